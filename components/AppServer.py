@@ -0,0 +1,178 @@
+"""AppServer() class aims to serve a flask app of DesFaaS with a production server.
+
+Typical usage example:
+
+    server = AppServer(app, 8054, "state_manager")
+    server.background(thread_function)
+    server.on_shutdown(flush_function)
+    server.serve()
+"""
+import fcntl
+import signal
+import sys
+import threading
+import time
+
+from flask import g, jsonify, request
+
+# The production server is an optional dependency, the flask development server is used without it.
+try:
+    import gunicorn.app.base as gunicorn_base
+except ImportError:
+    gunicorn_base = None
+
+# config.py
+SERVE_MODE = "gunicorn"
+SERVE_HOST = "0.0.0.0"
+SERVE_WORKERS = 1
+SERVE_THREADS = 16
+SERVE_TIMEOUT = 60
+SERVE_GRACEFUL_TIMEOUT = 30
+SERVE_SLOW_REQUEST = 1.0
+SERVE_LOCK_DIR = "/tmp"
+
+class AppServer:
+    """Serve a flask app with gunicorn worker processes and threads, or with the flask development
+    server if SERVE_MODE is "dev" or gunicorn is not installed.
+
+    Every request is timed and the time is returned in the Server-Timing header. Background
+    threads run exactly once among the worker processes: each worker waits on a file lock per
+    thread function, so the thread is taken over by another worker if its owner exits, and a
+    worker draining during a reload never runs it beside its replacement. Shutdown functions run
+    when a worker stops on SIGTERM or SIGINT.
+
+    The state manager and the state monitor keep their state in process memory, so they must run
+    a single worker and scale with SERVE_THREADS.
+
+    Attributes:
+        app: the flask app.
+        port: the port the app is served on.
+        name: the daemon name, used to name the lock files.
+        timings: a dict with url rules as keys and [count, total seconds, max seconds] as values.
+    """
+
+    def __init__(self,app,port,name):
+        """Initial the AppServer class and install the request timing hooks."""
+        self.app = app
+        self.port = port
+        self.name = name
+        self.thread_functions = []
+        self.shutdown_functions = []
+        self.lock_files = []
+        self.timings = {}
+        self.timings_lock = threading.Lock()
+        self.stopped = False
+
+        app.before_request(self.request_start)
+        app.after_request(self.request_end)
+        app.add_url_rule('/server_timing_get','server_timing_get',self.timing_get,methods=['GET'])
+
+    def request_start(self):
+        """Record the start time of a request."""
+        g.request_start_time = time.perf_counter()
+
+    def request_end(self,response):
+        """Record the duration of a request and return it in the Server-Timing header."""
+        duration = time.perf_counter() - g.get("request_start_time",time.perf_counter())
+        rule = request.url_rule.rule if request.url_rule else request.path
+        with self.timings_lock:
+            timing = self.timings.setdefault(rule,[0, 0.0, 0.0])
+            timing[0] += 1
+            timing[1] += duration
+            timing[2] = max(timing[2], duration)
+        if duration > SERVE_SLOW_REQUEST:
+            print(f"Slow request: {request.method} {request.path} {duration:.3f}s") # Error handling
+        response.headers["Server-Timing"] = f"app;dur={duration * 1000:.2f}"
+        return response
+
+    def timing_get(self):
+        """The interface to get the request count and durations of every route in this worker."""
+        with self.timings_lock:
+            return jsonify({rule: {"count": count, "avg": total / count, "max": max_time}
+                            for rule, (count, total, max_time) in self.timings.items()}),200
+
+    def background(self,thread_function,once=True):
+        """Register a background thread function started in the workers when serving.
+
+        Args:
+            thread_function: the function run by the thread.
+            once: run the function in one worker at a time, False to run it in every worker, such
+                    as a consumer of a queue local to the worker.
+        """
+        self.thread_functions.append((thread_function, once))
+
+    def on_shutdown(self,shutdown_function):
+        """Register a function run when the worker stops, such as flushing buffered writes."""
+        self.shutdown_functions.append(shutdown_function)
+
+    def start_background(self):
+        """Start a thread per background function, waiting for its lock before running it."""
+        for thread_function, once in self.thread_functions:
+            thread = threading.Thread(target=self.run_locked if once else thread_function,
+                                      args=(thread_function,) if once else ())
+            thread.daemon = True
+            thread.start()
+
+    def run_locked(self,thread_function):
+        """Run a background function once its lock among the workers is acquired."""
+        lock_path = f"{SERVE_LOCK_DIR}/desfaas-{self.name}-{self.port}-{thread_function.__name__}.lock"
+        lock_file = open(lock_path,'w')
+        fcntl.flock(lock_file,fcntl.LOCK_EX) # Released by the operating system when the worker exits
+        self.lock_files.append(lock_file)
+        thread_function()
+
+    def shutdown(self,*args):
+        """Run the shutdown functions once."""
+        if self.stopped:
+            return
+        self.stopped = True
+        for shutdown_function in self.shutdown_functions:
+            try:
+                shutdown_function()
+            except Exception as e:
+                print(f"Shutdown error: {e}") # Error handling
+
+    def serve(self):
+        """Serve the app until it is stopped."""
+        if SERVE_MODE == "gunicorn" and gunicorn_base is not None:
+            self.serve_gunicorn()
+        else:
+            self.serve_dev()
+
+    def serve_dev(self):
+        """Serve the app with the threaded flask development server."""
+        def stop(signum,frame):
+            self.shutdown()
+            sys.exit(0)
+        signal.signal(signal.SIGTERM,stop)
+        self.start_background()
+        try:
+            self.app.run(host=SERVE_HOST,port=self.port,threaded=True)
+        finally:
+            self.shutdown()
+
+    def serve_gunicorn(self):
+        """Serve the app with gunicorn threaded workers, stopping them gracefully on SIGTERM."""
+        server = self
+        options = {
+            "bind": f"{SERVE_HOST}:{self.port}",
+            "workers": SERVE_WORKERS,
+            "threads": SERVE_THREADS,
+            "worker_class": "gthread",
+            "timeout": SERVE_TIMEOUT,
+            "graceful_timeout": SERVE_GRACEFUL_TIMEOUT,
+            "post_worker_init": lambda worker: server.start_background(),
+            "worker_exit": lambda arbiter, worker: server.shutdown(),
+        }
+
+        class GunicornApplication(gunicorn_base.BaseApplication):
+            """Run the app object directly instead of importing it from a module path."""
+
+            def load_config(self):
+                for key, value in options.items():
+                    self.cfg.set(key,value)
+
+            def load(self):
+                return server.app
+
+        GunicornApplication().run()
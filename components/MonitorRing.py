@@ -0,0 +1,128 @@
+"""MonitorRing() class aims to route the requests about a state to the state monitor partition owning it.
+
+Typical usage example:
+
+    mr = MonitorRing()
+    shard = mr.shard(function_name)
+    res = mr.request(transport, "GET", f"primary_state_search/{function_name}", function_name)
+"""
+import bisect
+import hashlib
+import socket
+import threading
+import time
+
+# config.py
+MASTER_IP = ""
+STATE_MONITOR_SHARDS = []
+STATE_MONITOR_VNODES = 64
+STATE_MONITOR_FAILOVER_SECONDS = 10.0
+
+class MonitorRing:
+    """A consistent hash ring of the state monitor partitions, every partition served by a primary
+    monitor and a standby monitor.
+
+    Every partition is placed on the ring at STATE_MONITOR_VNODES points hashed from the ip of its
+    primary monitor, and a state belongs to the partition of the first point after the hash of its
+    name, so adding a partition only moves the states of its new points. A request is sent to the
+    primary monitor of the partition, and to the standby if the primary fails, the failed monitor
+    being skipped for STATE_MONITOR_FAILOVER_SECONDS. A standby answers changes with 503, it is
+    not marked failed for it and the change is left for the sender to retry on the primary.
+
+    Attributes:
+        shards: a list of the partitions, each a list of the primary and standby monitor ips.
+        points: the sorted hashes of the ring points.
+        owners: the partition index of every ring point.
+        down: a dict with the ips of the failed monitors as keys and the time to retry them as values.
+    """
+
+    def __init__(self,shards=STATE_MONITOR_SHARDS,vnodes=STATE_MONITOR_VNODES):
+        """Initial the MonitorRing class and place the partitions on the ring.
+
+        Args:
+            shards: the partitions, a single monitor on MASTER_IP if empty.
+            vnodes: the number of ring points of every partition.
+        """
+        self.shards = [list(monitors) for monitors in shards] or [[MASTER_IP]]
+        ring = sorted((self.hash(f"{monitors[0]}#{vnode}"), index)
+                      for index, monitors in enumerate(self.shards) for vnode in range(vnodes))
+        self.points = [point for point, index in ring]
+        self.owners = [index for point, index in ring]
+        self.down = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def hash(key):
+        """Hash a key to a 64 bits integer, the same in every process."""
+        return int.from_bytes(hashlib.md5(key.encode()).digest()[:8],"big")
+
+    def shard(self,function_name):
+        """Find the partition index owning a state."""
+        position = bisect.bisect(self.points,self.hash(function_name)) % len(self.points)
+        return self.owners[position]
+
+    def monitors(self,shard):
+        """List the monitors of a partition, the ones not marked failed first."""
+        now = time.time()
+        with self.lock:
+            return sorted(self.shards[shard],key=lambda monitor_ip: self.down.get(monitor_ip,0) > now)
+
+    def mark_down(self,monitor_ip):
+        """Skip a failed monitor for STATE_MONITOR_FAILOVER_SECONDS."""
+        with self.lock:
+            self.down[monitor_ip] = time.time() + STATE_MONITOR_FAILOVER_SECONDS
+
+    def locate(self):
+        """Find the partition and the role of the monitor running on this machine.
+
+        Returns:
+            A tuple of the partition index and "primary" or "standby", or (None, None) if no
+            monitor ip of the ring is an address of this machine.
+        """
+        for index, monitors in enumerate(self.shards):
+            for role, monitor_ip in zip(("primary", "standby"),monitors):
+                try:
+                    with socket.socket(socket.AF_INET,socket.SOCK_DGRAM) as sock:
+                        sock.bind((monitor_ip,0)) # Only succeeds for a local address
+                    return index, role
+                except OSError:
+                    continue
+        return None, None
+
+    def shard_request(self,transport,shard,method,path,**kwargs):
+        """Send a request to a partition, failing over to its standby monitor.
+
+        Args:
+            transport: the object sending the request, such as a requests session.
+            shard: the partition index.
+            method: "GET" or "POST".
+            path: the url path on the monitor.
+            kwargs: other arguments passed to the transport, such as json.
+
+        Returns:
+            The response of the first monitor answering without a server error.
+        """
+        error = None
+        for monitor_ip in self.monitors(shard):
+            try:
+                res = transport.request(method,f"http://{monitor_ip}:8053/{path}",**kwargs)
+                if res.status_code < 500:
+                    return res
+                error = Exception(f"{monitor_ip} answered {res.status_code}")
+                if res.status_code == 503:
+                    continue # A standby refusing a change
+            except Exception as e:
+                error = e
+            self.mark_down(monitor_ip)
+        raise error
+
+    def request(self,transport,method,path,function_name,**kwargs):
+        """Send a request about a state to the partition owning it."""
+        return self.shard_request(transport,self.shard(function_name),method,path,**kwargs)
+
+    def stats(self):
+        """Acquire the partitions and the monitors currently skipped."""
+        now = time.time()
+        with self.lock:
+            return {"shards": self.shards,
+                    "down": [monitor_ip for monitor_ip, until in self.down.items() if until > now]}
@@ -27,6 +27,25 @@ WORKER_NODES_PASSWORD = ""
 WORKER_NODES_PORT = 22
 
 WORKER_STATE_DISK_PATH = ""
+WORKER_STATE_DISK_ENGINE = "sqlite"     # "sqlite" (WAL database with batched commits), "json" (one file per state) or "mmap" (json files read through memory maps)
+STATE_DISK_DURABLE = True               # commit every sqlite disk tier write before it returns, False to batch them and lose the last ones on a crash
+STATE_MMAP_MIN_BYTES = 1024 * 1024      # "mmap" engine replicas above this size are streamed without parsing
+STATE_DISK_FLUSH_INTERVAL = 0.5         # seconds between batched commits of the disk tier
+STATE_DISK_FLUSH_BATCH = 64             # buffered writes which trigger an early commit
+STATE_DISK_COMPACT_INTERVAL = 3600      # seconds between compactions of the disk tier
+WORKER_STATE_MEMORY_BUDGET = 256 * 1024 * 1024  # bytes of state replicas kept in the memory tier
+WORKER_STATE_MEMORY_POLICY = "lru"      # memory tier eviction policy, "lru", "lfu" or "tinylfu"
+STATE_HOT_MAX_BYTES = 64 * 1024         # largest state replica which can be scheduled hot
+STATE_HOT_WINDOW = 120                  # seconds window of the accesses turning a state hot
+STATE_HOT_ACCESSES = 10                 # accesses in the window turning a state hot
+STATE_HOT_RECHECK_SECONDS = 30          # seconds between checks whether a hot state cooled down
+STATE_WARM_IDLE_SECONDS = 60            # idle seconds before a warm state is moved from memory to disk
+STATE_COLD_IDLE_SECONDS = 1000000       # idle seconds before a state turns cold
+STATE_PROMOTE_DELAY = 1.0               # seconds after an access to check whether the state turns hot
+STATE_ACCESS_BUCKET_SECONDS = 10        # length of one access counting bucket
+STATE_ACCESS_BUCKETS = 60               # buckets in the ring, the longest countable window is their total length
+STATE_ACCESS_WINDOWS = [60, 120, 600]   # windows in seconds reported by /state_access_rate_get
+STATE_ACCESS_EWMA_TAU = 60.0            # seconds time constant of the decayed access rate
 WORKER_CHECKPOINT_DISK_PATH = ""
 
 EXTERNAL_IMAGE_STORAGE = ""
@@ -36,6 +55,70 @@ EXTERNAL_STATE_SERVER_USERNAME = ""
 EXTERNAL_STATE_SERVER_PASSWORD = ""
 PORT = 22
 EXTERNAL_STATE_SERVER_STORAGE_PATH = ""
+STATE_EXTERNAL_RECONCILE_INTERVAL = 300   # seconds between reconciliations of the monitor's external storage catalog
+STATE_EVICT_WORKERS = 16                  # threads of the monitor removing cold state replicas
+STATE_EVICT_PER_NODE = 2                  # removals running on one worker VM at a time
+STATE_EVICT_RETRIES = 3                   # retries of a failed removal
+STATE_EVICT_BACKOFF = 1.0                 # seconds before the first retry, doubled for every next one
+STATE_EVICT_SWEEP_TIMEOUT = 300.0        # seconds a sweep waits for its removals, the ones not started are left to the next sweep
+STATE_BOOTSTRAP_TIMEOUT = 3.0             # seconds the monitor waits for the worker VMs at bootstrap
+STATE_REMOVE_TIMEOUT = 120.0              # seconds the monitor waits for a state manager to remove a replica, uploads included
+STATE_REPLICATE_TIMEOUT = 30.0            # seconds the monitor waits for a state manager to pull a replica
+STATE_RECONCILE_MAX_DELAY = 60.0          # maximum seconds between the retries of the worker VMs missed at bootstrap
+STATE_CATALOG_PATH = ""                    # directory of the monitor's catalog journal and snapshots, "" disables them
+STATE_CATALOG_FSYNC_INTERVAL = 0.2        # seconds between fsyncs of the catalog journal
+STATE_CATALOG_SNAPSHOT_INTERVAL = 300     # seconds between snapshots of the catalog
+STATE_CATALOG_SNAPSHOT_RECORDS = 100000   # journal records which trigger an early snapshot
+STATE_MONITOR_SHARDS = []                 # state monitor partitions as [primary ip, standby ip] lists, [] means one monitor on MASTRE_IP
+STATE_MONITOR_VNODES = 64                 # points of every partition on the consistent hash ring
+STATE_MONITOR_FAILOVER_SECONDS = 10.0     # seconds a failed monitor is skipped for its standby
+STATE_MONITOR_REPLICATE_INTERVAL = 0.2    # seconds between shipments of catalog changes to the standby monitor
+STATE_MONITOR_REPLICATE_BATCH = 1024      # catalog changes shipped in one request
+STATE_MONITOR_REPLICATE_QUEUE_MAX = 100000  # catalog changes queued for an unreachable standby before a full copy is sent instead
+STATE_PLACEMENT_ENABLED = True            # place state replicas from the access rates reported by the state managers
+STATE_PLACEMENT_INTERVAL = 60             # seconds between placement rounds
+STATE_PLACEMENT_CREATE_RATE = 0.05        # reads per second on a node which get a replica created there
+STATE_PLACEMENT_DROP_RATE = 0.001         # reads per second on a node below which its slave replica is dropped
+STATE_PLACEMENT_WRITE_COST = 0.5          # cost of replicating a write to a replica, relative to a remote read
+STATE_PLACEMENT_PRIMARY_RATE = 0.05       # writes per second from a node needed to move the primary replica there
+STATE_PLACEMENT_PRIMARY_RATIO = 2.0       # how many times more than the primary's node a node must write to take the primary
+STATE_PLACEMENT_MIN_REPLICAS = 1          # replicas of a state never dropped by the placement
+STATE_PLACEMENT_MAX_REPLICAS = 0          # replicas of a state beyond which none is created, 0 for no limit
+STATE_PLACEMENT_MAX_ACTIONS = 32          # replicas created, dropped or made primary in one round
+
+# state access transport config
+STATE_HTTP_POOL_CONNECTIONS = 16    # number of peers whose keep-alive pools are cached
+STATE_HTTP_POOL_MAXSIZE = 32        # keep-alive connections kept to one peer
+STATE_HTTP_CONNECT_TIMEOUT = 1.0    # seconds
+STATE_HTTP_READ_TIMEOUT = 10.0      # seconds
+
+# state replica fanout config
+STATE_FANOUT_WORKERS = 16   # threads sending lock/unlock requests to replicas
+STATE_FANOUT_TIMEOUT = 5.0  # seconds to wait for one replica
+STATE_FANOUT_QUORUM = 0     # replica acknowledgements needed, 0 means all replicas
+STATE_REPLICATION_MODE = "delta"    # "delta" sends patches to slave replicas, "full" sends the whole value
+STATE_PRIMARY_CACHE_TTL = 10.0      # seconds a state manager caches the primary replica location
+STATE_REPORT_FLUSH_INTERVAL = 0.5   # seconds between batched reports from a state manager to the monitor
+STATE_REPORT_BATCH = 128            # queued reports which trigger an early flush
+STATE_REPORT_QUEUE_MAX = 100000     # queued reports kept while the monitor is unreachable
+STATE_WIRE_FORMAT = "application/json"  # or "application/msgpack" / "application/cbor" between state managers
+STATE_COMPRESS_MIN_BYTES = 64 * 1024    # state payloads above this size are compressed with zstd or lz4
+
+# state lock config
+STATE_LOCK_TTL = 30.0               # seconds a state lock lease lasts without renewal
+STATE_LOCK_WAIT_TIMEOUT = 10.0      # seconds to wait for a state lock
+STATE_LOCK_REAP_INTERVAL = 1.0      # seconds between releasing expired leases
+STATE_MAP_SHARDS = 16               # shards, each with its own lock, of the state manager's state maps
+
+# daemon serving config
+SERVE_MODE = "gunicorn"             # "gunicorn" (production server) or "dev" (flask development server)
+SERVE_HOST = "0.0.0.0"              # address the daemons listen on
+SERVE_WORKERS = 1                   # worker processes, keep 1 for the state manager and state monitor
+SERVE_THREADS = 16                  # request threads per worker process
+SERVE_TIMEOUT = 60                  # seconds a silent worker runs before it is restarted
+SERVE_GRACEFUL_TIMEOUT = 30         # seconds to finish in-flight requests on shutdown
+SERVE_SLOW_REQUEST = 1.0            # requests slower than this many seconds are logged
+SERVE_LOCK_DIR = "/tmp"             # directory of the locks running background threads once
 
 
 # Scheduling Strategy
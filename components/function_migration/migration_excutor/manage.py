@@ -7,8 +7,10 @@ from flask import Flask, request, jsonify
 
 from .app import CheckpointExcutor
 from .app import RestoreExcutor
+from ... import AppServer
 
 app = Flask(__name__)
+SERVER = AppServer(app,8052,"migration_excutor")
 
 @app.route('/checkpoint', methods=['POST'])
 def checkpoint():
@@ -21,4 +23,4 @@ def restore():
     return jsonify(RestoreExcutor(request.get_json())),200
 
 if __name__ == '__main__':
-    app.run(port=8052) # Run flask app
+    SERVER.serve() # Run flask app
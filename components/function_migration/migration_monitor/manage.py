@@ -5,10 +5,12 @@ start the migration monitor.
 from flask import Flask, request, jsonify
 
 from .app import MigrationMonitor
+from ... import AppServer
 
 # init flask app and MonitorMonitor class
 app = Flask(__name__)
 MM = MigrationMonitor()
+SERVER = AppServer(app,8055,"migration_monitor")
 
 @app.route('/node_pods_utilization',methods=['GET'])
 def node_pod_cpu_utilization():
@@ -36,4 +38,4 @@ def function_recent_call_times(function_name):
     return jsonify(MM.function_recent_call_times(function_name)),200   
 
 if __name__ == '__main__': 
-    app.run(port=8055) # run flask app
+    SERVER.serve() # run flask app
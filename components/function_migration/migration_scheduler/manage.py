@@ -9,10 +9,12 @@ import time
 from .app import CheckpointManager
 from .app import RestoreManager
 from .app import MigrationScheduler
+from ... import AppServer
 
 # Initialize the global dependency
 app = Flask(__name__)
 MS = MigrationScheduler()
+SERVER = AppServer(app,8051,"migration_scheduler")
 PENDING_CHECKPOINTS = queue.Queue()
 PENDING_RESTORES = queue.Queue()
 
@@ -52,9 +54,9 @@ def descision_request():
     return jsonify(PENDING_CHECKPOINTS.put(MS.checkpoint_info_build(request.get_json()))),200
 
 if __name__ == '__main__':
-    # Run 2 prcessing threadings.
-    MS.run_thread(process_checkpoint)
-    MS.run_thread(process_restore)
+    # Run 2 prcessing threadings in every worker, consuming the queues of the worker.
+    SERVER.background(process_checkpoint,once=False)
+    SERVER.background(process_restore,once=False)
     
     # Run flask app.
-    app.run(port=8051)
+    SERVER.serve()
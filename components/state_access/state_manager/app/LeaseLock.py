@@ -0,0 +1,233 @@
+"""LeaseLock() class aims to provide a state lock which expires automatically.
+
+Typical usage example:
+
+    lock = LeaseLock()
+    token = lock.acquire()
+    lock.renew(token)
+    lock.release(token)
+"""
+import collections
+import ipaddress
+import threading
+import time
+
+# config.py
+STATE_LOCK_TTL = 30.0
+STATE_LOCK_WAIT_TIMEOUT = 10.0
+
+class LeaseLock:
+    """A lock granted as a lease with a time-to-live, so a state locked by a crashed function is
+    released when the lease expires instead of being locked forever.
+
+    Waiters are granted the lock in FIFO order and every local grant carries a fencing token larger
+    than all the tokens issued or adopted before, so a write from a holder whose lease expired can
+    be detected. Replicas locked by another manager adopt the token of that manager's lease.
+
+    A token is a 64 bits integer, the epoch of the grant in its high 32 bits and the IPv4 address of
+    the granting node in its low 32 bits, so two managers never issue the same token. The epoch is
+    the current second, or the last epoch seen by the lock plus one if it is not behind, so the
+    tokens of a restarted manager still follow the ones it issued before.
+
+    Attributes:
+        node: the IPv4 address of this node as an integer, set once by the state manager.
+        ttl: the default lease length in seconds.
+        holder: the fencing token of the current lease, None if the lock is free.
+        reading: True if the current lease is held by an unlocked read, not by a writer.
+        expire_time: the time the current lease expires.
+        fence: the largest fencing token issued or adopted by this lock.
+        waiters: the FIFO queue of tickets waiting for the lock.
+    """
+    node = 0
+
+    def __init__(self,ttl=STATE_LOCK_TTL):
+        """Initial the LeaseLock class."""
+        self.ttl = ttl
+        self.condition = threading.Condition()
+        self.holder = None
+        self.reading = False
+        self.expire_time = None
+        self.acquire_time = None
+        self.fence = 0
+        self.waiters = collections.deque()
+
+        # Contention statistics
+        self.acquire_count = 0
+        self.timeout_count = 0
+        self.expired_count = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+        self.hold_time_total = 0.0
+        self.hold_time_max = 0.0
+
+    def acquire(self,timeout=STATE_LOCK_WAIT_TIMEOUT,ttl=None,token=None,read=False):
+        """Wait in FIFO order for the lock and take a lease on it.
+
+        Args:
+            timeout: the maximum seconds to wait for the lock.
+            ttl: the lease length, the default ttl is used if None.
+            token: the fencing token issued by the lock on another replica, adopted as the
+                    token of this lease.
+            read: True for the brief lease of an unlocked read, which does not exclude writers.
+
+        Returns:
+            The fencing token of the lease, or None if the lock was not acquired in time.
+        """
+        ticket = object()
+        start_time = time.time()
+        deadline = start_time + timeout
+        with self.condition:
+            self.waiters.append(ticket)
+            while True:
+                self._expire()
+                if self.holder is None and self.waiters[0] is ticket:
+                    break
+
+                # Give up waiting and let the next waiter try.
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    self.waiters.remove(ticket)
+                    self.timeout_count += 1
+                    self.condition.notify_all()
+                    return None
+
+                # Wake up at the latest when the current lease expires.
+                if self.expire_time is not None:
+                    remaining = min(remaining, max(self.expire_time - time.time(), 0.001))
+                self.condition.wait(remaining)
+
+            # Grant the lease
+            self.waiters.popleft()
+            if token is None:
+                epoch = max((self.fence >> 32) + 1, int(time.time()))
+                self.fence = (epoch << 32) | LeaseLock.node
+                self.holder = self.fence
+            else:
+                self.fence = max(self.fence, token)
+                self.holder = token
+            self.reading = read
+            self.acquire_time = time.time()
+            self.expire_time = self.acquire_time + (ttl or self.ttl)
+
+            # Record the waiting time
+            wait_time = self.acquire_time - start_time
+            self.acquire_count += 1
+            self.wait_time_total += wait_time
+            self.wait_time_max = max(self.wait_time_max, wait_time)
+            return self.holder
+
+    def release(self,token=None):
+        """Release the lease.
+
+        Args:
+            token: the fencing token of the lease, nothing is released if None.
+
+        Returns:
+            True if the lease was released, False if it was not held or held with another token.
+        """
+        with self.condition:
+            if self.holder is None or token is None or token != self.holder:
+                return False
+            self._free()
+            return True
+
+    def renew(self,token,ttl=None):
+        """Extend the lease of the current holder.
+
+        Args:
+            token: the fencing token of the lease.
+            ttl: the new lease length from now, the default ttl is used if None.
+
+        Returns:
+            True if the lease was renewed, False if it had expired or is held by another token.
+        """
+        with self.condition:
+            self._expire()
+            if self.holder is None or token != self.holder:
+                return False
+            self.expire_time = time.time() + (ttl or self.ttl)
+            return True
+
+    def locked(self):
+        """Check whether an unexpired lease is held."""
+        with self.condition:
+            self._expire()
+            return self.holder is not None
+
+    def write_locked(self):
+        """Check whether an unexpired lease is held by a writer, not by an unlocked read."""
+        with self.condition:
+            self._expire()
+            return self.holder is not None and not self.reading
+
+    def stale(self,token):
+        """Check whether a fencing token belongs to a lease which has been taken over.
+
+        Returns:
+            True if another lease is held, or the lock was granted again after the token's lease.
+        """
+        with self.condition:
+            self._expire()
+            if self.holder is not None:
+                return self.holder != token
+            return token < self.fence
+
+    def reap(self):
+        """Release the lease if it has expired.
+
+        Returns:
+            True if an expired lease was released.
+        """
+        with self.condition:
+            return self._expire()
+
+    def stats(self):
+        """Acquire the lease and contention statistics of the lock.
+
+        Returns:
+            A dict containing the holder, the waiters and the waiting and holding times.
+        """
+        with self.condition:
+            self._expire()
+            now = time.time()
+            return {
+                "locked": self.holder is not None,
+                "token": self.holder,
+                "expires_in": self.expire_time - now if self.holder is not None else None,
+                "held_for": now - self.acquire_time if self.holder is not None else None,
+                "waiters": len(self.waiters),
+                "acquire_count": self.acquire_count,
+                "timeout_count": self.timeout_count,
+                "expired_count": self.expired_count,
+                "wait_time_avg": self.wait_time_total / self.acquire_count if self.acquire_count else 0.0,
+                "wait_time_max": self.wait_time_max,
+                "hold_time_avg": self.hold_time_total / self.acquire_count if self.acquire_count else 0.0,
+                "hold_time_max": self.hold_time_max,
+            }
+
+    @staticmethod
+    def node_set(node_ip):
+        """Set the node part of the tokens issued by the locks of this process."""
+        try:
+            LeaseLock.node = int(ipaddress.IPv4Address(node_ip))
+        except ValueError:
+            LeaseLock.node = 0
+
+    def _expire(self):
+        """Free the lock if the lease has expired, the condition must be held."""
+        if self.holder is not None and time.time() >= self.expire_time:
+            self.expired_count += 1
+            self._free()
+            return True
+        return False
+
+    def _free(self):
+        """Free the lock and wake up the waiters, the condition must be held."""
+        hold_time = time.time() - self.acquire_time
+        self.hold_time_total += hold_time
+        self.hold_time_max = max(self.hold_time_max, hold_time)
+        self.holder = None
+        self.reading = False
+        self.expire_time = None
+        self.acquire_time = None
+        self.condition.notify_all()
@@ -0,0 +1,128 @@
+"""MonitorReporter() class aims to send the state membership and temperature reports to the monitor in batches.
+
+Typical usage example:
+
+    mr = MonitorReporter(transport, ring)
+    mr.report("add", function_name)
+    mr.report("activity", function_name, 1)
+    so.run_thread(mr.flush_manager)
+"""
+import collections
+import threading
+
+# config.py
+STATE_REPORT_FLUSH_INTERVAL = 0.5
+STATE_REPORT_BATCH = 128
+STATE_REPORT_QUEUE_MAX = 100000
+
+class MonitorReporter:
+    """Queue the reports of a state manager to the state monitor and post them in one request
+    per batch, so a state read or write does not wait for a round trip to the master.
+
+    Reports are sent in the order they were made, and a temperature report superseded by a later
+    one of the same state is dropped before sending. A batch is split by the monitor partition
+    owning every reported state, and the reports of a partition which could not be reached are
+    queued again without holding back the other partitions. The creation of a replica flushes
+    the queue at once, so the monitor knows the primary replica of a new state before its first write.
+
+    Attributes:
+        transport: the pooled HTTP transport posting the batches.
+        ring: the MonitorRing routing every report to its monitor partition.
+        queue: the reports waiting to be sent, as dicts containing "type", "name" and "activity".
+        flush_event: set when a full batch is queued to flush it before the interval.
+    """
+
+    def __init__(self,transport,ring):
+        """Initial the MonitorReporter class."""
+        self.transport = transport
+        self.ring = ring
+        self.queue = collections.deque()
+        self.queue_lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.flush_event = threading.Event()
+        self.sent = 0
+        self.dropped = 0
+
+    def report(self,report_type,function_name,activity=None):
+        """Queue a report without waiting for the monitor.
+
+        Args:
+            report_type: "add" or "delete" for membership changes, "activity" for temperatures,
+                    "external_add" or "external_delete" for external storage changes.
+            function_name: the reported state name.
+            activity: the new temperature of an "activity" report.
+        """
+        with self.queue_lock:
+            # Drop the oldest reports rather than growing without bound while the monitor is down.
+            if len(self.queue) >= STATE_REPORT_QUEUE_MAX:
+                self.queue.popleft()
+                self.dropped += 1
+            self.queue.append({"type": report_type, "name": function_name, "activity": activity})
+            if len(self.queue) >= STATE_REPORT_BATCH:
+                self.flush_event.set()
+
+    def coalesce(self,batch):
+        """Drop the temperature reports superseded by a later one of the same state.
+
+        Returns:
+            The list of remaining reports in order.
+        """
+        last_activity = {}
+        for index, msg in enumerate(batch):
+            if msg["type"] == "activity":
+                if msg["name"] in last_activity:
+                    batch[last_activity[msg["name"]]] = None
+                last_activity[msg["name"]] = index
+            else:
+                last_activity.pop(msg["name"],None)
+        return [msg for msg in batch if msg is not None]
+
+    def flush(self):
+        """Post the queued reports to their monitor partitions, putting back the reports of the
+        partitions whose post fails. One flush runs at a time so the reports keep their order."""
+        with self.flush_lock:
+            self._flush()
+
+    def _flush(self):
+        """Post the queued reports, the flush_lock must be held."""
+        with self.queue_lock:
+            batch = list(self.queue)
+            self.queue.clear()
+        if not batch:
+            return
+
+        shard_batches = {}
+        for msg in self.coalesce(batch):
+            shard_batches.setdefault(self.ring.shard(msg["name"]),[]).append(msg)
+
+        failed = []
+        error = None
+        for shard, shard_batch in shard_batches.items():
+            try:
+                res = self.ring.shard_request(self.transport,shard,"POST","state_report_batch",json={"reports": shard_batch})
+                res.raise_for_status()
+                self.sent += len(shard_batch)
+            except Exception as e:
+                failed.extend(shard_batch)
+                error = e
+
+        if failed:
+            # Resend in order before the reports queued in between.
+            with self.queue_lock:
+                self.queue.extendleft(reversed(failed))
+            raise error
+
+    def flush_manager(self):
+        """Flush the queued reports periodically, or as soon as a full batch is queued."""
+        while True:
+            self.flush_event.wait(STATE_REPORT_FLUSH_INTERVAL)
+            self.flush_event.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Thread error: {e}") # Error handling
+
+    def stats(self):
+        """Acquire the queued, sent and dropped report counts."""
+        with self.queue_lock:
+            return {"queued": len(self.queue), "sent": self.sent, "dropped": self.dropped}
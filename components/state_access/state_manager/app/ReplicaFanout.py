@@ -0,0 +1,100 @@
+"""ReplicaFanout() class aims to send the same request to several state replicas concurrently.
+
+Typical usage example:
+
+    rf = ReplicaFanout()
+    report = rf.fanout(nodes_list, lambda node_ip, timeout: send_request(node_ip, timeout))
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# config.py
+STATE_FANOUT_WORKERS = 16
+STATE_FANOUT_TIMEOUT = 5.0
+STATE_FANOUT_QUORUM = 0
+
+class ReplicaFanout:
+    """Propagate lock and unlock requests to the replicas in parallel and return as soon as
+    a quorum of replicas acknowledged, the stragglers are finished in the background.
+
+    Attributes:
+        executor: the thread pool sending the requests.
+        timeout: seconds to wait for one replica.
+        quorum: the number of replica acknowledgements needed, 0 means all replicas.
+    """
+
+    def __init__(self,max_workers=STATE_FANOUT_WORKERS,timeout=STATE_FANOUT_TIMEOUT,quorum=STATE_FANOUT_QUORUM):
+        """Initial the ReplicaFanout class and its thread pool."""
+        self.executor = ThreadPoolExecutor(max_workers=max_workers,thread_name_prefix="replica-fanout")
+        self.timeout = timeout
+        self.quorum = quorum
+
+    def fanout(self,nodes_list,send,quorum=None):
+        """Send a request to every replica concurrently.
+
+        Args:
+            nodes_list: the ip addresses of the replicas.
+            send: a function called as send(node_ip, timeout) which sends the request to one replica
+                    and returns the response.
+            quorum: the number of acknowledgements needed, the default quorum is used if None.
+
+        Returns:
+            A dict containing whether the quorum acknowledged, and the success and latency of every
+            replica. Replicas still running when the quorum is reached are reported as "pending".
+        """
+        # Compute the acknowledgements required.
+        quorum = self.quorum if quorum is None else quorum
+        required = len(nodes_list) if quorum <= 0 else min(quorum, len(nodes_list))
+
+        if not nodes_list:
+            return {"acknowledged": True, "quorum": 0, "replicas": {}}
+
+        # Send all requests at once.
+        futures = {}
+        for node_ip in nodes_list:
+            futures[self.executor.submit(self._send,send,node_ip)] = node_ip
+
+        # Wait until enough replicas acknowledged, all of them answered or the timeout expires.
+        deadline = time.time() + self.timeout
+        pending = set(futures)
+        acks = 0
+        while pending and acks < required:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            done, pending = wait(pending,timeout=remaining,return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.result()[0]:
+                    acks += 1
+
+        # Snapshot the report, the stragglers keep running in the background.
+        result = {"acknowledged": acks >= required, "quorum": required, "replicas": {}}
+        for future, node_ip in futures.items():
+            if future.done():
+                success, latency = future.result()
+                result["replicas"][node_ip] = {"status": "success" if success else "failed", "latency": latency}
+            else:
+                result["replicas"][node_ip] = {"status": "pending", "latency": None}
+                future.add_done_callback(lambda f, node_ip=node_ip: self._straggler_done(node_ip,f))
+        return result
+
+    def _send(self,send,node_ip):
+        """Send the request to one replica and measure its latency.
+
+        Returns:
+            A tuple of the success flag and the latency in seconds.
+        """
+        start_time = time.time()
+        try:
+            res = send(node_ip,self.timeout)
+            success = res.status_code < 400
+        except Exception as e:
+            print(f"Fanout to {node_ip} error: {e}") # Error handling
+            success = False
+        return success, time.time() - start_time
+
+    def _straggler_done(self,node_ip,future):
+        """Report a replica which failed after the quorum had been reached."""
+        success, latency = future.result()
+        if not success:
+            print(f"Fanout straggler {node_ip} failed after {latency:.3f}s") # Error handling
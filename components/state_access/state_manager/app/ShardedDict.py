@@ -0,0 +1,111 @@
+"""ShardedDict() class aims to provide a dict shared by request and background threads safely.
+
+Typical usage example:
+
+    sd = ShardedDict()
+    lock, created = sd.get_or_create(function_name, LeaseLock)
+    for function_name, value in sd.items():
+        ...
+"""
+import collections.abc
+import threading
+
+# config.py
+STATE_MAP_SHARDS = 16
+
+class ShardedDict(collections.abc.MutableMapping):
+    """A dict split into shards by key hash, each guarded by its own lock, so threads working on
+    different states rarely contend and check-then-insert sequences can be made atomic.
+
+    Iteration and the keys(), values() and items() views are snapshots taken shard by shard, so a
+    background loop never sees the dict change size while it iterates.
+
+    Attributes:
+        shards: the list of (dict, lock) pairs.
+    """
+
+    def __init__(self,shards=STATE_MAP_SHARDS):
+        """Initial the ShardedDict class."""
+        self.shards = [({}, threading.Lock()) for _ in range(shards)]
+
+    def _shard(self,key):
+        """Get the (dict, lock) pair holding a key."""
+        return self.shards[hash(key) % len(self.shards)]
+
+    def __getitem__(self,key):
+        data, lock = self._shard(key)
+        with lock:
+            return data[key]
+
+    def __setitem__(self,key,value):
+        data, lock = self._shard(key)
+        with lock:
+            data[key] = value
+
+    def __delitem__(self,key):
+        data, lock = self._shard(key)
+        with lock:
+            del data[key]
+
+    def __contains__(self,key):
+        data, lock = self._shard(key)
+        with lock:
+            return key in data
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return sum(len(data) for data, _ in self.shards)
+
+    def get(self,key,default=None):
+        data, lock = self._shard(key)
+        with lock:
+            return data.get(key,default)
+
+    def pop(self,key,*default):
+        data, lock = self._shard(key)
+        with lock:
+            return data.pop(key,*default)
+
+    def setdefault(self,key,default=None):
+        data, lock = self._shard(key)
+        with lock:
+            return data.setdefault(key,default)
+
+    def get_or_create(self,key,factory):
+        """Get the value of a key, creating it atomically if it is missing.
+
+        Args:
+            key: the key.
+            factory: the function creating the value, called only if the key is missing.
+
+        Returns:
+            A tuple of the value and whether it was created by this call.
+        """
+        data, lock = self._shard(key)
+        with lock:
+            if key in data:
+                return data[key], False
+            data[key] = factory()
+            return data[key], True
+
+    def keys(self):
+        """Snapshot the keys."""
+        return [key for key, _ in self.items()]
+
+    def values(self):
+        """Snapshot the values."""
+        return [value for _, value in self.items()]
+
+    def items(self):
+        """Snapshot the (key, value) pairs, each shard copied under its lock."""
+        pairs = []
+        for data, lock in self.shards:
+            with lock:
+                pairs.extend(data.items())
+        return pairs
+
+    def snapshot(self):
+        """Copy the dict to a plain dict."""
+        return dict(self.items())
@@ -0,0 +1,102 @@
+"""StateAccessRate() class aims to track the access frequency of a state replica in constant memory.
+
+Typical usage example:
+
+    sar = StateAccessRate()
+    sar.record()
+    accesses = sar.count(120)
+"""
+import math
+import threading
+import time
+
+# config.py
+STATE_ACCESS_BUCKET_SECONDS = 10
+STATE_ACCESS_BUCKETS = 60
+STATE_ACCESS_WINDOWS = [60, 120, 600]
+STATE_ACCESS_EWMA_TAU = 60.0
+
+class StateAccessRate:
+    """Count the accesses of a state replica in a ring of time buckets, so the memory is fixed and
+    an access is recorded in constant time however hot the state is.
+
+    The ring covers STATE_ACCESS_BUCKETS * STATE_ACCESS_BUCKET_SECONDS seconds, and a bucket left
+    from an older lap of the ring is cleared lazily when it is reused. An exponentially decayed
+    access rate is kept beside the buckets as a smooth signal.
+
+    Attributes:
+        epochs: the bucket epoch (time divided by the bucket length) counted by every slot.
+        counts: the number of accesses counted by every slot.
+        last_time: the time of the last access, None if never accessed.
+        ewma: the decayed access rate per second at last_time.
+    """
+
+    def __init__(self,bucket_seconds=STATE_ACCESS_BUCKET_SECONDS,buckets=STATE_ACCESS_BUCKETS,tau=STATE_ACCESS_EWMA_TAU):
+        """Initial the StateAccessRate class."""
+        self.bucket_seconds = bucket_seconds
+        self.epochs = [-1] * buckets
+        self.counts = [0] * buckets
+        self.tau = tau
+        self.last_time = None
+        self.ewma = 0.0
+        self.lock = threading.Lock()
+
+    def record(self,now=None):
+        """Count one access.
+
+        Args:
+            now: the access time, the current time if None.
+        """
+        now = time.time() if now is None else now
+        epoch = int(now // self.bucket_seconds)
+        slot = epoch % len(self.counts)
+        with self.lock:
+            # Reuse the slot of an older lap of the ring.
+            if self.epochs[slot] != epoch:
+                self.epochs[slot] = epoch
+                self.counts[slot] = 0
+            self.counts[slot] += 1
+
+            # Decay the rate to now and add the access.
+            if self.last_time is not None:
+                self.ewma *= math.exp(-max(now - self.last_time, 0) / self.tau)
+            self.ewma += 1 / self.tau
+            self.last_time = max(now, self.last_time or now)
+
+    def count(self,window,now=None):
+        """Count the accesses in the last window seconds, rounded to whole buckets.
+
+        Args:
+            window: the window length in seconds, at most the length of the ring.
+            now: the end of the window, the current time if None.
+
+        Returns:
+            The number of accesses.
+        """
+        now = time.time() if now is None else now
+        epoch = int(now // self.bucket_seconds)
+        oldest = epoch - max(math.ceil(window / self.bucket_seconds), 1)
+        with self.lock:
+            return sum(count for bucket_epoch, count in zip(self.epochs,self.counts) if oldest < bucket_epoch <= epoch)
+
+    def rate(self,now=None):
+        """Get the exponentially decayed access rate per second."""
+        now = time.time() if now is None else now
+        with self.lock:
+            if self.last_time is None:
+                return 0.0
+            return self.ewma * math.exp(-max(now - self.last_time, 0) / self.tau)
+
+    def snapshot(self,windows=STATE_ACCESS_WINDOWS,now=None):
+        """Summarize the access frequency over several windows.
+
+        Returns:
+            A dict containing the access counts with the window lengths as keys, the decayed rate
+            and the last access time.
+        """
+        now = time.time() if now is None else now
+        return {
+            "counts": {str(window): self.count(window,now) for window in windows},
+            "rate": self.rate(now),
+            "last_time": self.last_time,
+        }
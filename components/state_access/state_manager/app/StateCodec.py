@@ -0,0 +1,167 @@
+"""StateCodec() class aims to encode and decode state payloads in JSON or compact binary formats.
+
+Typical usage example:
+
+    sc = StateCodec()
+    body, headers = sc.encode(state_data, "application/msgpack", "zstd")
+    state_data = sc.decode(body, headers["Content-Type"], headers.get("X-State-Encoding"))
+"""
+import json
+
+# Binary formats and compressions are optional dependencies.
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+# config.py
+STATE_WIRE_FORMAT = "application/json"
+STATE_COMPRESS_MIN_BYTES = 64 * 1024
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+CBOR = "application/cbor"
+
+class StateCodec:
+    """Serialize state payloads in the format negotiated with the peer.
+
+    JSON is always available, MessagePack and CBOR are offered if msgpack or cbor2 is installed,
+    and bodies larger than STATE_COMPRESS_MIN_BYTES are compressed with zstd or lz4 if the peer
+    accepts it and the library is installed. The compression is announced in the X-State-Encoding
+    and X-State-Accept-Encoding headers rather than Content-Encoding, so HTTP clients do not
+    decompress the body transparently.
+
+    Attributes:
+        formats: a dict with the available content types as keys and (encode, decode) functions
+                as values.
+        compressions: a dict with the available content encodings as keys and (compress,
+                decompress) functions as values.
+        compress_min_bytes: the smallest body size which is compressed.
+    """
+
+    def __init__(self,compress_min_bytes=STATE_COMPRESS_MIN_BYTES):
+        """Initial the StateCodec class with the installed formats and compressions."""
+        self.formats = {JSON: (lambda obj: json.dumps(obj).encode(), lambda body: json.loads(body))}
+        if msgpack is not None:
+            self.formats[MSGPACK] = (lambda obj: msgpack.packb(obj,use_bin_type=True),
+                                     lambda body: msgpack.unpackb(body,raw=False))
+        if cbor2 is not None:
+            self.formats[CBOR] = (cbor2.dumps, cbor2.loads)
+
+        self.compressions = {}
+        if zstandard is not None:
+            self.compressions["zstd"] = (lambda body: zstandard.ZstdCompressor().compress(body),
+                                         lambda body: zstandard.ZstdDecompressor().decompress(body))
+        if lz4_frame is not None:
+            self.compressions["lz4"] = (lz4_frame.compress, lz4_frame.decompress)
+        self.compress_min_bytes = compress_min_bytes
+
+    def negotiate(self,accept):
+        """Choose the content type for a peer.
+
+        Args:
+            accept: the content types accepted by the peer in order of preference, or a single
+                    content type.
+
+        Returns:
+            The first accepted content type which is available, JSON if none is.
+        """
+        if isinstance(accept, str):
+            accept = [accept]
+        for content_type in accept or []:
+            if content_type in self.formats:
+                return content_type
+        return JSON
+
+    def negotiate_encoding(self,accept_encoding):
+        """Choose the compression for a peer.
+
+        Args:
+            accept_encoding: the content encodings accepted by the peer in order of preference.
+
+        Returns:
+            The first accepted compression which is available, None if none is.
+        """
+        if isinstance(accept_encoding, str):
+            accept_encoding = [token.split(";")[0].strip() for token in accept_encoding.split(",")]
+        for encoding in accept_encoding or []:
+            if encoding in self.compressions:
+                return encoding
+        return None
+
+    def encode(self,obj,content_type=JSON,content_encoding=None):
+        """Serialize a payload.
+
+        Args:
+            obj: the payload.
+            content_type: the requested content type, JSON is used if it is not available.
+            content_encoding: the requested compression, applied only above the size threshold.
+
+        Returns:
+            A tuple of the body bytes and the headers describing it.
+        """
+        content_type = self.negotiate(content_type)
+        body = self.formats[content_type][0](obj)
+        headers = {"Content-Type": content_type}
+        if content_encoding in self.compressions and len(body) >= self.compress_min_bytes:
+            body = self.compressions[content_encoding][0](body)
+            headers["X-State-Encoding"] = content_encoding
+        return body, headers
+
+    def decode(self,body,content_type=JSON,content_encoding=None):
+        """Deserialize a payload.
+
+        Args:
+            body: the body bytes.
+            content_type: the content type of the body, parameters such as charset are ignored.
+            content_encoding: the compression of the body, if any.
+
+        Returns:
+            The payload.
+        """
+        if content_encoding:
+            body = self.compressions[content_encoding][1](body)
+        content_type = (content_type or JSON).split(";")[0].strip()
+        if content_type not in self.formats:
+            content_type = JSON
+        return self.formats[content_type][1](body)
+
+    def request_kwargs(self,obj,content_type=STATE_WIRE_FORMAT):
+        """Build the requests arguments sending a payload to another state manager.
+
+        Args:
+            obj: the payload.
+            content_type: the wire format between state managers.
+
+        Returns:
+            A dict of keyword arguments for requests, with the encoded body and headers.
+        """
+        if self.negotiate(content_type) == JSON:
+            return {"json": obj}
+        body, headers = self.encode(obj,content_type,self.negotiate_encoding(list(self.compressions)))
+        headers["Accept"] = content_type
+        headers["X-State-Accept-Encoding"] = ", ".join(self.compressions)
+        return {"data": body, "headers": headers}
+
+    def response_decode(self,res):
+        """Deserialize the body of a requests response from another state manager.
+
+        Args:
+            res: the requests response object.
+
+        Returns:
+            The payload.
+        """
+        return self.decode(res.content,res.headers.get("Content-Type"),res.headers.get("X-State-Encoding"))
@@ -0,0 +1,117 @@
+"""StateDelta() class aims to compute and apply JSON-patch style differences between state values.
+
+Typical usage example:
+
+    sd = StateDelta()
+    patch = sd.diff(old_state_data, new_state_data)
+    state_data = sd.apply(old_state_data, patch)
+"""
+
+class StateDelta:
+    """Compute the structural difference of two JSON values as a list of "add", "remove" and
+    "replace" operations addressed by JSON pointers, and apply it to a copy of a replica's value.
+
+    JSON pointers address dict keys as strings, so a dict with keys of other types, which the
+    binary wire formats keep, is replaced as a whole instead of being patched key by key."""
+
+    def __init__(self):
+        """Initial the StateDelta class."""
+        pass
+
+    def diff(self,old,new,path=""):
+        """Compute the patch turning the old value into the new value.
+
+        Dicts with string keys are compared key by key and lists of the same length element by
+        element, every other change replaces the whole value at its path.
+
+        Args:
+            old: the last replicated value.
+            new: the newly written value.
+            path: the JSON pointer of the compared values.
+
+        Returns:
+            A list of patch operations, empty if the values are equal.
+        """
+        if type(old) != type(new):
+            return [{"op": "replace", "path": path, "value": new}]
+
+        # Compare dict keys, which JSON pointers can only address as strings
+        if isinstance(new, dict):
+            if not all(isinstance(key, str) for key in list(old) + list(new)):
+                return [] if old == new else [{"op": "replace", "path": path, "value": new}]
+            patch = []
+            for key in old:
+                if key not in new:
+                    patch.append({"op": "remove", "path": f"{path}/{self._escape(key)}"})
+            for key, value in new.items():
+                if key not in old:
+                    patch.append({"op": "add", "path": f"{path}/{self._escape(key)}", "value": value})
+                else:
+                    patch.extend(self.diff(old[key],value,f"{path}/{self._escape(key)}"))
+            return patch
+
+        # Compare list elements if the length is not changed
+        if isinstance(new, list) and len(old) == len(new):
+            patch = []
+            for index in range(len(new)):
+                patch.extend(self.diff(old[index],new[index],f"{path}/{index}"))
+            return patch
+
+        if old == new:
+            return []
+        return [{"op": "replace", "path": path, "value": new}]
+
+    def apply(self,doc,patch):
+        """Apply a patch to a copy of a value.
+
+        The containers on the path of every operation are copied, the other ones are shared with
+        the original value, so the original value is never modified and readers of the replica
+        never see a half-patched value.
+
+        Args:
+            doc: the value of the replica, which is not modified.
+            patch: the list of patch operations.
+
+        Returns:
+            The patched value.
+        """
+        copied = set() # ids of the containers copied by this patch
+        for operation in patch:
+            value = operation.get("value")
+            if operation["path"] == "":
+                doc = value
+                copied = set()
+                continue
+
+            # Copy the containers down to the parent of the target
+            tokens = [self._unescape(token) for token in operation["path"].split("/")[1:]]
+            doc = self._copied(doc,copied)
+            parent = doc
+            for token in tokens[:-1]:
+                index = int(token) if isinstance(parent, list) else token
+                parent[index] = self._copied(parent[index],copied)
+                parent = parent[index]
+            key = int(tokens[-1]) if isinstance(parent, list) else tokens[-1]
+
+            # Apply the operation
+            if operation["op"] == "remove":
+                del parent[key]
+            else:
+                parent[key] = value
+        return doc
+
+    def _copied(self,container,copied):
+        """Get a shallow copy of a container, the container itself if this patch copied it."""
+        if id(container) in copied:
+            return container
+        container = list(container) if isinstance(container, list) else dict(container)
+        copied.add(id(container))
+        return container
+
+    def _escape(self,key):
+        """Escape a dict key as a JSON pointer token."""
+        return str(key).replace("~", "~0").replace("/", "~1")
+
+    def _unescape(self,token):
+        """Unescape a JSON pointer token to a dict key."""
+        return token.replace("~1", "/").replace("~0", "~")
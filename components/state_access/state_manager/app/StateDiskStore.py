@@ -0,0 +1,409 @@
+"""StateDiskStore() class aims to store warm and cold state replicas on the local disk.
+
+Typical usage example:
+
+    sds = StateDiskStore()
+    sds.save(function_name, state_data)
+    state_data = sds.load(function_name)
+"""
+import json
+import mmap
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+# config.py
+WORKER_STATE_DISK_PATH = ""
+WORKER_STATE_DISK_ENGINE = "sqlite"
+STATE_DISK_DURABLE = True
+STATE_DISK_FLUSH_INTERVAL = 0.5
+STATE_DISK_FLUSH_BATCH = 64
+STATE_DISK_COMPACT_INTERVAL = 3600
+STATE_MMAP_MIN_BYTES = 1024 * 1024
+STATE_MMAP_CHUNK_BYTES = 256 * 1024
+
+class JsonFileStore:
+    """Store every state replica in its own {WORKER_STATE_DISK_PATH}/{function_name}.json file,
+    written to a temporary file, fsynced and atomically renamed so a crash never leaves a torn file."""
+
+    def __init__(self,path=WORKER_STATE_DISK_PATH):
+        """Initial the JsonFileStore class."""
+        self.path = path
+        self.flush_event = threading.Event()
+
+    def file_path(self,function_name):
+        """The file path of a state replica."""
+        return f"{self.path}/{function_name}.json"
+
+    def save(self,function_name,state_data):
+        """Write a state replica atomically and durably."""
+        fd, tmp_path = tempfile.mkstemp(dir=self.path,prefix=f".{function_name}.",suffix=".tmp")
+        try:
+            with os.fdopen(fd,'w') as file:
+                json.dump(state_data,file)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(tmp_path,self.file_path(function_name))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        # Persist the rename itself
+        dir_fd = os.open(self.path,os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+    def load(self,function_name):
+        """Read a state replica."""
+        with open(self.file_path(function_name),'r') as json_file:
+            return json.load(json_file)
+
+    def exists(self,function_name):
+        """Check whether a state replica is stored."""
+        return os.path.exists(self.file_path(function_name))
+
+    def delete(self,function_name):
+        """Remove a state replica."""
+        if os.path.exists(self.file_path(function_name)):
+            os.remove(self.file_path(function_name))
+
+    def export_file(self,function_name):
+        """Get a JSON file of a state replica to send to external storage.
+
+        Returns:
+            A tuple of the file path and whether the file is temporary.
+        """
+        return self.file_path(function_name), False
+
+    def import_file(self,function_name,file_path):
+        """Store a state replica from a JSON file pulled from external storage.
+
+        Returns:
+            The state value.
+        """
+        with open(file_path,'r') as json_file:
+            state_data = json.load(json_file)
+        if file_path != self.file_path(function_name):
+            self.save(function_name,state_data)
+            os.remove(file_path)
+        return state_data
+
+    def stream_raw(self,function_name):
+        """Raw serialized bytes are only streamed by MmapFileStore."""
+        return None
+
+    def flush(self):
+        """Nothing is buffered, every save is durable when it returns."""
+        pass
+
+    def compact(self):
+        """Remove the temporary files left by crashes during a save."""
+        for file_name in os.listdir(self.path):
+            if file_name.startswith(".") and file_name.endswith(".tmp"):
+                os.remove(f"{self.path}/{file_name}")
+
+class MmapFileStore(JsonFileStore):
+    """Store every state replica as a JSON file like JsonFileStore, and serve reads of large
+    replicas straight from a read-only memory map of the file, without parsing them into Python
+    objects and re-encoding them.
+
+    A replaced file is never modified in place, so a stream keeps reading the version it mapped.
+    """
+
+    def stream_raw(self,function_name,min_bytes=STATE_MMAP_MIN_BYTES):
+        """Map a state replica file to stream its serialized bytes.
+
+        Args:
+            function_name: the read state name
+            min_bytes: smaller replicas are not streamed, parsing them is cheap
+
+        Returns:
+            A tuple of the size and a generator of byte chunks closing the map when exhausted, or
+            None if the replica is smaller than min_bytes or its file is gone.
+        """
+        try:
+            with open(self.file_path(function_name),'rb') as file:
+                size = os.fstat(file.fileno()).st_size
+                if size < min_bytes:
+                    return None
+                state_map = mmap.mmap(file.fileno(),0,access=mmap.ACCESS_READ)
+        except FileNotFoundError:
+            return None # Promoted or removed meanwhile, read by state_read instead
+
+        def chunks():
+            try:
+                for offset in range(0,size,STATE_MMAP_CHUNK_BYTES):
+                    yield state_map[offset:offset + STATE_MMAP_CHUNK_BYTES]
+            finally:
+                state_map.close()
+        return size, chunks()
+
+class SqliteStore:
+    """Store all state replicas in one SQLite database in WAL mode, so many small states do not
+    pile up as files.
+
+    With STATE_DISK_DURABLE, every save and removal is committed with synchronous=FULL before it
+    returns. Otherwise saves are buffered and committed in batches by flush() with
+    synchronous=NORMAL, and load() reads the buffered value first, so a crash loses the writes of
+    the last STATE_DISK_FLUSH_INTERVAL seconds and a power loss the last commits too.
+
+    The connection is opened on first use in every process, a connection inherited across a fork
+    is never used. A replica saved as {function_name}.json by the json engine is read when the
+    database does not have it, and moved into the database.
+
+    Attributes:
+        db: the database connection of this process shared by the threads under db_lock.
+        pending: a dict with state names as keys and the buffered values (None for deletions).
+        flushing: the batch being committed, still visible to readers until the commit ends.
+    """
+
+    def __init__(self,path=WORKER_STATE_DISK_PATH,durable=STATE_DISK_DURABLE):
+        """Initial the SqliteStore class, the database is opened on first use."""
+        self.path = path
+        self.durable = durable
+        self.connection = None
+        self.connection_pid = None
+        self.db_lock = threading.Lock()
+        self.pending = {}
+        self.flushing = {}
+        self.pending_lock = threading.Lock()
+        self.flush_event = threading.Event()
+
+    @property
+    def db(self):
+        """The database connection of this process, opened on first use, the db_lock must be held."""
+        if self.connection is None or self.connection_pid != os.getpid():
+            db = sqlite3.connect(f"{self.path}/states.db",check_same_thread=False,isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=FULL" if self.durable else "PRAGMA synchronous=NORMAL")
+            db.execute("CREATE TABLE IF NOT EXISTS states (name TEXT PRIMARY KEY, value TEXT NOT NULL, updated REAL NOT NULL)")
+            self.connection = db
+            self.connection_pid = os.getpid()
+        return self.connection
+
+    def legacy_path(self,function_name):
+        """The file path of a state replica saved by the json engine."""
+        return f"{self.path}/{function_name}.json"
+
+    def stream_raw(self,function_name):
+        """Raw serialized bytes are only streamed by MmapFileStore."""
+        return None
+
+    def buffered(self,function_name):
+        """Get the buffered value of a state, the pending_lock must be held.
+
+        Returns:
+            A tuple of whether the state is buffered and its serialized value (None if removed).
+        """
+        for buffer in (self.pending, self.flushing):
+            if function_name in buffer:
+                return True, buffer[function_name]
+        return False, None
+
+    def save(self,function_name,state_data):
+        """Commit the write of a state replica, or buffer it to be flushed within
+        STATE_DISK_FLUSH_INTERVAL seconds if the store is not durable."""
+        if self.durable:
+            with self.db_lock:
+                self.db.execute("INSERT OR REPLACE INTO states (name, value, updated) VALUES (?, ?, ?)",
+                                (function_name,json.dumps(state_data),time.time()))
+            return
+        with self.pending_lock:
+            self.pending[function_name] = json.dumps(state_data)
+            if len(self.pending) >= STATE_DISK_FLUSH_BATCH:
+                self.flush_event.set()
+
+    def load(self,function_name):
+        """Read a state replica.
+
+        Raises:
+            KeyError: the state is not stored.
+        """
+        with self.pending_lock:
+            found, value = self.buffered(function_name)
+        if found:
+            if value is None:
+                raise KeyError(function_name)
+            return json.loads(value)
+        with self.db_lock:
+            row = self.db.execute("SELECT value FROM states WHERE name = ?",(function_name,)).fetchone()
+        if row is None:
+            return self.legacy_load(function_name)
+        return json.loads(row[0])
+
+    def legacy_load(self,function_name):
+        """Read a state replica saved by the json engine and move it into the database.
+
+        Raises:
+            KeyError: the state is not stored.
+        """
+        try:
+            with open(self.legacy_path(function_name),'r') as json_file:
+                state_data = json.load(json_file)
+        except FileNotFoundError:
+            raise KeyError(function_name)
+        self.save(function_name,state_data)
+        self.flush()
+        if os.path.exists(self.legacy_path(function_name)):
+            os.remove(self.legacy_path(function_name))
+        return state_data
+
+    def exists(self,function_name):
+        """Check whether a state replica is stored."""
+        with self.pending_lock:
+            found, value = self.buffered(function_name)
+        if found:
+            return value is not None
+        with self.db_lock:
+            if self.db.execute("SELECT 1 FROM states WHERE name = ?",(function_name,)).fetchone() is not None:
+                return True
+        return os.path.exists(self.legacy_path(function_name))
+
+    def delete(self,function_name):
+        """Remove a state replica, or buffer its removal if the store is not durable."""
+        if os.path.exists(self.legacy_path(function_name)):
+            os.remove(self.legacy_path(function_name))
+        if self.durable:
+            with self.db_lock:
+                self.db.execute("DELETE FROM states WHERE name = ?",(function_name,))
+            return
+        with self.pending_lock:
+            self.pending[function_name] = None
+
+    def export_file(self,function_name):
+        """Write a state replica to a temporary JSON file to send to external storage.
+
+        Returns:
+            A tuple of the file path and whether the file is temporary.
+        """
+        file_path = f"{self.path}/.{function_name}.export.json"
+        with open(file_path,'w') as file:
+            json.dump(self.load(function_name),file)
+        return file_path, True
+
+    def import_file(self,function_name,file_path):
+        """Store a state replica from a JSON file pulled from external storage and remove the file.
+
+        Returns:
+            The state value.
+        """
+        with open(file_path,'r') as json_file:
+            state_data = json.load(json_file)
+        self.save(function_name,state_data)
+        os.remove(file_path)
+        return state_data
+
+    def flush(self):
+        """Commit all buffered writes and removals in one transaction."""
+        with self.pending_lock:
+            batch = self.pending
+            self.pending = {}
+            self.flushing = batch
+        if not batch:
+            return
+
+        now = time.time()
+        with self.db_lock:
+            try:
+                self.db.execute("BEGIN")
+                for function_name, value in batch.items():
+                    if value is None:
+                        self.db.execute("DELETE FROM states WHERE name = ?",(function_name,))
+                    else:
+                        self.db.execute("INSERT OR REPLACE INTO states (name, value, updated) VALUES (?, ?, ?)",
+                                        (function_name,value,now))
+                self.db.execute("COMMIT")
+            except Exception:
+                self.db.execute("ROLLBACK")
+                # Put the batch back unless newer values were buffered in between.
+                with self.pending_lock:
+                    for function_name, value in batch.items():
+                        self.pending.setdefault(function_name,value)
+                    self.flushing = {}
+                raise
+        with self.pending_lock:
+            self.flushing = {}
+
+    def compact(self):
+        """Fold the write-ahead log into the database and reclaim the space of removed states."""
+        self.flush()
+        with self.db_lock:
+            self.db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self.db.execute("VACUUM")
+
+class StateDiskStore:
+    """The disk tier of the state manager, delegating to the engine chosen by
+    WORKER_STATE_DISK_ENGINE: "sqlite" (SQLite in WAL mode with batched commits), "json" (one
+    atomically replaced JSON file per state) or "mmap" (JSON files whose large replicas are read
+    through memory maps).
+
+    Attributes:
+        engine: the storage engine object.
+    """
+
+    ENGINES = {"json": JsonFileStore, "mmap": MmapFileStore, "sqlite": SqliteStore}
+
+    def __init__(self,engine=WORKER_STATE_DISK_ENGINE,path=WORKER_STATE_DISK_PATH):
+        """Initial the StateDiskStore class with the configured engine."""
+        self.engine = self.ENGINES[engine](path)
+
+    def save(self,function_name,state_data):
+        """Store a state replica."""
+        self.engine.save(function_name,state_data)
+
+    def load(self,function_name):
+        """Read a state replica."""
+        return self.engine.load(function_name)
+
+    def exists(self,function_name):
+        """Check whether a state replica is stored."""
+        return self.engine.exists(function_name)
+
+    def delete(self,function_name):
+        """Remove a state replica."""
+        self.engine.delete(function_name)
+
+    def export_file(self,function_name):
+        """Get a JSON file of a state replica to send to external storage.
+
+        Returns:
+            A tuple of the file path and whether the file is temporary.
+        """
+        return self.engine.export_file(function_name)
+
+    def stream_raw(self,function_name):
+        """Stream the serialized JSON bytes of a large state replica without parsing it.
+
+        Returns:
+            A tuple of the size and a generator of byte chunks, or None if the engine or the
+            replica size does not allow it.
+        """
+        return self.engine.stream_raw(function_name)
+
+    def import_file(self,function_name,file_path):
+        """Store a state replica from a JSON file pulled from external storage."""
+        return self.engine.import_file(function_name,file_path)
+
+    def flush(self):
+        """Commit the buffered writes now."""
+        self.engine.flush()
+
+    def flush_manager(self):
+        """Flush the buffered writes in batches and compact the store periodically."""
+        last_compact_time = time.time()
+        while True:
+            # Wake up periodically, or as soon as a full batch is buffered.
+            self.engine.flush_event.wait(STATE_DISK_FLUSH_INTERVAL)
+            self.engine.flush_event.clear()
+            try:
+                self.engine.flush()
+                if time.time() - last_compact_time > STATE_DISK_COMPACT_INTERVAL:
+                    self.engine.compact()
+                    last_compact_time = time.time()
+            except Exception as e:
+                print(f"Thread error: {e}") # Error handling
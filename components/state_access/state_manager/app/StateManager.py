@@ -7,45 +7,139 @@ Typical usage example:
 """
 import time
 import threading
-import sys
-import os
-import psutil
 
 from app import StateOperater
-from app import StateFileManager
+from app import StateDelta
+from app import LeaseLock
+from app import StateMemoryCache
+from app import StateAccessRate
+from app import StateScheduler
+from app import ShardedDict
 
 # config.py
-WORKER_STATE_DISK_PATH = ""
+STATE_LOCK_REAP_INTERVAL = 1.0
+STATE_HOT_MAX_BYTES = 64 * 1024
+STATE_HOT_WINDOW = 120
+STATE_HOT_ACCESSES = 10
+STATE_HOT_RECHECK_SECONDS = 30
+STATE_WARM_IDLE_SECONDS = 60
+STATE_COLD_IDLE_SECONDS = 1000000
+STATE_PROMOTE_DELAY = 1.0
+STATE_MAP_SHARDS = 16
 
 class StateManager:
     """Manage the state monitor data and provide scheduling ability about the monitored data.
 
     Attributes:
-        memory_state_storage: a dict with state replica's name as keys and the state value as
+        memory_state_storage: a StateMemoryCache with state replica's name as keys and the state
+                value as values, demoting replicas to local disk beyond its byte budget.
+        state_access_time: a ShardedDict with state name as keys and their access time (int) as
                 values.
-        state_access_time: a dict with state name as keys and their access time (int) as values.
-        state_access_log: a dict with state name as keys and list of their acces times as values.
-        state_lock: a dict with state name as keys and lock object as values.
-        state_activity: a dict with state replica name as keys and their temperature as values.
+        state_access_log: a ShardedDict with state name as keys and StateAccessRate objects
+                counting their accesses in sliding windows as values.
+        state_write_log: a ShardedDict with (state name, origin node ip) as keys and StateAccessRate
+                objects counting the writes of the primary replica by the functions on every node.
+        state_read_log: a ShardedDict with (state name, origin node ip) as keys and StateAccessRate
+                objects counting the reads of the local replica by the functions on other nodes.
+        state_lock: a ShardedDict with state name as keys and LeaseLock object as values, a state
+                is published in it only after its value is in place.
+        state_activity: a ShardedDict with state replica name as keys and their temperature as
+                values.
+        state_version: a ShardedDict with state name as keys and the replication version of the
+                local replica as values. A replica pulled from another node keeps the version of
+                the value pulled, and a state created or restored without a version starts at an
+                epoch version, so the version of a state never moves backwards for its readers.
+        state_version_locks: STATE_MAP_SHARDS locks, the one of a state making the update of its
+                value and its version atomic and the creation of its local replica happen once.
+                Only the swap of the value and the version is done under it, the disk tier is
+                read and written outside.
+        scheduler: the StateScheduler running the temperature check of every state when it is due.
         so: StateOeprater object to excute detailed operations.
     """
 
     def __init__(self):
         """Initial the StateManager class."""
-        self.memory_state_storage = {}
-        self.state_access_time = {}
-        self.state_access_log = {}
-        self.state_lock = {} 
-        self.state_activity = {}
         self.so = StateOperater()
+        LeaseLock.node_set(self.so.node_ip)
+        self.memory_state_storage = StateMemoryCache(demote=self.so.save_dict_to_file)
+        self.state_access_time = ShardedDict()
+        self.state_access_log = ShardedDict()
+        self.state_write_log = ShardedDict()
+        self.state_read_log = ShardedDict()
+        self.state_lock = ShardedDict()
+        self.state_activity = ShardedDict()
+        self.state_version = ShardedDict()
+        self.state_version_locks = [threading.Lock() for _ in range(STATE_MAP_SHARDS)]
+        self.scheduler = StateScheduler()
+
+    def state_version_lock(self,function_name):
+        """Get the version lock of a state, shared with the states hashed to the same shard."""
+        return self.state_version_locks[hash(function_name) % len(self.state_version_locks)]
 
     def state_lock_get(self):
-        """Serialize the lock objects and return the locks list dict."""
+        """Serialize the lock objects and return the locks list dict with their lease and
+        contention statistics."""
         serializable_locks = {}
         for lock_name, lock_obj in self.state_lock.items():
-            serializable_locks[lock_name] = lock_obj.locked()
+            serializable_locks[lock_name] = lock_obj.stats()
         return serializable_locks
 
+    def state_lock_renew(self,function_name,token,post_identity):
+        """Extend the lease of a locked state replica.
+
+        Args:
+            function_name: the locked state name
+            token: the fencing token of the lease
+            post_identity: 1 (stateful functions) pr 0 (monitor or other manager)
+
+        Returns:
+            True if the local lease was renewed.
+        """
+        if function_name not in self.state_lock:
+            return False
+        renewed = self.state_lock[function_name].renew(token)
+        if renewed and post_identity == 1:
+            self.so.state_lock_renew_of_other_nodes(function_name,token)
+        return renewed
+
+    def state_lock_release(self,function_name,token,post_identity):
+        """Release the lease of a locked state replica without writing it.
+
+        Args:
+            function_name: the locked state name
+            token: the fencing token of the lease
+            post_identity: 1 (stateful functions) pr 0 (monitor or other manager)
+
+        Returns:
+            True if the local lease was released.
+        """
+        lock_obj = self.state_lock.get(function_name)
+        if lock_obj is None:
+            return False
+        released = lock_obj.release(token)
+        if released and post_identity == 1:
+            self.so.state_lock_release_of_other_nodes(function_name,token,self.so.state_replicas_search(function_name))
+        return released
+
+    def state_lock_quorum(self,function_name,token):
+        """Lock the replicas in other nodes with the token of the local lease, giving their
+        leases back if the quorum of replicas did not acknowledge.
+
+        Raises:
+            TimeoutError: the quorum of replicas was not locked in the bounded waiting time.
+        """
+        report = self.so.state_lock_of_other_nodes(function_name,token)
+        if not report["acknowledged"]:
+            self.so.state_lock_release_of_other_nodes(function_name,token,list(report["replicas"]))
+            raise TimeoutError(f"replicas of state {function_name} not locked by a quorum")
+
+    def state_lock_reaper(self):
+        """Release the expired leases of crashed lock holders in background."""
+        while True:
+            for lock_obj in self.state_lock.values():
+                lock_obj.reap()
+            time.sleep(STATE_LOCK_REAP_INTERVAL)
+
     def state_create(self,function_name,value):
         """Create a new state replica in the state manager.
         
@@ -53,21 +147,21 @@ class StateManager:
             fucntion_name: the created state name
             value: the value of new state
         """
-        # Check whether the state has existed in the state manager.
-        if function_name in self.memory_state_storage:
-            return f"state of function {function_name} has exists" 
-
-        # Create state's lock and initial its value       
-        self.state_lock[function_name] = threading.Lock()
-        self.memory_state_storage[function_name] = value
+        size = StateMemoryCache.sizeof(value)
+        with self.state_version_lock(function_name):
+            # Check whether the state has existed in the state manager.
+            if function_name in self.state_lock:
+                return f"state of function {function_name} has exists" 
+
+            # Initial its value and the temperature to be warm, then publish state's lock
+            victims = self.memory_state_storage.put(function_name,value,size)
+            self.state_version[function_name] = self.state_version_epoch()
+            self.state_activity[function_name] = 1
+            self.state_lock[function_name] = LeaseLock()
+        self.memory_state_storage.demote_victims(victims)
         
         # Record the first access messages
-        self.state_access_time[function_name] = time.time()
-        self.state_access_log[function_name] = []
-        self.state_access_log[function_name].append(time.time())
-
-        # Initial the temperature to be warm
-        self.state_activity[function_name] = 1
+        self.state_access_record(function_name)
         
         # Tell the creating messages to state monitor
         self.so.state_new_tell_monitor(function_name)
@@ -77,97 +171,551 @@ class StateManager:
         """Interface for state monitor to initial the monitor dict."""
         monitor_dict = {}
         for function_name in self.state_lock :
-            monitor_dict[function_name]["activity"] = self.state_activity[function_name]
+            monitor_dict[function_name] = {"activity": self.state_activity.get(function_name)}
         return monitor_dict
 
     def state_size(self):
         """Interface for experiments to monitor the memory cost of state manager's memory storage."""
-        total_size = 0
-        for value in self.memory_state_storage.values():
-            total_size += sys.getsizeof(value)
-        return total_size
+        return self.memory_state_storage.used
 
-    def state_read(self,function_name,locked,post_identity):
+    def state_read(self,function_name,locked,post_identity,versioned=False,token=None,if_version=None,origin=None):
         """Provide the ability to read the states' values and related lock operations.
         
         Args:
             function_name: the read state name
             locked: 1 (lock the state) or 0 (don't lock the state)
             post_identity: 1 (stateful functions) pr 0 (monitor or other manager)
+            versioned: return the value together with its version, and the fencing token of the
+                    lease taken if locked, if True
+            token: the fencing token of the lease taken by the locking manager
+            if_version: the version cached by the reader, the value is not returned if unchanged
+            origin: the ip of the node running the reading function
         
         Returns:
-            The state value required.
+            The state value required, or a dict containing "state_data", "version" and "token" if
+            versioned, or a dict containing "not_modified" and "version" if the reader's version is current.
+
+        Raises:
+            TimeoutError: the lock was not acquired in the bounded waiting time.
         """
         # Just lock the local state (from other manager locking the state.)
         if locked == 1 and post_identity == 0 :
-            self.state_lock[function_name].acquire()
+            if self.state_lock[function_name].acquire(token=token) is None:
+                raise TimeoutError(f"lock of state {function_name} timed out")
             return 
 
-        # There is not the specific state replica locally, needing to pull from other positions.
-        if function_name not in self.state_lock:
-            # Initial the lock object
-            self.state_lock[function_name] = threading.Lock()
+        # The reader's cached value is current, no need to load or send the state.
+        if locked == 0 and if_version is not None and function_name in self.state_lock:
+            with self.state_version_lock(function_name):
+                version = self.state_version.get(function_name,0)
+            if version == if_version:
+                if post_identity == 1:
+                    self.state_access_record(function_name)
+                    self.state_read_record(function_name,origin)
+                return {"not_modified": True, "version": version}
 
-            # Pull the specific state.
-            self.memory_state_storage[function_name] = self.so.state_pull_from_other_nodes(function_name) 
-            
-            # Initial temperature and tell monitor.
-            self.state_activity[function_name] = 1
-            self.so.activity_update_tell(function_name,1)
-            self.so.state_new_tell_monitor(function_name)
-
-        # State juest in local disk.
-        elif function_name not in self.memory_state_storage:
-            # Load state from local disk to local memory.
-            self.memory_state_storage[function_name] = self.so.state_load_from_local_disk(function_name) 
+        # Make the state replica available in local memory.
+        self.state_local_load(function_name)
 
         # Check whether locking the state replica.
         if locked == 1 : # Lock
-            self.state_lock[function_name].acquire()
-            state_data = self.memory_state_storage[function_name]
-            self.so.state_lock_of_other_nodes(function_name)
+            lock_token = self.state_lock[function_name].acquire()
+            if lock_token is None:
+                raise TimeoutError(f"lock of state {function_name} timed out")
+            try:
+                state_data, version = self.state_versioned_get(function_name)
+                self.state_lock_quorum(function_name,lock_token)
+            except Exception:
+                # The replicas could not be searched or locked, give the local lease back.
+                self.state_lock[function_name].release(lock_token)
+                raise
         else : # Unlock
-            self.state_lock[function_name].acquire()
-            state_data = self.memory_state_storage[function_name]
-            self.state_lock[function_name].release()
+            lock_token = self.state_lock[function_name].acquire(read=True)
+            if lock_token is None:
+                raise TimeoutError(f"lock of state {function_name} timed out")
+            state_data, version = self.state_versioned_get(function_name)
+            self.state_lock[function_name].release(lock_token)
         
         # If state is read by stateful function, update the access message logs. 
         if post_identity == 1:
-            if function_name not in self.state_access_log:
-                self.state_access_log[function_name] = []
-            self.state_access_time[function_name] = time.time()
-            self.state_access_log[function_name].append(time.time())
+            self.state_access_record(function_name)
+            self.state_read_record(function_name,origin)
 
+        if versioned:
+            return {"state_data": state_data, "version": version, "token": lock_token if locked == 1 else None}
         return state_data # Return the value read.
 
-    def state_write(self,function_name,post_identity,state_data):
+    def state_read_raw(self,function_name,post_identity,origin=None):
+        """Stream a warm state replica from the disk tier without loading it into memory.
+
+        Only an unlocked read of a replica which is on local disk and large enough is streamed,
+        its serialized bytes are sent as they are instead of being parsed and re-encoded. The
+        replica stays on disk, it is parsed only when the manager itself needs the value.
+
+        Args:
+            function_name: the read state name
+            post_identity: 1 (stateful functions) pr 0 (monitor or other manager)
+            origin: the ip of the node running the reading function
+
+        Returns:
+            A tuple of the size and a generator of JSON byte chunks, or None if the replica
+            should be read by state_read.
+
+        Raises:
+            TimeoutError: the lock was not acquired in the bounded waiting time.
+        """
+        if function_name not in self.state_lock or function_name in self.memory_state_storage:
+            return None
+
+        # Wait for the locked read in progress and map the replica before releasing the lock.
+        lock_token = self.state_lock[function_name].acquire(read=True)
+        if lock_token is None:
+            raise TimeoutError(f"lock of state {function_name} timed out")
+        try:
+            if function_name in self.memory_state_storage:
+                return None
+            raw = self.so.disk.stream_raw(function_name)
+        finally:
+            self.state_lock[function_name].release(lock_token)
+
+        if raw is not None and post_identity == 1:
+            self.state_access_record(function_name)
+            self.state_read_record(function_name,origin)
+        return raw
+
+    def state_local_load(self,function_name):
+        """Make a state replica available in local memory, pulling it from other positions or
+        loading it from local disk if needed.
+
+        Args:
+            function_name: the loaded state name
+        """
+        # There is not the specific state replica locally, needing to pull from other positions.
+        if function_name not in self.state_lock:
+            # Pull the specific state with its version.
+            state_data, version = self.so.state_pull_from_other_nodes(function_name)
+
+            # Initial the value and temperature, unless a concurrent request created the replica first.
+            size = StateMemoryCache.sizeof(state_data)
+            with self.state_version_lock(function_name):
+                created = function_name not in self.state_lock
+                if created:
+                    victims = self.memory_state_storage.put(function_name,state_data,size)
+                    self.state_version[function_name] = self.state_version_epoch() if version is None else version
+                    self.state_activity[function_name] = 1
+                    self.state_lock[function_name] = LeaseLock()
+            
+            # Tell monitor.
+            if created:
+                self.memory_state_storage.demote_victims(victims)
+                self.so.activity_update_tell(function_name,1)
+                self.so.state_new_tell_monitor(function_name)
+
+        # State juest in local disk.
+        elif not self.memory_state_storage.hit(function_name):
+            # Load state from local disk to local memory, unless the admission policy keeps it on disk.
+            self.state_promote(function_name)
+
+        # Check whether the replica in memory turns idle.
+        self.scheduler.schedule(function_name,time.time() + STATE_WARM_IDLE_SECONDS)
+
+    def state_promote(self,function_name):
+        """Load a state replica from local disk to local memory, unless the admission policy keeps
+        it on disk or a write replaced it while it was read from disk."""
+        state_data, version = self.state_versioned_get(function_name)
+        size = StateMemoryCache.sizeof(state_data)
+        with self.state_version_lock(function_name):
+            if self.state_version.get(function_name,0) != version:
+                return
+            _, victims = self.memory_state_storage.promote(function_name,state_data,size)
+        self.memory_state_storage.demote_victims(victims)
+
+    def state_access_record(self,function_name):
+        """Update the access message logs of a state accessed by stateful function."""
+        access_rate, _ = self.state_access_log.get_or_create(function_name,StateAccessRate)
+        access_time = time.time()
+        self.state_access_time[function_name] = access_time
+        access_rate.record(access_time)
+
+        # Check soon whether the state turns hot, at most once per STATE_PROMOTE_DELAY.
+        if self.state_activity.get(function_name) != 2:
+            self.scheduler.schedule(function_name,access_time + STATE_PROMOTE_DELAY)
+
+    def state_write_record(self,function_name,origin=None):
+        """Count a write of a state by a function on the origin node, this node if not given."""
+        write_rate, _ = self.state_write_log.get_or_create((function_name, origin or self.so.node_ip),StateAccessRate)
+        write_rate.record()
+
+    def state_read_record(self,function_name,origin=None):
+        """Count a read of the local replica by a function on another node."""
+        if origin and origin != self.so.node_ip:
+            read_rate, _ = self.state_read_log.get_or_create((function_name, origin),StateAccessRate)
+            read_rate.record()
+
+    def state_access_rate_get(self):
+        """Summarize the access counts of every state replica in several windows and their decayed
+        rates, with the decayed write rates by origin node of the primary replicas and the decayed
+        read rates by the other nodes reading the local replica."""
+        rates = {function_name: access_rate.snapshot() for function_name, access_rate in self.state_access_log.items()}
+        for kind, log in (("writes", self.state_write_log), ("reads", self.state_read_log)):
+            for (function_name, origin), rate in log.items():
+                if function_name in rates:
+                    rates[function_name].setdefault(kind,{})[origin] = rate.rate()
+        return rates
+
+    def state_access_log_clear(self,function_name):
+        """Forget the accesses of a removed state replica, so they are not reported any more."""
+        self.state_access_log.pop(function_name,None)
+        self.state_access_time.pop(function_name,None)
+        for log in (self.state_write_log, self.state_read_log):
+            for key in [key for key in log.keys() if key[0] == function_name]:
+                log.pop(key,None)
+
+    def state_mget(self,function_names,locked,post_identity):
+        """Read several states in one request.
+
+        Locked reads acquire the local leases in sorted name order, so two functions locking
+        overlapping states can not deadlock, and either all the states are locked or none.
+
+        Args:
+            function_names: the read state names
+            locked: 1 (lock the states) or 0 (don't lock the states)
+            post_identity: 1 (stateful functions) pr 0 (monitor or other manager)
+
+        Returns:
+            A dict containing the state values, their versions and the fencing tokens if locked.
+
+        Raises:
+            TimeoutError: one of the locks was not acquired in the bounded waiting time.
+        """
+        function_names = sorted(set(function_names))
+        states = {}
+        versions = {}
+
+        # Unlocked reads are independent of each other.
+        if locked == 0:
+            for function_name in function_names:
+                msg = self.state_read(function_name,0,post_identity,versioned=True)
+                states[function_name] = msg["state_data"]
+                versions[function_name] = msg["version"]
+            return {"states": states, "versions": versions}
+
+        # Acquire all local leases in the deterministic order, rolling back on timeout.
+        tokens = {}
+        for function_name in function_names:
+            self.state_local_load(function_name)
+            lock_token = self.state_lock[function_name].acquire()
+            if lock_token is None:
+                for locked_name, locked_token in tokens.items():
+                    self.state_lock[locked_name].release(locked_token)
+                raise TimeoutError(f"lock of state {function_name} timed out")
+            tokens[function_name] = lock_token
+
+        # Read the values and lock the replicas in other nodes, rolling back if the replicas can not be searched or locked.
+        replicated = []
+        try:
+            for function_name in function_names:
+                states[function_name], versions[function_name] = self.state_versioned_get(function_name)
+                self.state_lock_quorum(function_name,tokens[function_name])
+                replicated.append(function_name)
+                if post_identity == 1:
+                    self.state_access_record(function_name)
+        except Exception:
+            for locked_name, locked_token in tokens.items():
+                if locked_name in replicated:
+                    self.state_lock_release(locked_name,locked_token,1)
+                else:
+                    self.state_lock[locked_name].release(locked_token)
+            raise
+        return {"states": states, "versions": versions, "tokens": tokens}
+
+    def state_mset(self,states,post_identity,tokens=None,origin=None):
+        """Write several states in one request, in sorted name order.
+
+        Args:
+            states: a dict with state names as keys and the new values as values
+            post_identity: 1 (stateful functions) pr 0 (monitor or other manager)
+            tokens: a dict with state names as keys and the fencing tokens of the locked reads
+            origin: the ip of the node running the writing function
+
+        Returns:
+            A dict with state names as keys and the result of every write as values.
+        """
+        tokens = tokens or {}
+        results = {}
+        for function_name in sorted(states):
+            results[function_name] = self.state_write(function_name,post_identity,states[function_name],
+                                                      token=tokens.get(function_name),origin=origin)
+        return results
+
+    def state_version_epoch(self):
+        """The first version of a state created or restored without a version.
+
+        It counts the seconds since 1970 in the bits above the lowest 24, above the versions an
+        earlier incarnation of the state reached unless it was written 2^24 times per second, so
+        a reader never finds a newer value at a version it has cached.
+        """
+        return int(time.time()) << 24
+
+    def state_versioned_get(self,function_name):
+        """Get the value of a state replica in memory together with its version.
+
+        Returns:
+            A tuple of the state value and its version.
+        """
+        while True:
+            # One lookup under the cache lock, the replica may be demoted to local disk at any time.
+            with self.state_version_lock(function_name):
+                state_data = self.memory_state_storage.get(function_name,self.memory_state_storage)
+                version = self.state_version.get(function_name,0)
+            if state_data is not self.memory_state_storage:
+                return state_data, version
+
+            # Read from disk outside the lock, again if a write moved the version meanwhile.
+            state_data = self.so.state_load_from_local_disk(function_name)
+            with self.state_version_lock(function_name):
+                if self.state_version.get(function_name,0) == version:
+                    return state_data, version
+
+    def state_cas(self,function_name,version,state_data,origin=None):
+        """Write a state only if its version is still the version the caller read (compare-and-swap).
+
+        No lock is held across the caller's round trip, the write just fails if another writer
+        updated the state in between or a locked read is in progress. The brief leases of unlocked
+        reads are not conflicts.
+
+        Args:
+            function_name: the written state name
+            version: the version the caller read the state at
+            state_data: the new value of the state
+            origin: the ip of the node running the writing function
+
+        Returns:
+            A dict containing whether the write succeeded, the current version of the state and
+            the replication report of the slave replicas, or the redirect message if this node is
+            not the primary replica of the state.
+        """
+        primary_ip = self.state_primary_redirect(function_name)
+        if primary_ip:
+            return {"success": False, "redirect": primary_ip}
+
+        if function_name not in self.state_lock:
+            return {"success": False, "version": None, "replication": None}
+
+        # Compare and swap the value atomically, the last value is sent in full if it is on disk.
+        size = StateMemoryCache.sizeof(state_data)
+        with self.state_version_lock(function_name):
+            current_version = self.state_version.get(function_name,0)
+            if current_version != version or self.state_lock[function_name].write_locked():
+                return {"success": False, "version": current_version, "replication": None}
+            last_data = self.memory_state_storage.get(function_name)
+            victims = self.memory_state_storage.put(function_name,state_data,size)
+            self.state_version[function_name] = current_version + 1
+        self.memory_state_storage.demote_victims(victims)
+
+        # Update the access message logs and replicate the value without locking slave replicas.
+        self.state_access_record(function_name)
+        self.state_write_record(function_name,origin)
+        replication = self.so.state_unlock_of_other_nodes(function_name,state_data,current_version + 1,last_data)
+        replication = self.state_version_catch_up(function_name,replication)
+        return {"success": True, "version": current_version + 1, "replication": replication}
+
+    def state_write(self,function_name,post_identity,state_data=None,patch=None,version=None,base_version=None,token=None,origin=None):
         """Provide the ability to wirte the states' values and related lock operations.
         
         Args:
             function_name: the write state name
             state data: the value wiil be updated to state manager
             post_identity: 1 (stateful functions) pr 0 (monitor or other manager)
+            patch: the delta from the primary replica, applied instead of state_data if given
+            version: the replication version of the written value from the primary replica
+            base_version: the version the patch is computed against
+            token: the fencing token of the lease taken by the locked read, if any
+            origin: the ip of the node running the writing function
+
+        Returns:
+            The replication report of the slave replicas if written by stateful function, the
+            version gap message if a patch can not be applied to the local replica, or the stale
+            token message if the lease of the writer has been taken over, or the stale version
+            message if the local replica is already at a later version than the replicated one, or
+            the redirect message if this node is not the primary replica of the state.
         """
-        # Pull state from other nodes if not existing locally
+        # Redirect the stateful function to the primary replica.
+        if post_identity == 1:
+            primary_ip = self.state_primary_redirect(function_name)
+            if primary_ip:
+                return {"redirect": primary_ip}
+
+        # A patch only applies to a local replica, the primary replica sends the full value instead.
+        if patch is not None and function_name not in self.state_lock:
+            return self.state_version_gap(function_name)
+
+        # Create the local replica with the written value, publishing its lock last.
+        created = False
         if function_name not in self.state_lock:
-            # Create and initial the related objects.
-            self.state_lock[function_name] = threading.Lock()
-            self.state_activity[function_name] = 1
-            self.so.activity_update_tell(function_name,1)
-            self.so.state_new_tell_monitor(function_name)
-        
-        # Write the state locally in memort.
-        self.memory_state_storage[function_name] = state_data
-        
+            size = StateMemoryCache.sizeof(state_data)
+            with self.state_version_lock(function_name):
+                created = function_name not in self.state_lock
+                if created:
+                    victims = self.memory_state_storage.put(function_name,state_data,size)
+                    self.state_version[function_name] = self.state_version_epoch() if version is None else version
+                    self.state_activity.setdefault(function_name,1)
+                    self.state_lock[function_name] = LeaseLock()
+            if created:
+                self.memory_state_storage.demote_victims(victims)
+                self.so.activity_update_tell(function_name,1)
+                self.so.state_new_tell_monitor(function_name)
+
+        # Reject the write of a holder whose lease expired and was granted to another one.
+        if token is not None and self.state_lock[function_name].stale(token):
+            return {"stale_token": True, "token": token}
+
+        # Apply the delta from primary replica to a copy of the local replica at its base version.
+        if patch is not None:
+            if self.state_version.get(function_name) != base_version:
+                return self.state_version_gap(function_name)
+            base_data = self.memory_state_storage.get(function_name,self.memory_state_storage)
+            if base_data is self.memory_state_storage: # Not in memory
+                if not self.so.disk.exists(function_name):
+                    return self.state_version_gap(function_name)
+                base_data = self.so.state_load_from_local_disk(function_name)
+            state_data = StateDelta().apply(base_data,patch)
+
+        # Write the state locally in memort, an out-of-order replication older than the local replica is dropped.
+        if created:
+            moved, stale, last_data = False, False, None
+            local_version = self.state_version.get(function_name,0)
+        else:
+            size = StateMemoryCache.sizeof(state_data)
+            victims = []
+            with self.state_version_lock(function_name):
+                # The patched copy is dropped if another write moved the local replica meanwhile.
+                moved = patch is not None and self.state_version.get(function_name) != base_version
+                stale = version is not None and version < self.state_version.get(function_name,0)
+                last_data = self.memory_state_storage.get(function_name)
+                if not moved and version is None:
+                    victims = self.memory_state_storage.put(function_name,state_data,size)
+                    self.state_version[function_name] = self.state_version.get(function_name,0) + 1
+                elif not moved and version > self.state_version.get(function_name,0):
+                    victims = self.memory_state_storage.put(function_name,state_data,size)
+                    self.state_version[function_name] = version
+                local_version = self.state_version.get(function_name,0)
+            self.memory_state_storage.demote_victims(victims)
+        if moved:
+            return self.state_version_gap(function_name)
+
         # Release the lock if it was locked. 
-        if self.state_lock.get(function_name).locked():
-            self.state_lock[function_name].release()
+        self.state_lock[function_name].release(token)
+        self.scheduler.schedule(function_name,time.time() + STATE_WARM_IDLE_SECONDS)
         
+        # Tell the primary replica it is behind this replica, it moves its version past it.
+        if stale:
+            return {"stale_version": True, "version": local_version}
+
         # If state is writen by stateful function, update the access message logs. 
         if post_identity == 1:
-            self.state_access_time[function_name] = time.time()
-            self.state_access_log[function_name].append(time.time())
-            self.so.state_unlock_of_other_nodes(function_name,state_data)   
+            self.state_access_record(function_name)
+            self.state_write_record(function_name,origin)
+            replication = self.so.state_unlock_of_other_nodes(function_name,state_data,local_version,last_data,token)
+            return self.state_version_catch_up(function_name,replication)
+
+    def state_version_catch_up(self,function_name,replication):
+        """Continue the version of a primary replica from the highest version of the replicas.
+
+        A node which became the primary replica may be behind replicas written by the former
+        primary, which refuse its writes as stale. Its version is moved past theirs and its value
+        is sent to them again in full.
+
+        Args:
+            function_name: the written state name
+            replication: the fanout report of the write, with the highest "ahead_version" of the
+                    replicas which refused it
+
+        Returns:
+            The fanout report of the value sent again, or the given report if no replica was ahead.
+        """
+        ahead_version = replication.get("ahead_version")
+        if ahead_version is None:
+            return replication
+        with self.state_version_lock(function_name):
+            if self.state_version.get(function_name,0) <= ahead_version:
+                self.state_version[function_name] = ahead_version + 1
+        state_data, version = self.state_versioned_get(function_name)
+        return self.so.state_unlock_of_other_nodes(function_name,state_data,version)
+
+    def state_primary_redirect(self,function_name):
+        """Check whether writes of a state should be sent to the primary replica in another node.
+
+        Args:
+            function_name: the written state name
+
+        Returns:
+            The ip address of the primary replica if it is in another node, else None.
+
+        Raises:
+            ConnectionError: the state monitor could not be asked where the primary replica is.
+        """
+        primary_ip = self.so.state_primary_search(function_name)
+        if primary_ip is None:
+            raise ConnectionError(f"primary replica of state {function_name} is unknown")
+        if primary_ip and primary_ip != self.so.node_ip:
+            return primary_ip
+        return None
+
+    def state_primary_handoff(self,function_name,primary_ip,state_data=None,version=None):
+        """Hand the primary replica of a state over to another node, before the monitor moves it.
+
+        The old primary replica redirects the writes to the new one from now on, waits for the
+        locked read in progress to write back, and sends its latest value and version to the new
+        primary replica, which takes it over unless its own version is later. The writes still
+        routed to the old primary replica by stale caches are redirected, so two primary replicas
+        never accept writes at once.
+
+        Args:
+            function_name: the state name
+            primary_ip: the ip of the new primary replica
+            state_data: the value sent by the old primary replica, on the new one
+            version: the version of the value sent, on the new one
+
+        Returns:
+            True once the new primary replica holds the latest value.
+
+        Raises:
+            TimeoutError: the locked read in progress did not write back in the bounded waiting time.
+        """
+        self.so.state_primary_set(function_name,primary_ip)
+        if primary_ip == self.so.node_ip:
+            if version is not None:
+                self.state_write(function_name,0,state_data,version=version)
+            return True
+
+        lock_obj = self.state_lock.get(function_name)
+        if lock_obj is None:
+            return True
+        lock_token = lock_obj.acquire()
+        try:
+            if lock_token is None:
+                raise TimeoutError(f"lock of state {function_name} timed out")
+            state_data, version = self.state_versioned_get(function_name)
+            self.so.state_primary_handoff_to(function_name,primary_ip,state_data,version)
+        except Exception:
+            # The primary replica stays here, ask the monitor again.
+            self.so.primary_cache.pop(function_name,None)
+            raise
+        finally:
+            lock_obj.release(lock_token)
+        return True
+
+    def state_version_gap(self,function_name):
+        """Tell the primary replica to send the full value, the lease stays held until that write.
+
+        Args:
+            function_name: the state whose patch can not be applied
+
+        Returns:
+            A dict containing the version gap flag and the local version.
+        """
+        return {"version_gap": True, "version": self.state_version.get(function_name)}
 
     def state_remove(self,function_name,type):
         """Provide the ability to remove a state replica in state manager for user and monitor.
@@ -180,101 +728,85 @@ class StateManager:
             # Remove afer move to external storage
             if type == 1 :
                 # Move to external from the stored stoarge layer.
-                sfm = StateFileManager()
-                if function_name in self.memory_state_storage: # Memory
-                    sfm.state_move_to_external_storage(function_name,self.memory_state_storage[function_name])
+                state_data = self.memory_state_storage.get(function_name,self.memory_state_storage)
+                if state_data is not self.memory_state_storage: # Memory
+                    self.so.state_move_to_external_storage(function_name,state_data)
                 else: # Disk
-                    sfm.state_move_to_external_storage_from_disk(function_name)
-                sfm.close()
+                    self.so.state_move_to_external_storage_from_disk(function_name)
             
             # Delete local state replica
-            del self.state_lock[function_name]
-            if function_name in self.memory_state_storage:
-                del self.memory_state_storage[function_name]
-            if os.path.exists(f"{WORKER_STATE_DISK_PATH}/{function_name}.json"):
-                os.remove(f"{WORKER_STATE_DISK_PATH}/{function_name}.json")
+            self.state_lock.pop(function_name,None)
+            self.scheduler.cancel(function_name)
+            self.state_access_log_clear(function_name)
+            self.memory_state_storage.pop(function_name,None)
+            self.so.disk.delete(function_name)
             
             # Tell monitor
             self.so.state_delete_tell_monitor(function_name)
 
 
-    def state_activity_change(self):
-        """Manage the active scheduling of state replicas' temperature."""
-        while True :
-            # Record the current time and local memory utilization.
-            current_time = time.time()
-            memory_utilization = self.so.get_memory_utilization()
-            
-            # Check every state replica locally
-            for function_name in self.state_lock:
-                # Compute the access time in 120 seconds
-                f = 0
-                for access_time in self.state_access_log[function_name] :
-                    if current_time - access_time < 120:
-                        f += 1
-
-                # Schedule the temperature according to the messages. 
-                if current_time - self.state_access_time[function_name] >= 1000000 :
-                    activity_temp = 0 # cold
-                elif f >= 10 and memory_utilization < 0.8 : 
-                    activity_temp = 2 # hot
-                else : 
-                    activity_temp = 1 # warm
-                
-                # Judge by the state size if hot.
-                if activity_temp == 2:
-                    # Compute size
-                    if function_name in self.memory_state_storage:
-                        data_size = sys.getsizeof(self.memory_state_storage[function_name])
-                    else:
-                        data_size = sys.getsizeof(self.so.state_load_from_local_disk(function_name)) 
-
-                    # Judege
-                    if data_size > 1024 or  psutil.virtual_memory().percent > 60 :
-                        activity_temp = 1 # warm
-
-                # If temperature is not changed
-                if activity_temp == self.state_activity[function_name] :
-                    continue
-
-                # If temperature is changed
-                else:
-                    # To hot, we update state to memory.
-                    if activity_temp == 2 :
-                        if function_name not in self.memory_state_storage : 
-                            self.memory_state_storage[function_name] = funcs.state_load_from_local_disk(function_name)
-                    
-                    # To cold, we delete state in meory first.
-                    elif activity_temp == 0 :
-                        if function_name in self.memory_state_storage :
-                            self.so.save_dict_to_file(function_name,self.memory_state_storage[function_name])
-                            del self.memory_state_storage[function_name]
-
-                    # Tell state monitor, and the cold state will be scheduling to external storage by top layer.
-                    self.state_activity[function_name] =  activity_temp
-                    self.so.activity_update_tell(function_name,activity_temp)
-            
-            # Schedule once every 5 minitues.
-            time.sleep(300)
+    def state_activity_evaluate(self,function_name):
+        """Schedule the temperature of a state replica when its check is due.
 
+        Args:
+            function_name: the checked state name
 
-    def state_semi_activity_manager(self):
-        """Manage the warm temperature."""
-        while True:
-            # Record the current time.
-            current_time = time.time()
-
-            # Check every warm state existing in local memory.
-            for function_name in self.state_lock:
-                if function_name in self.memory_state_storage :
-                    
-                    # Judge if last access time is greater than 60 seconds from now.
-                    if self.state_activity[function_name] == 1 and current_time - self.state_access_time[function_name] > 60 :
-                        if function_name in self.memory_state_storage:
-                            
-                            # Save state to local disk and remove the replica in memorty
-                            self.so.save_dict_to_file(function_name,self.memory_state_storage[function_name])
-                            del self.memory_state_storage[function_name]
-
-            # Schedule once every 30 seconds.
-            time.sleep(30)
\ No newline at end of file
+        Returns:
+            The time of the next check of the state, or None if the state was removed.
+        """
+        if function_name not in self.state_lock:
+            return None
+        current_time = time.time()
+        access_time = self.state_access_time.get(function_name,current_time)
+        access_rate = self.state_access_log.get(function_name)
+
+        # Schedule the temperature according to the messages.
+        if current_time - access_time >= STATE_COLD_IDLE_SECONDS :
+            activity_temp = 0 # cold
+        elif access_rate is not None and access_rate.count(STATE_HOT_WINDOW,current_time) >= STATE_HOT_ACCESSES :
+            activity_temp = 2 # hot
+        else :
+            activity_temp = 1 # warm
+
+        # Judge by the state size if hot.
+        if activity_temp == 2:
+            # Compute the deep size
+            data_size = self.memory_state_storage.sizes.get(function_name)
+            if data_size is None:
+                data_size = StateMemoryCache.sizeof(self.state_versioned_get(function_name)[0])
+
+            # Judge whether the state is small enough and fits in the memory budget.
+            if data_size > STATE_HOT_MAX_BYTES or not self.memory_state_storage.fits(function_name,data_size):
+                activity_temp = 1 # warm
+
+        # If temperature is changed
+        if activity_temp != self.state_activity.get(function_name):
+            # To hot, we update state to memory.
+            if activity_temp == 2 :
+                self.state_promote(function_name)
+            
+            # To cold, we delete state in meory first.
+            elif activity_temp == 0 :
+                self.memory_state_storage.evict(function_name)
+
+            # Tell state monitor, and the cold state will be scheduling to external storage by top layer.
+            self.state_activity[function_name] =  activity_temp
+            self.so.activity_update_tell(function_name,activity_temp)
+
+        # Save an idle warm state to local disk and remove the replica in memory.
+        if activity_temp == 1 and current_time - access_time > STATE_WARM_IDLE_SECONDS:
+            self.memory_state_storage.evict(function_name)
+
+        # Check again when the state may turn idle or cold, or cool down if hot.
+        if activity_temp == 0:
+            return None
+        due_time = access_time + STATE_COLD_IDLE_SECONDS
+        if activity_temp == 1 and function_name in self.memory_state_storage:
+            due_time = min(due_time, access_time + STATE_WARM_IDLE_SECONDS)
+        if activity_temp == 2:
+            due_time = min(due_time, current_time + STATE_HOT_RECHECK_SECONDS)
+        return due_time
+
+    def state_activity_manager(self):
+        """Manage the temperature of state replicas, checking every state when its next check is due."""
+        self.scheduler.run(self.state_activity_evaluate)
@@ -0,0 +1,416 @@
+"""StateMemoryCache() class aims to hold the hot state replicas in memory within a byte budget.
+
+Typical usage example:
+
+    smc = StateMemoryCache(demote=so.save_dict_to_file)
+    smc[function_name] = state_data
+    if not smc.hit(function_name):
+        admitted, victims = smc.promote(function_name, state_data_from_disk)
+        smc.demote_victims(victims)
+"""
+import collections
+import collections.abc
+import random
+import sys
+import threading
+
+# config.py
+WORKER_STATE_MEMORY_BUDGET = 256 * 1024 * 1024
+WORKER_STATE_MEMORY_POLICY = "lru"
+
+class LruPolicy:
+    """Evict the state replica least recently accessed."""
+
+    def __init__(self):
+        """Initial the LruPolicy class."""
+        self.order = collections.OrderedDict()
+
+    def access(self,key):
+        """Record an access of a state replica in memory."""
+        self.order[key] = None
+        self.order.move_to_end(key)
+
+    def remove(self,key):
+        """Forget a state replica leaving memory."""
+        self.order.pop(key,None)
+
+    def victim(self,exclude=None):
+        """Choose the state replica to evict, never the excluded one.
+
+        Returns:
+            The state name, or None if there is no other replica.
+        """
+        for key in self.order:
+            if key != exclude:
+                return key
+        return None
+
+    def admit(self,candidate,victim):
+        """Every new state replica is admitted to memory."""
+        return True
+
+class LfuPolicy:
+    """Evict the state replica least frequently accessed, the least recently accessed one among
+    equal frequencies, in constant time with one insertion ordered bucket per frequency."""
+
+    def __init__(self):
+        """Initial the LfuPolicy class."""
+        self.freq = {}
+        self.buckets = collections.defaultdict(collections.OrderedDict)
+        self.min_freq = 0
+
+    def access(self,key):
+        """Record an access of a state replica in memory."""
+        count = self.freq.get(key,0)
+        if count:
+            del self.buckets[count][key]
+            if not self.buckets[count]:
+                del self.buckets[count]
+                if self.min_freq == count:
+                    self.min_freq = count + 1
+        else:
+            self.min_freq = 1
+        self.freq[key] = count + 1
+        self.buckets[count + 1][key] = None
+
+    def remove(self,key):
+        """Forget a state replica leaving memory."""
+        count = self.freq.pop(key,None)
+        if count is None:
+            return
+        del self.buckets[count][key]
+        if not self.buckets[count]:
+            del self.buckets[count]
+            if self.min_freq == count:
+                self.min_freq = min(self.buckets) if self.buckets else 0
+
+    def victim(self,exclude=None):
+        """Choose the state replica to evict, never the excluded one.
+
+        Returns:
+            The state name, or None if there is no other replica.
+        """
+        for count in ([self.min_freq] if self.min_freq in self.buckets else []) + sorted(self.buckets):
+            for key in self.buckets[count]:
+                if key != exclude:
+                    return key
+        return None
+
+    def admit(self,candidate,victim):
+        """Every new state replica is admitted to memory."""
+        return True
+
+class TinyLfuPolicy(LruPolicy):
+    """Evict in LRU order, but admit a new state replica only if it was accessed more often than
+    the replica it would evict (W-TinyLFU admission), so a scan of rarely read states can not
+    flush the frequently read ones out of memory.
+
+    The access frequencies of all states, in memory or not, are estimated by a count-min sketch
+    whose counters are halved every sample_size accesses to forget old popularity.
+    """
+
+    DEPTH = 4
+
+    def __init__(self,width=4096):
+        """Initial the TinyLfuPolicy class."""
+        super().__init__()
+        self.width = width
+        self.sketch = [[0] * width for _ in range(self.DEPTH)]
+        self.seeds = [random.getrandbits(32) for _ in range(self.DEPTH)]
+        self.sample_size = 10 * width
+        self.samples = 0
+
+    def record(self,key):
+        """Count an access of a state in the frequency sketch."""
+        for row, seed in zip(self.sketch,self.seeds):
+            index = hash((seed,key)) % self.width
+            row[index] = min(row[index] + 1, 15)
+        self.samples += 1
+        if self.samples >= self.sample_size:
+            for row in self.sketch:
+                for index in range(self.width):
+                    row[index] >>= 1
+            self.samples //= 2
+
+    def frequency(self,key):
+        """Estimate the recent access frequency of a state."""
+        return min(row[hash((seed,key)) % self.width] for row, seed in zip(self.sketch,self.seeds))
+
+    def access(self,key):
+        """Record an access of a state replica in memory."""
+        super().access(key)
+        self.record(key)
+
+    def admit(self,candidate,victim):
+        """Admit a new state replica only if it is more popular than the victim."""
+        return self.frequency(candidate) > self.frequency(victim)
+
+class StateMemoryCache(collections.abc.MutableMapping):
+    """The memory tier of the state manager, a dict of state replicas whose total deep size is
+    bounded by a byte budget.
+
+    Every insert is charged with the deep size of the value, and replicas chosen by the eviction
+    policy are demoted to the disk tier until the memory tier fits in the budget again. Accesses
+    are recorded by hit(), which the readers call before loading a replica from disk.
+
+    A written replica is always admitted, the admission policy only applies to replicas promoted
+    from the disk tier by promote(). The victims are taken out under the lock and saved to disk
+    after it is released, one at a time, and stay readable until their save completes. A victim
+    failing to be saved stays readable and its save is retried by the next demotion. put() and
+    promote() hand the victims back to the caller, which saves them by demote_victims() once it
+    released its own locks.
+
+    Attributes:
+        budget: the maximum total size in bytes of the replicas in memory.
+        policy: the eviction policy object, chosen from POLICIES.
+        demote: the function saving an evicted replica to the disk tier.
+        sizes: a dict with state names as keys and the deep size of their values as values.
+        used: the total size in bytes of the replicas in memory.
+        demoting: a dict with state names as keys and the evicted values being saved as values.
+        failed: the set of state names in demoting whose save failed, to be retried.
+    """
+
+    POLICIES = {"lru": LruPolicy, "lfu": LfuPolicy, "tinylfu": TinyLfuPolicy}
+
+    def __init__(self,demote,budget=WORKER_STATE_MEMORY_BUDGET,policy=WORKER_STATE_MEMORY_POLICY):
+        """Initial the StateMemoryCache class with the configured budget and policy."""
+        self.budget = budget
+        self.policy = self.POLICIES[policy]()
+        self.policy_name = policy
+        self.demote = demote
+        self.data = {}
+        self.sizes = {}
+        self.used = 0
+        self.demoting = {}
+        self.failed = set()
+        self.lock = threading.Lock()
+        self.demote_lock = threading.Lock()
+
+        # Cache statistics
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.rejections = 0
+        self.evicted_bytes = 0
+
+    @staticmethod
+    def sizeof(obj):
+        """Measure the deep size of a state value, counting every object it references once.
+
+        Returns:
+            The size in bytes.
+        """
+        seen = set()
+        stack = [obj]
+        size = 0
+        while stack:
+            item = stack.pop()
+            if id(item) in seen:
+                continue
+            seen.add(id(item))
+            size += sys.getsizeof(item)
+            if isinstance(item, dict):
+                stack.extend(item.keys())
+                stack.extend(item.values())
+            elif isinstance(item, (list, tuple, set, frozenset)):
+                stack.extend(item)
+        return size
+
+    def hit(self,key):
+        """Look up a state replica for a read, recording the hit or the miss.
+
+        Returns:
+            True if the replica is in memory.
+        """
+        with self.lock:
+            if key in self.data or key in self.demoting:
+                self.hits += 1
+                if key in self.data:
+                    self.policy.access(key)
+                return True
+            self.misses += 1
+            if isinstance(self.policy, TinyLfuPolicy):
+                self.policy.record(key)
+            return False
+
+    def fits(self,key,size):
+        """Check whether a value of the given size could stay in memory without evictions."""
+        with self.lock:
+            return self.used - self.sizes.get(key,0) + size <= self.budget
+
+    def promote(self,key,value,size=None):
+        """Insert a replica read from the disk tier, unless the policy refuses to admit it in
+        place of a more popular one or the replica is in memory already.
+
+        Args:
+            key: the state name
+            value: the value read from the disk tier
+            size: the deep size of the value, measured if None
+
+        Returns:
+            A tuple of whether the replica is in memory and the victims to pass to demote_victims().
+        """
+        size = self.sizeof(value) if size is None else size
+        with self.lock:
+            if key in self.data or key in self.demoting:
+                return True, []
+            if self.used + size > self.budget:
+                victim = self.policy.victim(exclude=key)
+                if victim is not None and not self.policy.admit(key,victim):
+                    self.rejections += 1
+                    return False, []
+            return True, self._insert(key,value,size)
+
+    def put(self,key,value,size=None):
+        """Insert a written replica without saving the victims, for a caller holding its own lock.
+
+        Returns:
+            The victims to pass to demote_victims() once the caller's lock is released.
+        """
+        size = self.sizeof(value) if size is None else size
+        with self.lock:
+            return self._insert(key,value,size)
+
+    def demote_victims(self,victims):
+        """Save the victims returned by put() or promote() to the disk tier."""
+        self._demote(victims)
+
+    def evict(self,key):
+        """Demote a replica to the disk tier now, as if it was chosen as a victim.
+
+        Returns:
+            True if the replica was in memory.
+        """
+        with self.lock:
+            value = self.data.pop(key,self)
+            if value is self:
+                return False
+            self.demoting[key] = value
+            self.used -= self.sizes.pop(key)
+            self.policy.remove(key)
+        self._demote([(key, value)])
+        return True
+
+    def get(self,key,default=None):
+        """Get a replica in memory or being demoted in one lookup."""
+        with self.lock:
+            if key in self.data:
+                return self.data[key]
+            return self.demoting.get(key,default)
+
+    def __getitem__(self,key):
+        value = self.get(key,self)
+        if value is self:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self,key,value):
+        size = self.sizeof(value)
+        with self.lock:
+            victims = self._insert(key,value,size)
+        self._demote(victims)
+
+    def __delitem__(self,key):
+        # Wait for the save of a victim, so a removal of the disk copy after this one is not undone.
+        if key in self.demoting:
+            with self.demote_lock:
+                self._delete(key)
+        else:
+            self._delete(key)
+
+    def _delete(self,key):
+        """Drop a replica from memory or from the victims being demoted, if it is still there."""
+        with self.lock:
+            self.demoting.pop(key,None)
+            self.failed.discard(key)
+            if self.data.pop(key,self) is self:
+                return
+            self.used -= self.sizes.pop(key)
+            self.policy.remove(key)
+
+    def __contains__(self,key):
+        return key in self.data or key in self.demoting
+
+    def __iter__(self):
+        return iter(list(self.data))
+
+    def __len__(self):
+        return len(self.data)
+
+    def snapshot(self):
+        """Copy the replicas in memory to a plain dict."""
+        with self.lock:
+            return dict(self.data)
+
+    def stats(self):
+        """Acquire the budget usage and the hit, miss and eviction counts of the memory tier.
+
+        Returns:
+            A dict of the statistics.
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "policy": self.policy_name,
+                "budget": self.budget,
+                "used": self.used,
+                "states": len(self.data),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "rejections": self.rejections,
+                "evicted_bytes": self.evicted_bytes,
+            }
+
+    def _insert(self,key,value,size):
+        """Insert a replica and take out the victims making the memory tier fit in the budget
+        again, the lock must be held. The inserted replica is never evicted to make room for itself.
+
+        Returns:
+            A list of the (state name, value) victims to demote.
+        """
+        self.demoting.pop(key,None) # The value being demoted is outdated
+        self.failed.discard(key)
+        self.used += size - self.sizes.get(key,0)
+        self.data[key] = value
+        self.sizes[key] = size
+        self.policy.access(key)
+
+        victims = []
+        while self.used > self.budget:
+            victim = self.policy.victim(exclude=key)
+            if victim is None:
+                break
+            victims.append((victim, self.data[victim]))
+            self.demoting[victim] = self.data[victim]
+            self.evictions += 1
+            self.evicted_bytes += self.sizes[victim]
+            del self.data[victim]
+            self.used -= self.sizes.pop(victim)
+            self.policy.remove(victim)
+        return victims
+
+    def _demote(self,victims):
+        """Save the victims and the ones whose save failed before to the disk tier without
+        holding the lock, skipping the ones written or removed meanwhile, and stop serving them
+        from memory once saved. A victim failing to be saved stays in demoting."""
+        with self.lock:
+            victims = [(key, self.demoting[key]) for key in self.failed if key in self.demoting] + list(victims)
+            self.failed.clear()
+        for key, value in victims:
+            with self.demote_lock:
+                with self.lock:
+                    if self.demoting.get(key) is not value:
+                        continue
+                try:
+                    self.demote(key,value)
+                except Exception as e:
+                    print(f"Demotion error: {e}") # Error handling
+                    with self.lock:
+                        if self.demoting.get(key) is value:
+                            self.failed.add(key)
+                    continue
+                with self.lock:
+                    if self.demoting.get(key) is value:
+                        del self.demoting[key]
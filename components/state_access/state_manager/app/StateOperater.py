@@ -5,12 +5,19 @@ Typical usage example:
     sm = StateOperater()
     sm.get_node_ip()
 """
-import json
+import os
 import threading
-import requests
+import time
 import psutil
 
 from app import StateFileManager
+from app import StateTransport
+from app import ReplicaFanout
+from app import StateDelta
+from app import StateCodec
+from app import StateDiskStore
+from app import MonitorReporter
+from components import MonitorRing
 
 # config.py
 WORKER_STATE_DISK_PATH = ""
@@ -21,17 +28,33 @@ EXTERNAL_STATE_SERVER_USERNAME = ""
 EXTERNAL_STATE_SERVER_PASSWORD = ""
 EXTERNAL_STATE_SERVER_STORAGE_PATH = ""
 WORKER_STATE_DISK_PATH = ""
+STATE_REPLICATION_MODE = "delta"
+STATE_PRIMARY_CACHE_TTL = 10.0
 
 class StateOperater:
     """Help StateManager to manage states.
     
     Atributes:
         node_ip: local ip address
+        transport: the pooled HTTP transport shared by all outbound requests of this process.
+        fanout: the engine sending lock and unlock requests to the replicas concurrently.
+        primary_cache: a dict with state name as keys and [primary ip, expire time] as values.
+        codec: the serializer of state payloads sent to other state managers.
+        disk: the local disk tier storing warm and cold state replicas.
+        ring: the consistent hash ring routing the requests about a state to its monitor partition.
+        reporter: the queue sending membership and temperature reports to the monitor in batches.
     """
 
     def __init__(self):
         """Initial the StateOperater class."""
         self.node_ip = self.get_node_ip()
+        self.transport = StateTransport.shared()
+        self.fanout = ReplicaFanout()
+        self.primary_cache = {}
+        self.codec = StateCodec()
+        self.disk = StateDiskStore()
+        self.ring = MonitorRing()
+        self.reporter = MonitorReporter(self.transport,self.ring)
     
     def get_node_ip(self):
         """Get local ip address.
@@ -51,9 +74,7 @@ class StateOperater:
         Args:
             function_name: state which will be saved to disk.
         """
-        filename = f"{WORKER_STATE_DISK_PATH}/{function_name}.json"
-        with open(filename, 'w') as file:
-            json.dump(state_data, file)
+        self.disk.save(function_name,state_data)
 
     def run_thread(self,thread_function):
         """Run a thread to help management."""
@@ -62,13 +83,17 @@ class StateOperater:
         thread.start()
 
     def state_new_tell_monitor(self,function_name):
-        """Tell monitor when creating a new state replica in state manager.
+        """Tell monitor when creating a new state replica in state manager, without waiting for
+        the next batch so the first write of a new state finds its primary replica.
         
         Args:
             function_name: state newly created.
         """
-        url = f'http://{MASTER_IP}:8053/state_change/add/{function_name}'
-        res = requests.post(url)
+        self.reporter.report("add",function_name)
+        try:
+            self.reporter.flush()
+        except Exception as e:
+            print(f"Report error: {e}") # Error handling
 
     def activity_update_tell(self,function_name,activity_temp):
         """Tell monitor to update the temperate of states.
@@ -77,45 +102,161 @@ class StateOperater:
             function_name: state whose temperature is changed
             activity_temp: new temperature
         """
-        url = f"http://{MASTER_IP}:8053/activity_change/{function_name}/{activity_temp}"
-        res = requests.post(url) 
+        self.reporter.report("activity",function_name,activity_temp)
 
-    def state_lock_of_other_nodes(self,function_name):
+    def state_primary_search(self,function_name):
+        """Search the primary replica location of a state, cached for STATE_PRIMARY_CACHE_TTL seconds.
+
+        Args:
+            function_name: the searched state name
+
+        Returns:
+            The ip address of the primary replica, "" if the monitor does not know the state, or
+            None if the monitor could not be asked.
+        """
+        entry = self.primary_cache.get(function_name)
+        if entry is not None and entry[1] > time.time():
+            return entry[0]
+
+        try:
+            res = self.ring.request(self.transport,"GET",f"primary_state_search/{function_name}",function_name)
+            primary_ip = res.json() if res.status_code == 200 else ""
+        except Exception as e:
+            print(f"Primary search error: {e}") # Error handling
+            return None
+        self.primary_cache[function_name] = [primary_ip, time.time() + STATE_PRIMARY_CACHE_TTL]
+        return primary_ip
+
+    def state_primary_set(self,function_name,primary_ip):
+        """Cache the primary replica location of a state known before the monitor records it."""
+        self.primary_cache[function_name] = [primary_ip, time.time() + STATE_PRIMARY_CACHE_TTL]
+
+    def state_primary_handoff_to(self,function_name,primary_ip,state_data,version):
+        """Send the value of a state and its version to its new primary replica.
+
+        Raises:
+            requests.HTTPError: the new primary replica did not take the value over.
+        """
+        url = f"http://{primary_ip}:8054/state_primary_handoff/{function_name}"
+        data = {"primary": primary_ip, "state_data": state_data, "version": version}
+        res = self.transport.post(url,**self.codec.request_kwargs(data))
+        res.raise_for_status()
+
+    def state_replicas_search(self,function_name):
+        """Search the replicas of a state located in other worker nodes.
+
+        Args:
+            function_name: the searched state name
+
+        Returns:
+            A list of ip addresses of other nodes holding the state replica.
+        """
+        res = self.ring.request(self.transport,"GET",f"state_search_all/{function_name}",function_name)
+        nodes_list = res.json()
+
+        # Filter out the local node and external storage
+        return [node_ip for node_ip in nodes_list if node_ip != self.node_ip and node_ip != "externalstorage"]
+
+    def state_lock_of_other_nodes(self,function_name,token=None):
         """Tell other nodes to lock their state with pointed state name.
         
         Args:
             function_name: state locked
+            token: the fencing token of the local lease adopted by the replicas
+
+        Returns:
+            The fanout report with the success and latency of every replica.
         """
         # Search all replicas' locations
-        url = f"http://{MASTER_IP}:8053/state_search_all/{function_name}"
-        res = requests.get(url) 
-        nodes_list = res.json()
+        nodes_list = self.state_replicas_search(function_name)
 
-        # Send lock requests to other nodes
-        data = {"locked": 1 , "identity": 0 }
-        for node_ip in nodes_list:
-            if (not node_ip == self.node_ip) and (not node_ip == "externalstorage") :
-                url = f"http://{node_ip}:8054/state_read/{function_name}"
-                requests.get(url,json=data)
+        # Send lock requests to other nodes concurrently
+        data = {"locked": 1 , "identity": 0 , "token": token }
+        def send(node_ip,timeout):
+            url = f"http://{node_ip}:8054/state_read/{function_name}"
+            return self.transport.get(url,json=data,timeout=(self.transport.timeout[0],timeout))
+        return self.fanout.fanout(nodes_list,send)
 
-    def state_unlock_of_other_nodes(self,function_name,state_data):
+    def state_unlock_of_other_nodes(self,function_name,state_data,version,last_data=None,token=None):
         """Tell other nodes to update and unlock their state with pointed state name.
+
+        In "delta" replication mode, only the patch against the last replicated value is sent,
+        and the full value is sent to the replicas reporting a version gap.
         
         Args:
             function_name: state locked
             state_data: the new updated value of state data 
+            version: the replication version of the new value
+            last_data: the last replicated value, the full value is sent if None
+            token: the fencing token of the released lease
+
+        Returns:
+            The fanout report with the success and latency of every replica, and the highest
+            "ahead_version" of the replicas refusing the value as older than theirs, or None.
         """
         # Search all replicas' locations
-        url = f"http://{MASTER_IP}:8053/state_search_all/{function_name}"
-        res = requests.get(url) 
-        nodes_list = res.json()
+        nodes_list = self.state_replicas_search(function_name)
+
+        # Build the full and the delta messages
+        full_data = {"state_data" : state_data,"version": version,"token": token,"identity": 0 }
+        data = full_data
+        if STATE_REPLICATION_MODE == "delta" and last_data is not None:
+            patch = StateDelta().diff(last_data,state_data)
+            if not (len(patch) == 1 and patch[0]["path"] == ""):
+                data = {"patch": patch,"version": version,"base_version": version - 1,"token": token,"identity": 0 }
+
+        # Send requests to other nodes concurrently
+        def send(node_ip,timeout):
+            url = f"http://{node_ip}:8054/state_write/{function_name}"
+            res = self.transport.post(url,timeout=(self.transport.timeout[0],timeout),**self.codec.request_kwargs(data))
+            if data is not full_data and res.status_code < 400:
+                msg = self.codec.response_decode(res)
+                if isinstance(msg,dict) and msg.get("version_gap"):
+                    # Fall back to the full value
+                    res = self.transport.post(url,timeout=(self.transport.timeout[0],timeout),**self.codec.request_kwargs(full_data))
+            if res.status_code == 409:
+                msg = self.codec.response_decode(res)
+                if isinstance(msg,dict) and msg.get("stale_version"):
+                    ahead.append(msg["version"])
+            return res
+        ahead = []
+        report = self.fanout.fanout(nodes_list,send)
+        report["ahead_version"] = max(ahead) if ahead else None
+        return report
 
-        # Send requests to other nodes
-        data = {"state_data" : state_data,"identity": 0 }
-        for node_ip in nodes_list:
-            if (not node_ip == self.node_ip) and (not node_ip == "externalstorage") : # 筛去自己和外部存储
-                url = f"http://{node_ip}:8054/state_write/{function_name}"
-                requests.post(url,json=data)
+    def state_lock_renew_of_other_nodes(self,function_name,token):
+        """Tell other nodes to extend the lease of their locked state replica.
+
+        Args:
+            function_name: state locked
+            token: the fencing token of the lease
+
+        Returns:
+            The fanout report with the success and latency of every replica.
+        """
+        nodes_list = self.state_replicas_search(function_name)
+        data = {"token": token, "identity": 0 }
+        def send(node_ip,timeout):
+            url = f"http://{node_ip}:8054/state_lock_renew/{function_name}"
+            return self.transport.post(url,json=data,timeout=(self.transport.timeout[0],timeout))
+        return self.fanout.fanout(nodes_list,send)
+
+    def state_lock_release_of_other_nodes(self,function_name,token,nodes_list):
+        """Tell other nodes to release the lease of their locked state replica without writing it.
+
+        Args:
+            function_name: state locked
+            token: the fencing token of the lease
+            nodes_list: the ip addresses of the replicas locked with the token
+
+        Returns:
+            The fanout report with the success and latency of every replica.
+        """
+        data = {"token": token, "identity": 0 }
+        def send(node_ip,timeout):
+            url = f"http://{node_ip}:8054/state_lock_release/{function_name}"
+            return self.transport.post(url,json=data,timeout=(self.transport.timeout[0],timeout))
+        return self.fanout.fanout(nodes_list,send)
 
     def state_move_to_external_storage(self,function_name,state_data):
         """Move state from memory to external storage.
@@ -125,9 +266,7 @@ class StateOperater:
             state_data: the moved data value
         """
         self.save_dict_to_file(function_name, state_data)
-        sfm = StateFileManager(EXTERNAL_STATE_SERVER_IP,EXTERNAL_STATE_SERVER_USERNAME,EXTERNAL_STATE_SERVER_PASSWORD)
-        sfm.file_send(f"{WORKER_STATE_DISK_PATH}/{function_name}.json",f"{EXTERNAL_STATE_SERVER_STORAGE_PATH }/{function_name}.json")
-        sfm.close()
+        self.state_move_to_external_storage_from_disk(function_name)
 
     def state_move_to_external_storage_from_disk(self,function_name):
         """Move state from local disk to external storage.
@@ -135,14 +274,17 @@ class StateOperater:
         Args:
             function_name: the state name which will be moved.
         """
+        file_path, temporary = self.disk.export_file(function_name)
         sfm = StateFileManager(EXTERNAL_STATE_SERVER_IP,EXTERNAL_STATE_SERVER_USERNAME,EXTERNAL_STATE_SERVER_PASSWORD)
-        sfm.file_send(f"{WORKER_STATE_DISK_PATH}/{function_name}.json",f"{EXTERNAL_STATE_SERVER_STORAGE_PATH}/{function_name}.json")
+        sfm.file_send(file_path,f"{EXTERNAL_STATE_SERVER_STORAGE_PATH}/{function_name}.json")
         sfm.close()
+        if temporary:
+            os.remove(file_path)
+        self.reporter.report("external_add",function_name)
 
     def state_delete_tell_monitor(self,function_name):
         """Tell monitor that the removing operation has been completed ."""
-        url = f'http://{MASTER_IP}:8053/state_change/delete/{function_name}'
-        res = requests.post(url)
+        self.reporter.report("delete",function_name)
     
     def state_pull_from_other_nodes(self,function_name):
         """Pull a state from other nodes or external storage.
@@ -151,23 +293,25 @@ class StateOperater:
             function name: the state name which will be pulled.
 
         Returns:
-            state data pulled from other locations.
+            A tuple of the state data pulled from other locations and its version, None if the
+            state was pulled from external storage.
         """
         # Search master state location or external storage
-        url = f"http://{MASTER_IP}:8053/state_search/{function_name}"
-        res = requests.get(url) 
+        res = self.ring.request(self.transport,"GET",f"state_search/{function_name}",function_name)
         node_ip = res.json()
 
         # State in external storage
         if node_ip == "externalstorage":
             # Pull state
             sfm = StateFileManager(EXTERNAL_STATE_SERVER_IP,EXTERNAL_STATE_SERVER_USERNAME,EXTERNAL_STATE_SERVER_PASSWORD)
-            sfm.file_pull(EXTERNAL_STATE_SERVER_STORAGE_PATH,WORKER_STATE_DISK_PATH) 
+            file_path = f"{WORKER_STATE_DISK_PATH}/{function_name}.json"
+            sfm.file_pull(f"{EXTERNAL_STATE_SERVER_STORAGE_PATH}/{function_name}.json",file_path) 
             sfm.close()
-            state_data = self.state_load_from_local_disk(function_name) 
+            state_data = self.disk.import_file(function_name,file_path)
 
             # Remove state in external storage
             self.state_externalstorage_delete(function_name)
+            version = None
 
         # State in other worker nodes
         else:
@@ -176,19 +320,21 @@ class StateOperater:
                 "locked": 0 ,
                 "identity": 0 
             }
-            url = f"http://{node_ip}:8054/state_read/{function_name}"
-            state_data = requests.get(url,json=data)
+            url = f"http://{node_ip}:8054/state_read_versioned/{function_name}"
+            res = self.transport.get(url,**self.codec.request_kwargs(data))
+            res.raise_for_status()
+            msg = self.codec.response_decode(res)
+            state_data, version = msg["state_data"], msg["version"]
 
-        return state_data.json()
+        return state_data, version
 
-    def state_load_from_local_disk(function_name):
+    def state_load_from_local_disk(self,function_name):
         """Load state from local disk to local memory.
         
         Args:
             function_name: the state name which will be loaded.
         """
-        with open(f"{WORKER_STATE_DISK_PATH}/{function_name}.json", 'r') as json_file:
-            return json.load(json_file)
+        return self.disk.load(function_name)
 
     def get_memory_utilization():
         """Acquire the local memory utilization.
@@ -200,7 +346,7 @@ class StateOperater:
         memory_percent = memory_info.percent
         return memory_percent
 
-    def state_externalstorage_delete(function_name):
+    def state_externalstorage_delete(self,function_name):
         """Remove a state replica in external storage
 
         Args:
@@ -209,4 +355,5 @@ class StateOperater:
         sfm = StateFileManager(EXTERNAL_STATE_SERVER_IP,EXTERNAL_STATE_SERVER_USERNAME,EXTERNAL_STATE_SERVER_PASSWORD)
         delete_command = f"rm  -rf {EXTERNAL_STATE_SERVER_STORAGE_PATH}/{function_name}.json"
         stdin, stdout, stderr = sfm.ssh.exec_command(delete_command)
-        sfm.close()
\ No newline at end of file
+        sfm.close()
+        self.reporter.report("external_delete",function_name)
\ No newline at end of file
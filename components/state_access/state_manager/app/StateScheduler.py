@@ -0,0 +1,94 @@
+"""StateScheduler() class aims to run the temperature checks of state replicas when they are due.
+
+Typical usage example:
+
+    ss = StateScheduler()
+    ss.schedule(function_name, time.time() + 60)
+    ss.run(handler)
+"""
+import heapq
+import itertools
+import threading
+import time
+
+class StateScheduler:
+    """A priority queue of the next check time of every state replica, so a state is checked when
+    its deadline comes instead of every state being scanned periodically.
+
+    A state has at most one pending check, scheduling an earlier one supersedes it and the
+    superseded heap entry is skipped when popped.
+
+    Attributes:
+        heap: the heap of (due time, sequence, state name) entries.
+        pending: a dict with state names as keys and the due time of their pending check as values.
+    """
+
+    def __init__(self):
+        """Initial the StateScheduler class."""
+        self.heap = []
+        self.pending = {}
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+        self.fired = 0
+
+    def schedule(self,function_name,due_time):
+        """Check a state at due_time, unless a check is already pending before it."""
+        with self.condition:
+            if function_name in self.pending and self.pending[function_name] <= due_time:
+                return
+            self.pending[function_name] = due_time
+            heapq.heappush(self.heap, (due_time, next(self.sequence), function_name))
+
+            # Wake up the runner if the new check is the earliest one.
+            if self.heap[0][2] == function_name:
+                self.condition.notify()
+
+    def cancel(self,function_name):
+        """Drop the pending check of a state."""
+        with self.condition:
+            self.pending.pop(function_name,None)
+
+    def next_due(self):
+        """Pop the next due state, waiting until its check is due, the condition must be held.
+
+        Returns:
+            The state name.
+        """
+        while True:
+            if not self.heap:
+                self.condition.wait()
+                continue
+            due_time, _, function_name = self.heap[0]
+            if self.pending.get(function_name) != due_time:
+                heapq.heappop(self.heap) # Superseded or cancelled
+                continue
+            remaining = due_time - time.time()
+            if remaining > 0:
+                self.condition.wait(remaining)
+                continue
+            heapq.heappop(self.heap)
+            del self.pending[function_name]
+            return function_name
+
+    def run(self,handler):
+        """Run the due checks forever.
+
+        Args:
+            handler: the function checking a state, returning the time of its next check or None.
+        """
+        while True:
+            with self.condition:
+                function_name = self.next_due()
+                self.fired += 1
+            try:
+                due_time = handler(function_name)
+            except Exception as e:
+                print(f"Thread error: {e}") # Error handling
+                continue
+            if due_time is not None:
+                self.schedule(function_name,due_time)
+
+    def stats(self):
+        """Acquire the number of pending and fired checks."""
+        with self.condition:
+            return {"pending": len(self.pending), "heap": len(self.heap), "fired": self.fired}
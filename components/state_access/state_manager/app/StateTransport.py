@@ -0,0 +1,134 @@
+"""StateTransport() class aims to provide pooled keep-alive HTTP connections for the state manager.
+
+Typical usage example:
+
+    st = StateTransport.shared()
+    res = st.get(f"http://{MASTER_IP}:8053/state_search/{function_name}")
+    st.stats()
+"""
+import threading
+import weakref
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+
+# config.py
+STATE_HTTP_POOL_CONNECTIONS = 16
+STATE_HTTP_POOL_MAXSIZE = 32
+STATE_HTTP_CONNECT_TIMEOUT = 1.0
+STATE_HTTP_READ_TIMEOUT = 10.0
+
+class StateTransport:
+    """Send HTTP requests of the state manager to the monitor and other managers through one
+    shared session, so the TCP connection to every peer is kept alive and reused.
+
+    Attributes:
+        session: the requests session holding one connection pool per peer.
+        adapter: the HTTP adapter configured with the pool sizes.
+        timeout: the default (connect, read) timeout of every request.
+        pool_hits: the number of requests served by an already opened connection.
+        pool_misses: the number of requests which had to open a new connection.
+        peer_stats: a dict with peer address as keys and their hits, misses and errors as values.
+        pool_seen: the connections and requests counts of every urllib3 pool already accounted.
+    """
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self,pool_connections=STATE_HTTP_POOL_CONNECTIONS,pool_maxsize=STATE_HTTP_POOL_MAXSIZE,
+                 connect_timeout=STATE_HTTP_CONNECT_TIMEOUT,read_timeout=STATE_HTTP_READ_TIMEOUT):
+        """Initial the StateTransport class and mount the pooled adapter.
+
+        Args:
+            pool_connections: the number of peers whose connection pools are cached.
+            pool_maxsize: the maximum number of kept-alive connections to one peer.
+            connect_timeout: seconds to wait for a new connection to be established.
+            read_timeout: seconds to wait for a peer's response.
+        """
+        self.session = requests.Session()
+        self.adapter = HTTPAdapter(pool_connections=pool_connections,pool_maxsize=pool_maxsize)
+        self.session.mount("http://", self.adapter)
+        self.session.mount("https://", self.adapter)
+        self.timeout = (connect_timeout, read_timeout)
+        self.pool_hits = 0
+        self.pool_misses = 0
+        self.peer_stats = {}
+        self.pool_seen = weakref.WeakKeyDictionary()
+        self.stats_lock = threading.Lock()
+
+    @classmethod
+    def shared(cls):
+        """Get the transport shared by every component in this process.
+
+        Returns:
+            The StateTransport object of the process, created on first use.
+        """
+        if cls._shared is None:
+            with cls._shared_lock:
+                if cls._shared is None:
+                    cls._shared = cls()
+        return cls._shared
+
+    def request(self,method,url,timeout=None,**kwargs):
+        """Send a request through the pooled session and count the connections it reused or opened.
+
+        Args:
+            method: "GET" or "POST".
+            url: the requested url.
+            timeout: the timeout of this request, the default timeout is used if None.
+            kwargs: other arguments passed to requests, such as json.
+
+        Returns:
+            The requests response object.
+        """
+        try:
+            res = self.session.request(method,url,timeout=timeout or self.timeout,**kwargs)
+        except requests.RequestException:
+            self._count(urlparse(url).netloc,"errors")
+            raise
+        self._count_pool(getattr(res.raw,"_pool",None))
+        return res
+
+    def _count_pool(self,pool):
+        """Account the requests sent by the urllib3 pool which served a response since it was
+        last seen, a request which did not open a new connection reused a kept-alive one."""
+        if pool is None:
+            return
+        with self.stats_lock:
+            seen_connections, seen_requests = self.pool_seen.get(pool,(0, 0))
+            misses = pool.num_connections - seen_connections
+            hits = max(pool.num_requests - seen_requests - misses, 0)
+            self.pool_seen[pool] = (pool.num_connections, pool.num_requests)
+            peer = self.peer_stats.setdefault(f"{pool.host}:{pool.port}",{"hits": 0, "misses": 0, "errors": 0})
+            peer["hits"] += hits
+            peer["misses"] += misses
+            self.pool_hits += hits
+            self.pool_misses += misses
+
+    def get(self,url,**kwargs):
+        """Send a GET request through the pooled session."""
+        return self.request("GET",url,**kwargs)
+
+    def post(self,url,**kwargs):
+        """Send a POST request through the pooled session."""
+        return self.request("POST",url,**kwargs)
+
+    def _count(self,peer,counter):
+        """Update a per-peer counter."""
+        with self.stats_lock:
+            if peer not in self.peer_stats:
+                self.peer_stats[peer] = {"hits": 0, "misses": 0, "errors": 0}
+            self.peer_stats[peer][counter] += 1
+
+    def stats(self):
+        """Acquire the connection pool counters.
+
+        Returns:
+            A dict containing the global hits and misses and the counters of every peer.
+        """
+        with self.stats_lock:
+            return {
+                "pool_hits": self.pool_hits,
+                "pool_misses": self.pool_misses,
+                "peers": {peer: dict(counters) for peer, counters in self.peer_stats.items()},
+            }
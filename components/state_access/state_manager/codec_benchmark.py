@@ -0,0 +1,60 @@
+'''
+Benchmark of the state wire formats, run codec_benchmark.py in the state manager directory to compare
+the encode and decode cost and the bytes on the wire of JSON and the installed binary formats.
+'''
+import os
+import random
+import time
+
+from app.StateCodec import StateCodec
+
+ROUNDS = 20
+
+def sample_states():
+    """Build the sample states: a numeric vector, a nested session dict and a binary blob.
+
+    Returns:
+        A dict with sample names as keys and state values as values.
+    """
+    random.seed(0)
+    return {
+        "numeric": [random.random() for _ in range(100000)],
+        "session": {f"user{i}": {"visits": i, "cart": list(range(i % 20)), "name": f"name{i}"} for i in range(10000)},
+        "blob": os.urandom(1024 * 1024),
+    }
+
+def measure(codec,state_data,content_type,content_encoding):
+    """Measure one format and compression on one state.
+
+    Returns:
+        A tuple of the encoded size in bytes, the encode and the decode time in milliseconds, or
+        None if the format can not carry the state.
+    """
+    try:
+        body, headers = codec.encode(state_data,content_type,content_encoding)
+    except TypeError:
+        return None # JSON can not carry raw bytes
+
+    start_time = time.perf_counter()
+    for _ in range(ROUNDS):
+        body, headers = codec.encode(state_data,content_type,content_encoding)
+    encode_time = (time.perf_counter() - start_time) * 1000 / ROUNDS
+
+    start_time = time.perf_counter()
+    for _ in range(ROUNDS):
+        codec.decode(body,headers["Content-Type"],headers.get("X-State-Encoding"))
+    decode_time = (time.perf_counter() - start_time) * 1000 / ROUNDS
+    return len(body), encode_time, decode_time
+
+if __name__ == '__main__':
+    codec = StateCodec()
+    print(f"{'state':<10}{'format':<22}{'compression':<13}{'bytes':>12}{'encode ms':>12}{'decode ms':>12}")
+    for name, state_data in sample_states().items():
+        for content_type in codec.formats:
+            for content_encoding in [None] + list(codec.compressions):
+                result = measure(codec,state_data,content_type,content_encoding)
+                if result is None:
+                    print(f"{name:<10}{content_type:<22}{str(content_encoding):<13}{'unsupported':>12}")
+                    continue
+                size, encode_time, decode_time = result
+                print(f"{name:<10}{content_type:<22}{str(content_encoding):<13}{size:>12}{encode_time:>12.2f}{decode_time:>12.2f}")
@@ -4,32 +4,90 @@ Entry to the state manager, run manage.py on every worker node to start the stat
 The state manager takes charge in the local state management among 3 storage layers, and communicate
 with global state monitor and state managers in other worker nodes to achieve the state scheduling.
 '''
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, redirect, Response
 
 from .app import StateManager
+from .app import StateCodec
+from ... import AppServer
 
 app = Flask(__name__)
 SM = StateManager()
+SC = StateCodec()
+SERVER = AppServer(app,8054,"state_manager")
+
+def state_payload():
+    """Decode a request body sent as JSON or in a binary wire format."""
+    if request.mimetype in ("", "application/json"):
+        return request.get_json()
+    return SC.decode(request.get_data(),request.mimetype,request.headers.get("X-State-Encoding"))
+
+def state_response_is_json():
+    """Check whether the requester accepts plain uncompressed JSON."""
+    content_type = request.accept_mimetypes.best_match(list(SC.formats),default="application/json")
+    content_encoding = SC.negotiate_encoding(request.headers.get("X-State-Accept-Encoding"))
+    return content_type == "application/json" and content_encoding is None
+
+def state_response(obj,status=200,headers=None):
+    """Encode a response in the wire format accepted by the requester, JSON by default."""
+    content_type = request.accept_mimetypes.best_match(list(SC.formats),default="application/json")
+    content_encoding = SC.negotiate_encoding(request.headers.get("X-State-Accept-Encoding"))
+    if content_type == "application/json" and content_encoding is None:
+        res = jsonify(obj)
+    else:
+        body, body_headers = SC.encode(obj,content_type,content_encoding)
+        res = Response(body,headers=body_headers)
+    res.status_code = status
+    res.headers.update(headers or {})
+    return res
+
+def state_redirect(result,path):
+    """Redirect a write aimed at a stale primary to the primary replica, keeping the method and body."""
+    res = redirect(f"http://{result['redirect']}:8054/{path}",code=307)
+    res.set_data(jsonify(result).get_data())
+    res.mimetype = "application/json"
+    return res
 
 @app.route('/state_memory_get',methods=['GET'])
 def state_memory_get():
     """The interface to get all the state replicas in memory locally managed by the state manager."""
-    return jsonify(SM.memory_state_storage)
+    return jsonify(SM.memory_state_storage.snapshot())
+
+@app.route('/state_memory_stats',methods=['GET'])
+def state_memory_stats():
+    """The interface to get the budget usage and the hit, miss and eviction counts of the memory tier."""
+    return jsonify(SM.memory_state_storage.stats()),200
 
 @app.route('/state_lock_get',methods=['GET'])
 def state_lock_get():
     """The interface to get all the state locks  locally managed by the state manager."""
     return jsonify(SM.state_lock_get()),200
 
+@app.route('/state_lock_renew/<function_name>',methods=['POST'])
+def state_lock_renew(function_name):
+    """The interface to extend the lease of a locked state replica."""
+    renewed = SM.state_lock_renew(function_name,request.get_json()['token'],request.get_json().get('identity',1))
+    return jsonify(renewed),200 if renewed else 409
+
+@app.route('/state_lock_release/<function_name>',methods=['POST'])
+def state_lock_release(function_name):
+    """The interface to release the lease of a locked state replica without writing it."""
+    released = SM.state_lock_release(function_name,request.get_json()['token'],request.get_json().get('identity',1))
+    return jsonify(released),200 if released else 409
+
 @app.route('/state_access_time_get',methods=['GET'])
 def state_access_time_get():
     """The interface to get all the times of state replicas locally managed by the state manager."""
-    return jsonify(SM.state_access_time)
+    return jsonify(SM.state_access_time.snapshot())
+
+@app.route('/state_access_rate_get',methods=['GET'])
+def state_access_rate_get():
+    """The interface to get the access counts in several windows and the decayed access rates of state replicas."""
+    return jsonify(SM.state_access_rate_get()),200
 
 @app.route('/state_create/<function_name>',methods=['POST'])
 def state_create(function_name):
     """The interface to create a state replica locally."""
-    return jsonify(SM.state_create(function_name,request.get_json()['value'])) , 200
+    return jsonify(SM.state_create(function_name,state_payload()['value'])) , 200
 
 @app.route('/state_monitor_get',methods=['GET'])
 def state_monitor_get():
@@ -39,24 +97,119 @@ def state_monitor_get():
 @app.route('/state_read/<function_name>',methods=['GET'])
 def state_read(function_name):
     """The interface for serverless stateful functions to read a specific state replica."""
-    return jsonify(SM.state_read(function_name,request.get_json()['locked'],request.get_json()['identity'])),200
+    data = state_payload()
+    try:
+        # Stream a large warm replica from its memory-mapped file to a JSON reader.
+        if data['locked'] == 0 and state_response_is_json():
+            raw = SM.state_read_raw(function_name,data['identity'],request.headers.get("X-State-Origin"))
+            if raw is not None:
+                return Response(raw[1],mimetype="application/json",headers={"Content-Length": str(raw[0])})
+        # Return the fencing token of the lease taken by this read to the locking function.
+        if data['locked'] == 1 and data['identity'] == 1:
+            msg = SM.state_read(function_name,1,1,versioned=True)
+            return state_response(msg["state_data"],200,{"X-State-Lock-Token": str(msg["token"])})
+        state_data = SM.state_read(function_name,data['locked'],data['identity'],token=data.get('token'),
+                                   origin=request.headers.get("X-State-Origin"))
+    except TimeoutError as e:
+        return jsonify({"error": str(e)}),423
+    return state_response(state_data,200)
 
 @app.route('/state_write/<function_name>',methods=['POST'])
 def state_write(function_name):
     """The interface for serverless stateful functions to write a specific state replica."""
-    return jsonify(SM.state_write(function_name,request.get_json()['identity'],request.get_json()['state_data'])),200
+    data = state_payload()
+    try:
+        result = SM.state_write(function_name,data['identity'],data.get('state_data'),data.get('patch'),
+                                data.get('version'),data.get('base_version'),data.get('token'),
+                                request.headers.get("X-State-Origin"))
+    except ConnectionError as e:
+        return jsonify({"error": str(e)}),503
+    if isinstance(result,dict) and (result.get("stale_token") or result.get("stale_version")):
+        return state_response(result,409)
+    if isinstance(result,dict) and result.get("redirect"):
+        return state_redirect(result,f"state_write/{function_name}")
+    return state_response(result,200)
+
+@app.route('/state_mget',methods=['GET'])
+def state_mget():
+    """The interface for serverless stateful functions to read several state replicas at once."""
+    data = state_payload()
+    try:
+        return state_response(SM.state_mget(data['names'],data.get('locked',0),data['identity']),200)
+    except TimeoutError as e:
+        return jsonify({"error": str(e)}),423
+
+@app.route('/state_mset',methods=['POST'])
+def state_mset():
+    """The interface for serverless stateful functions to write several state replicas at once."""
+    data = state_payload()
+    try:
+        return state_response(SM.state_mset(data['states'],data['identity'],data.get('tokens'),
+                                            request.headers.get("X-State-Origin")),200)
+    except ConnectionError as e:
+        return jsonify({"error": str(e)}),503
+
+@app.route('/state_read_versioned/<function_name>',methods=['GET'])
+def state_read_versioned(function_name):
+    """The interface for serverless stateful functions to read a state replica with its version."""
+    try:
+        data = state_payload()
+        return state_response(SM.state_read(function_name,0,data['identity'],versioned=True,if_version=data.get('if_version'),
+                                            origin=request.headers.get("X-State-Origin")),200)
+    except TimeoutError as e:
+        return jsonify({"error": str(e)}),423
+
+@app.route('/state_cas/<function_name>',methods=['POST'])
+def state_cas(function_name):
+    """The interface for serverless stateful functions to write a state only if its version matches."""
+    data = state_payload()
+    try:
+        result = SM.state_cas(function_name,data['version'],data['state_data'],request.headers.get("X-State-Origin"))
+    except ConnectionError as e:
+        return jsonify({"error": str(e)}),503
+    if result.get("redirect"):
+        return state_redirect(result,f"state_cas/{function_name}")
+    return state_response(result,200 if result["success"] else 409)
+
+@app.route('/state_primary_handoff/<function_name>',methods=['POST'])
+def state_primary_handoff(function_name):
+    """The interface for the state monitor to hand the primary replica of a state over to another node."""
+    data = state_payload()
+    try:
+        return jsonify(SM.state_primary_handoff(function_name,data['primary'],data.get('state_data'),data.get('version'))),200
+    except TimeoutError as e:
+        return jsonify({"error": str(e)}),423
 
 @app.route('/state_remove/<function_name>',methods=['POST'])
 def state_remove(function_name):
     """The interface to remove a local state."""
     return jsonify(SM.state_remove(function_name,request.get_json()['type'])),200
 
+@app.route('/state_transport_get',methods=['GET'])
+def state_transport_get():
+    """The interface to get the connection pool hits and misses of outbound requests."""
+    return jsonify(SM.so.transport.stats()),200
+
+@app.route('/state_scheduler_get',methods=['GET'])
+def state_scheduler_get():
+    """The interface to get the number of pending and fired temperature checks."""
+    return jsonify(SM.scheduler.stats()),200
+
+@app.route('/state_reporter_get',methods=['GET'])
+def state_reporter_get():
+    """The interface to get the queued, sent and dropped reports to the state monitor."""
+    return jsonify(SM.so.reporter.stats()),200
+
 @app.route('/state_size',methods=['GET'])
 def state_size():
     """The interface to acquire the sum storage cost of state replicas in memory"""
     return jsonify(SM.state_size()),200
 
 if __name__ == '__main__': 
-    SM.so.run_thread(SM.state_activity_change) # Run temperature management thread 
-    SM.so.run_thread(SM.state_semi_activity_manager) # Run warm state daya management thread
-    app.run(port=8054) # Run flask app
\ No newline at end of file
+    SERVER.background(SM.state_activity_manager) # Run temperature management thread 
+    SERVER.background(SM.state_lock_reaper) # Run expired lease releasing thread
+    SERVER.background(SM.so.disk.flush_manager) # Run disk tier batched flushing and compaction thread
+    SERVER.background(SM.so.reporter.flush_manager) # Run batched monitor reporting thread
+    SERVER.on_shutdown(SM.so.disk.flush) # Commit the buffered disk tier writes
+    SERVER.on_shutdown(SM.so.reporter.flush) # Send the queued monitor reports
+    SERVER.serve() # Run flask app
\ No newline at end of file
@@ -0,0 +1,193 @@
+"""CatalogJournal() class aims to persist the catalog of the state monitor on the local disk.
+
+Typical usage example:
+
+    cj = CatalogJournal(capture)
+    recovered = cj.recover(restore, apply)
+    cj.write({"op": "add", "node": node_ip, "name": function_name}, apply)
+    so.run_thread(cj.journal_manager)
+"""
+import json
+import os
+import tempfile
+import threading
+import time
+
+# config.py
+STATE_CATALOG_PATH = ""
+STATE_CATALOG_FSYNC_INTERVAL = 0.2
+STATE_CATALOG_SNAPSHOT_INTERVAL = 300
+STATE_CATALOG_SNAPSHOT_RECORDS = 100000
+
+class CatalogJournal:
+    """A write-ahead log of the changes to the catalog of the state monitor, with periodic snapshots,
+    so a restarted monitor reloads its catalog from the disk instead of polling every worker VM.
+
+    Every change is a record applied to the catalog and appended to {STATE_CATALOG_PATH}/catalog.wal
+    under the same lock, so the log keeps the order the changes were applied in. The log is fsynced
+    every STATE_CATALOG_FSYNC_INTERVAL seconds. A snapshot renames the log to catalog.wal.old and
+    starts a new one under the lock, then writes catalog.snapshot.json atomically and removes the
+    old log. Records carry a sequence number, so recovery replays the records after the snapshot
+    from both logs. The journal is disabled if STATE_CATALOG_PATH is empty.
+
+    Attributes:
+        capture: the function returning a JSON serializable copy of the catalog, run under the lock.
+        path: the directory of the log and snapshot files, "" if the journal is disabled.
+        seq: the sequence number of the last record.
+        records: the number of records since the last snapshot.
+        snapshot_time: the time of the last snapshot, None before the first one.
+    """
+
+    def __init__(self,capture,path=STATE_CATALOG_PATH):
+        """Initial the CatalogJournal class."""
+        self.capture = capture
+        self.path = path
+        self.wal_path = f"{path}/catalog.wal"
+        self.old_wal_path = f"{path}/catalog.wal.old"
+        self.snapshot_path = f"{path}/catalog.snapshot.json"
+        self.file = None
+        self.seq = 0
+        self.records = 0
+        self.snapshot_time = None
+        self.lock = threading.Lock()
+        self.snapshot_lock = threading.Lock()
+
+    def recover(self,restore,apply):
+        """Reload the catalog from the last snapshot and the records logged after it, then take a
+        new snapshot so the log starts empty.
+
+        Args:
+            restore: the function replacing the catalog with a snapshot.
+            apply: the function applying one record to the catalog.
+
+        Returns:
+            True if a catalog was found on the disk.
+        """
+        if not self.path:
+            return False
+        os.makedirs(self.path,exist_ok=True)
+
+        recovered = False
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path,'r') as json_file:
+                snapshot = json.load(json_file)
+            restore(snapshot["catalog"])
+            self.seq = snapshot["seq"]
+            recovered = True
+
+        for wal_path in [self.old_wal_path, self.wal_path]:
+            if not os.path.exists(wal_path):
+                continue
+            with open(wal_path,'r') as wal_file:
+                for line in wal_file:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        break # Torn last record of a crash, the records after it were never acknowledged
+                    if record["seq"] <= self.seq:
+                        continue
+                    apply(record)
+                    self.seq = record["seq"]
+                    recovered = True
+
+        self.file = open(self.wal_path,'a')
+        self.snapshot()
+        return recovered
+
+    def write(self,record,apply):
+        """Apply a record to the catalog and append it to the log.
+
+        Returns:
+            The return value of apply.
+        """
+        with self.lock:
+            result = apply(record)
+            if self.file is not None:
+                self.seq += 1
+                record["seq"] = self.seq
+                self.file.write(json.dumps(record) + "\n")
+                self.records += 1
+            return result
+
+    def consistent(self,function):
+        """Run a function while no record is applied, such as copying the catalog."""
+        with self.lock:
+            return function()
+
+    def flush(self):
+        """Make the appended records durable."""
+        with self.lock:
+            if self.file is None:
+                return
+            self.file.flush()
+            fd = os.dup(self.file.fileno()) # Stays open if a snapshot closes the log meanwhile
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def snapshot(self):
+        """Write a snapshot of the catalog and drop the records it contains."""
+        with self.snapshot_lock:
+            with self.lock:
+                if self.file is None:
+                    return
+                catalog = self.capture()
+                seq = self.seq
+                self.file.flush()
+                os.fsync(self.file.fileno())
+                self.file.close()
+                os.replace(self.wal_path,self.old_wal_path)
+                self.file = open(self.wal_path,'a')
+                self.records = 0
+
+            # Serialized outside the lock, the captured catalog is a copy the live catalog never changes.
+            fd, tmp_path = tempfile.mkstemp(dir=self.path,prefix=".catalog.",suffix=".tmp")
+            try:
+                with os.fdopen(fd,'w') as file:
+                    json.dump({"seq": seq, "catalog": catalog},file)
+                    file.flush()
+                    os.fsync(file.fileno())
+                os.replace(tmp_path,self.snapshot_path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+
+            # Persist the rename before the old records are dropped
+            dir_fd = os.open(self.path,os.O_RDONLY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+            os.remove(self.old_wal_path)
+            self.snapshot_time = time.time()
+
+    def journal_manager(self):
+        """Fsync the log periodically, and take a snapshot every STATE_CATALOG_SNAPSHOT_INTERVAL
+        seconds or STATE_CATALOG_SNAPSHOT_RECORDS records."""
+        last_snapshot = time.time()
+        while True:
+            time.sleep(STATE_CATALOG_FSYNC_INTERVAL)
+            try:
+                self.flush()
+                if (self.records >= STATE_CATALOG_SNAPSHOT_RECORDS
+                        or time.time() - last_snapshot >= STATE_CATALOG_SNAPSHOT_INTERVAL):
+                    self.snapshot()
+                    last_snapshot = time.time()
+            except Exception as e:
+                print(f"Thread error: {e}") # Error handling
+
+    def close(self):
+        """Take a last snapshot and close the log, the changes after it are not logged."""
+        self.snapshot()
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+    def stats(self):
+        """Acquire the sequence number, the records since the last snapshot and its time."""
+        with self.lock:
+            return {"enabled": bool(self.path), "seq": self.seq, "records": self.records,
+                    "snapshot_time": self.snapshot_time}
@@ -0,0 +1,170 @@
+"""EvictionPool() class aims to remove cold state replicas from the worker VMs concurrently.
+
+Typical usage example:
+
+    ep = EvictionPool(so.state_remove, on_removed)
+    report = ep.sweep([[function_name, node_ip, remove_type], ...])
+"""
+import collections
+import concurrent.futures
+import threading
+import time
+
+# config.py
+STATE_EVICT_WORKERS = 16
+STATE_EVICT_PER_NODE = 2
+STATE_EVICT_RETRIES = 3
+STATE_EVICT_BACKOFF = 1.0
+STATE_EVICT_SWEEP_TIMEOUT = 300.0
+
+class EvictionPool:
+    """Run the removals of a sweep in a bounded thread pool, so a slow upload to external storage
+    only holds back the removals on its own node.
+
+    At most STATE_EVICT_PER_NODE removals run on one node at a time across all the sweeps in
+    progress, the removals of a node waiting in a queue of the pool and the next one being started
+    when one of its removals ends. A failed removal is retried with exponential backoff.
+
+    A sweep waits at most STATE_EVICT_SWEEP_TIMEOUT seconds. The removals not started by then are
+    abandoned and left to the next sweep, and the running ones are not retried any more.
+
+    Attributes:
+        remove: the function sending a removal, returning True if the state manager removed it.
+        on_removed: the function applying a successful removal to the monitoring dicts.
+        executor: the thread pool running the removals.
+        queues: a dict with node ips as keys and the deques of the (task, deadline, finished)
+                removals waiting for the node as values.
+        running: a Counter of the removals running on every node.
+        last_report: the report of the last sweep.
+    """
+
+    def __init__(self,remove,on_removed,workers=STATE_EVICT_WORKERS,per_node=STATE_EVICT_PER_NODE):
+        """Initial the EvictionPool class."""
+        self.remove = remove
+        self.on_removed = on_removed
+        self.per_node = per_node
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        self.queues = collections.defaultdict(collections.deque)
+        self.running = collections.Counter()
+        self.lock = threading.RLock() # Callbacks of futures already done run in the submitting thread
+        self.last_report = None
+
+    def dispatch(self,node_ip):
+        """Start the queued removals of a node up to the per node limit, the lock must be held."""
+        queue = self.queues.get(node_ip)
+        while queue and self.running[node_ip] < self.per_node:
+            task, deadline, finished = queue.popleft()
+            self.running[node_ip] += 1
+            future = self.executor.submit(self.evict,task,deadline)
+            future.add_done_callback(lambda future, task=task, finished=finished: self.ended(task,future,finished))
+        if not queue:
+            self.queues.pop(node_ip,None)
+
+    def ended(self,task,future,finished):
+        """Free the slot of a finished removal, start the next one of its node and report it."""
+        with self.lock:
+            self.running[task[1]] -= 1
+            if self.running[task[1]] <= 0:
+                del self.running[task[1]]
+            self.dispatch(task[1])
+        finished(task,future)
+
+    def evict(self,task,deadline=None):
+        """Remove one replica, retrying with exponential backoff.
+
+        Args:
+            task: a list of the state name, the node ip and the remove type.
+            deadline: the time after which the removal is not retried, None for no limit.
+
+        Returns:
+            A tuple of whether the replica was removed, the attempts and the seconds spent.
+        """
+        function_name, node_ip, remove_type = task
+        start_time = time.time()
+        for attempt in range(STATE_EVICT_RETRIES + 1):
+            try:
+                if self.remove(function_name,node_ip,remove_type):
+                    self.on_removed(function_name,node_ip,remove_type)
+                    return True, attempt + 1, time.time() - start_time
+            except Exception as e:
+                print(f"Eviction error: {e}") # Error handling
+            backoff = STATE_EVICT_BACKOFF * 2 ** attempt
+            if attempt == STATE_EVICT_RETRIES or (deadline is not None and time.time() + backoff >= deadline):
+                return False, attempt + 1, time.time() - start_time
+            time.sleep(backoff)
+
+    def sweep(self,tasks,timeout=STATE_EVICT_SWEEP_TIMEOUT):
+        """Run the removals of a sweep and wait for them until the sweep times out.
+
+        Args:
+            tasks: a list of [state name, node ip, remove type] removals.
+            timeout: the maximum seconds to wait for the removals.
+
+        Returns:
+            A dict reporting the removed, failed and abandoned replicas, the removals still
+            running, the retries and the latencies in total and per node.
+        """
+        start_time = time.time()
+        deadline = start_time + timeout
+        report = {"started": start_time, "duration": 0.0, "total": len(tasks), "succeeded": 0,
+                  "failed": 0, "abandoned": 0, "running": 0, "retries": 0, "latency_avg": 0.0,
+                  "latency_max": 0.0, "nodes": {}}
+        latencies = []
+        remaining = [len(tasks)]
+        lock = threading.Lock() # Taken after the lock of the pool
+        done = threading.Event()
+
+        def finished(task,future):
+            """Record a finished removal."""
+            try:
+                removed, attempts, latency = future.result()
+            except Exception:
+                removed, attempts, latency = False, 1, 0.0
+            with lock:
+                if done.is_set():
+                    return # Finished after the sweep timed out, applied by on_removed only
+                node_report = report["nodes"].setdefault(task[1],{"succeeded": 0, "failed": 0, "abandoned": 0})
+                result = "succeeded" if removed else "failed"
+                report[result] += 1
+                node_report[result] += 1
+                report["retries"] += attempts - 1
+                latencies.append(latency)
+                remaining[0] -= 1
+                if remaining[0] == 0:
+                    done.set()
+
+        if not tasks:
+            done.set()
+        with self.lock:
+            for task in tasks:
+                self.queues[task[1]].append((task, deadline, finished))
+            for node_ip in {task[1] for task in tasks}:
+                self.dispatch(node_ip)
+
+        # Abandon the removals not started in time, the next sweep finds their replicas again.
+        if not done.wait(timeout):
+            with self.lock:
+                abandoned = collections.Counter()
+                for node_ip in list(self.queues):
+                    queue = self.queues[node_ip]
+                    kept = collections.deque(entry for entry in queue if entry[2] is not finished)
+                    abandoned[node_ip] = len(queue) - len(kept)
+                    if kept:
+                        self.queues[node_ip] = kept
+                    else:
+                        del self.queues[node_ip]
+                with lock:
+                    done.set()
+                    for node_ip, count in abandoned.items():
+                        if count:
+                            node_report = report["nodes"].setdefault(node_ip,{"succeeded": 0, "failed": 0, "abandoned": 0})
+                            node_report["abandoned"] += count
+                            report["abandoned"] += count
+                    report["running"] = remaining[0] - report["abandoned"]
+
+        if latencies:
+            report["latency_avg"] = sum(latencies) / len(latencies)
+            report["latency_max"] = max(latencies)
+        report["duration"] = time.time() - start_time
+        self.last_report = report
+        return report
@@ -0,0 +1,115 @@
+"""ExternalCatalog() class aims to keep the list of states in external storage in memory.
+
+Typical usage example:
+
+    ec = ExternalCatalog(commit)
+    ec.add(function_name)
+    if function_name in ec:
+        ...
+"""
+import threading
+import time
+
+from app import StateFileManager
+
+# config.py
+STATE_EXTERNAL_RECONCILE_INTERVAL = 300
+
+class ExternalCatalog:
+    """The names of the states in external storage, updated when the state managers report a
+    state pushed to or deleted from external storage and reconciled with a listing of the external
+    storage server in background, so a lookup never opens an SSH connection.
+
+    Attributes:
+        commit: the function applying the reconciled listing to the catalog through the journal of
+                the monitor by replace(), replace() itself if None.
+        states: the set of state names in external storage.
+        pending: the changes reported while a reconciliation lists the server, replayed on top of
+                the listing, or None if no reconciliation is running.
+        reconciled_time: the time of the last reconciliation, None before the first one.
+    """
+
+    def __init__(self,commit=None):
+        """Initial the ExternalCatalog class."""
+        self.commit = commit or self.replace
+        self.states = set()
+        self.pending = None
+        self.lock = threading.Lock()
+        self.reconciled_time = None
+
+    def __contains__(self,function_name):
+        return function_name in self.states
+
+    def add(self,function_name):
+        """Record a state pushed to external storage."""
+        self.change(function_name,True)
+
+    def delete(self,function_name):
+        """Record a state deleted from external storage."""
+        self.change(function_name,False)
+
+    def load(self,names):
+        """Replace the catalog with the state names recovered from the disk."""
+        with self.lock:
+            self.states = set(names)
+
+    def names(self):
+        """Acquire a copy of the state names in the catalog."""
+        with self.lock:
+            return list(self.states)
+
+    def change(self,function_name,stored):
+        """Apply a reported change, and keep it for the running reconciliation if any."""
+        with self.lock:
+            if stored:
+                self.states.add(function_name)
+            else:
+                self.states.discard(function_name)
+            if self.pending is not None:
+                self.pending.append((function_name, stored))
+
+    def reconcile(self):
+        """List the external storage server and commit the listing to the catalog."""
+        with self.lock:
+            self.pending = []
+        try:
+            sfm = StateFileManager()
+            listed = sfm.external_states_get()
+            sfm.close()
+            self.commit(listed)
+        finally:
+            with self.lock:
+                self.pending = None
+
+    def replace(self,names):
+        """Replace the catalog with a listing of the external storage server, keeping the
+        changes reported while listing.
+
+        Returns:
+            The list of state names in the catalog.
+        """
+        listed = set(names)
+        with self.lock:
+            for function_name, stored in self.pending or []:
+                if stored:
+                    listed.add(function_name)
+                else:
+                    listed.discard(function_name)
+            self.states = listed
+            self.pending = None
+            self.reconciled_time = time.time()
+            return sorted(listed)
+
+    def reconcile_manager(self):
+        """Reconcile the catalog at start and every STATE_EXTERNAL_RECONCILE_INTERVAL seconds."""
+        while True:
+            try:
+                self.reconcile()
+            except Exception as e:
+                print(f"Thread error: {e}") # Error handling
+            time.sleep(STATE_EXTERNAL_RECONCILE_INTERVAL)
+
+    def stats(self):
+        """Acquire the catalog size and the last reconciliation time."""
+        with self.lock:
+            return {"states": len(self.states), "reconciled_time": self.reconciled_time}
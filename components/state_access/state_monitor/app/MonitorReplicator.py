@@ -0,0 +1,98 @@
+"""MonitorReplicator() class aims to ship the catalog changes of a primary state monitor to its standby.
+
+Typical usage example:
+
+    mr = MonitorReplicator(standby_ip, capture)
+    mr.report(record)
+    so.run_thread(mr.replicate_manager)
+"""
+import collections
+import threading
+import time
+
+import requests
+
+# config.py
+STATE_MONITOR_REPLICATE_INTERVAL = 0.2
+STATE_MONITOR_REPLICATE_BATCH = 1024
+STATE_MONITOR_REPLICATE_QUEUE_MAX = 100000
+
+class MonitorReplicator:
+    """Queue the change records applied by a primary monitor and post them in order to the standby
+    monitor of its partition, which applies them to its own catalog and journal.
+
+    The standby is sent a full copy of the catalog first, and again whenever records were dropped
+    because the standby was unreachable for too long, so it never applies records on top of a
+    catalog missing some changes.
+
+    Attributes:
+        standby_ip: the ip of the standby monitor, None if the partition has no standby.
+        capture: the function returning a consistent JSON serializable copy of the catalog and
+                clearing the queue under the same lock.
+        queue: the change records waiting to be sent.
+        resync: True when the standby must be sent a full copy of the catalog.
+    """
+
+    def __init__(self,standby_ip,capture):
+        """Initial the MonitorReplicator class."""
+        self.standby_ip = standby_ip
+        self.capture = capture
+        self.url = f"http://{standby_ip}:8053/catalog_replicate"
+        self.session = requests.Session()
+        self.queue = collections.deque()
+        self.queue_lock = threading.Lock()
+        self.resync = True
+        self.sent = 0
+        self.resyncs = 0
+
+    def report(self,record):
+        """Queue a change record, called in the order the records are applied."""
+        if self.standby_ip is None:
+            return
+        with self.queue_lock:
+            if len(self.queue) >= STATE_MONITOR_REPLICATE_QUEUE_MAX:
+                self.queue.clear()
+                self.resync = True
+            self.queue.append(dict(record))
+
+    def clear(self):
+        """Drop the queued records, contained in a catalog copy being captured."""
+        with self.queue_lock:
+            self.queue.clear()
+
+    def replicate(self):
+        """Post the full catalog if needed, then the queued records in batches."""
+        if self.resync:
+            res = self.session.post(self.url,json={"catalog": self.capture()},timeout=30)
+            res.raise_for_status()
+            self.resync = False
+            self.resyncs += 1
+
+        while True:
+            with self.queue_lock:
+                batch = [self.queue.popleft() for _ in range(min(len(self.queue),STATE_MONITOR_REPLICATE_BATCH))]
+            if not batch:
+                return
+            try:
+                res = self.session.post(self.url,json={"records": batch},timeout=10)
+                res.raise_for_status()
+            except Exception:
+                with self.queue_lock:
+                    self.queue.extendleft(reversed(batch))
+                raise
+            self.sent += len(batch)
+
+    def replicate_manager(self):
+        """Replicate the changes every STATE_MONITOR_REPLICATE_INTERVAL seconds."""
+        while self.standby_ip is not None:
+            time.sleep(STATE_MONITOR_REPLICATE_INTERVAL)
+            try:
+                self.replicate()
+            except Exception as e:
+                print(f"Thread error: {e}") # Error handling
+
+    def stats(self):
+        """Acquire the standby, the queued and sent record counts and the full copies sent."""
+        with self.queue_lock:
+            return {"standby": self.standby_ip, "queued": len(self.queue), "sent": self.sent,
+                    "resyncs": self.resyncs, "resync": self.resync}
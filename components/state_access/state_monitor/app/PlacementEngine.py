@@ -0,0 +1,173 @@
+"""PlacementEngine() class aims to place the state replicas where the states are accessed.
+
+Typical usage example:
+
+    pe = PlacementEngine(so.state_replicate, eviction, move_primary)
+    report = pe.place(rates, locations, primaries)
+"""
+import concurrent.futures
+import time
+
+# config.py
+STATE_PLACEMENT_CREATE_RATE = 0.05
+STATE_PLACEMENT_DROP_RATE = 0.001
+STATE_PLACEMENT_WRITE_COST = 0.5
+STATE_PLACEMENT_PRIMARY_RATE = 0.05
+STATE_PLACEMENT_PRIMARY_RATIO = 2.0
+STATE_PLACEMENT_MAX_REPLICAS = 0
+STATE_PLACEMENT_MIN_REPLICAS = 1
+STATE_PLACEMENT_MAX_ACTIONS = 32
+
+class PlacementEngine:
+    """Decide from the access rates reported by the state managers where state replicas should be
+    created, which ones should be dropped and where the primary replicas should move, then apply
+    the decisions.
+
+    The reads of a node are its local accesses minus the writes and the remote reads its replicas
+    received, plus the remote reads it sent to other replicas, so a node without a replica is seen
+    reading the state. For a state read r times per second on a node and written w times per second
+    in total, a replica on the node saves a remote pull per read and costs a replication per write:
+        - a replica is created on a node not holding it if r >= STATE_PLACEMENT_CREATE_RATE and
+          r > STATE_PLACEMENT_WRITE_COST * w, as long as the state has less than
+          STATE_PLACEMENT_MAX_REPLICAS replicas (0 for no limit);
+        - a slave replica is dropped if r < STATE_PLACEMENT_DROP_RATE, keeping at least
+          STATE_PLACEMENT_MIN_REPLICAS replicas, the drop rate being kept below the create rate so
+          a replica does not flap;
+        - the primary replica moves to the node writing the state the most, if it writes at least
+          STATE_PLACEMENT_PRIMARY_RATE times per second and STATE_PLACEMENT_PRIMARY_RATIO times more
+          than the node of the current primary. A replica is created there first if needed, and the
+          current primary redirects its writes and hands its latest value over before the move.
+    At most STATE_PLACEMENT_MAX_ACTIONS decisions with the highest rates are applied per round.
+
+    Attributes:
+        create: the function asking a node to pull a replica, returning True on success.
+        eviction: the EvictionPool removing the dropped replicas.
+        move_primary: the function handing the primary replica of a state over to a node and
+                recording it, returning True on success.
+        last_report: the report of the last round.
+    """
+
+    def __init__(self,create,eviction,move_primary):
+        """Initial the PlacementEngine class."""
+        self.create = create
+        self.eviction = eviction
+        self.move_primary = move_primary
+        self.last_report = None
+
+    def rates_split(self,rates):
+        """Split the access rates reported by the nodes into reads and writes.
+
+        Args:
+            rates: a dict with node ips as keys and the /state_access_rate_get answers as values.
+
+        Returns:
+            A tuple of two dicts with state names as keys and dicts of the read rate on every node
+            and the write rate from every node as values.
+        """
+        reads = {}
+        writes = {}
+        for node_ip, node_rates in rates.items():
+            for function_name, rate in node_rates.items():
+                # The writes and remote reads received by a replica are counted as accesses on its node.
+                received = sum(rate.get("writes",{}).values()) + sum(rate.get("reads",{}).values())
+                state_reads = reads.setdefault(function_name,{})
+                state_reads[node_ip] = state_reads.get(node_ip,0.0) + max(rate["rate"] - received, 0.0)
+                for origin_ip, read_rate in rate.get("reads",{}).items():
+                    state_reads[origin_ip] = state_reads.get(origin_ip,0.0) + read_rate
+                for origin_ip, write_rate in rate.get("writes",{}).items():
+                    state_writes = writes.setdefault(function_name,{})
+                    state_writes[origin_ip] = state_writes.get(origin_ip,0.0) + write_rate
+        return reads, writes
+
+    def plan(self,rates,locations,primaries):
+        """Decide the replicas to create and drop and the primary replicas to move.
+
+        Args:
+            rates: a dict with node ips as keys and the /state_access_rate_get answers as values.
+            locations: a dict with state names as keys and dicts keyed by the replica nodes as values.
+            primaries: a dict with state names as keys and the primary replica node as values.
+
+        Returns:
+            A dict containing the "create" [state name, node ip] pairs, the "drop" [state name,
+            node ip, 0] removals and the "primary" [state name, node ip] moves.
+        """
+        reads, writes = self.rates_split(rates)
+        creates = []
+        drops = []
+        moves = []
+        for function_name in set(reads) | set(writes):
+            replicas = locations.get(function_name,{})
+            if not replicas:
+                continue # Not in the cluster, or in external storage
+            state_reads = reads.get(function_name,{})
+            state_writes = writes.get(function_name,{})
+            write_rate = sum(state_writes.values())
+            primary = primaries.get(function_name)
+            keep = {primary}
+            count = len(replicas)
+
+            # Move the primary replica to the node writing the state the most.
+            target = max(state_writes,key=state_writes.get) if state_writes else None
+            if (target is not None and target != primary
+                    and state_writes[target] >= STATE_PLACEMENT_PRIMARY_RATE
+                    and state_writes[target] >= STATE_PLACEMENT_PRIMARY_RATIO * state_writes.get(primary,0.0)):
+                if target in replicas:
+                    moves.append((state_writes[target], [function_name, target]))
+                    keep.add(target)
+                else:
+                    creates.append((state_writes[target], [function_name, target]))
+                    count += 1
+
+            # Create replicas where the reads save more than the replication costs.
+            for node_ip, read_rate in state_reads.items():
+                if node_ip in replicas or [function_name, node_ip] in (action for _, action in creates):
+                    continue
+                if STATE_PLACEMENT_MAX_REPLICAS and count >= STATE_PLACEMENT_MAX_REPLICAS:
+                    break
+                if read_rate >= STATE_PLACEMENT_CREATE_RATE and read_rate > STATE_PLACEMENT_WRITE_COST * write_rate:
+                    creates.append((read_rate, [function_name, node_ip]))
+                    count += 1
+
+            # Drop the slave replicas rarely read, keeping the minimum number of replicas.
+            remaining = len(replicas)
+            for node_ip in replicas:
+                if node_ip in keep or remaining <= STATE_PLACEMENT_MIN_REPLICAS:
+                    continue
+                if state_reads.get(node_ip,0.0) < STATE_PLACEMENT_DROP_RATE:
+                    drops.append((STATE_PLACEMENT_DROP_RATE - state_reads.get(node_ip,0.0), [function_name, node_ip, 0]))
+                    remaining -= 1
+
+        # Apply the decisions with the highest rates first.
+        actions = sorted([(rate, "primary", action) for rate, action in moves]
+                         + [(rate, "create", action) for rate, action in creates]
+                         + [(rate, "drop", action) for rate, action in drops],key=lambda item: -item[0])
+        plan = {"create": [], "drop": [], "primary": []}
+        for _, kind, action in actions[:STATE_PLACEMENT_MAX_ACTIONS]:
+            plan[kind].append(action)
+        return plan
+
+    def place(self,rates,locations,primaries):
+        """Plan and apply a placement round.
+
+        Returns:
+            A dict reporting the planned decisions and the created, dropped and moved replicas.
+        """
+        start_time = time.time()
+        plan = self.plan(rates,locations,primaries)
+        report = {"started": start_time, "duration": 0.0, "plan": plan, "created": 0, "dropped": 0, "moved": 0}
+
+        for function_name, node_ip in plan["primary"]:
+            if self.move_primary(function_name,node_ip):
+                report["moved"] += 1
+
+        if plan["create"]:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=len(plan["create"])) as executor:
+                results = executor.map(lambda action: self.create(*action),plan["create"])
+                report["created"] = sum(1 for created in results if created)
+
+        if plan["drop"]:
+            report["dropped"] = self.eviction.sweep(plan["drop"])["succeeded"]
+
+        report["duration"] = time.time() - start_time
+        self.last_report = report
+        return report
@@ -0,0 +1,151 @@
+"""StateDirectory() class aims to keep the locations of state replicas indexed by node and by state.
+
+Typical usage example:
+
+    sd = StateDirectory()
+    sd.add(node_ip, function_name)
+    replicas = sd.replicas(function_name)
+    version, messages, locations = sd.snapshot()
+"""
+import threading
+
+class StateDirectory:
+    """The monitoring dicts of the state monitor, with the inverted index from every state to its
+    replicas maintained on every change, so finding where a state lives does not scan all nodes.
+
+    Snapshots are copy-on-write: a snapshot copies only the outer dicts, and the first change of
+    an inner dict after a snapshot copies that inner dict instead of modifying the one the
+    snapshot holds, so a snapshot never changes and costs no deep copy.
+
+    Attributes:
+        messages: a dict with node ips as keys and dicts of the states on the node as values, every
+                state mapped to a dict containing its "activity".
+        locations: a dict with state names as keys and dicts with the ips of the nodes holding a
+                replica as keys and the replica temperature (None if not reported) as values.
+        version: the number of changes applied to the dicts.
+        generation: the number of snapshots taken, inner dicts copied in an older generation
+                may be shared with a snapshot.
+        recovered: a dict with node ips as keys and the sets of the states recovered from the disk
+                on the node and not reported since as values, checked when the node answers.
+        lock: the lock keeping both dicts consistent.
+    """
+
+    def __init__(self):
+        """Initial the StateDirectory class."""
+        self.messages = {}
+        self.locations = {}
+        self.version = 0
+        self.generation = 0
+        self.owned = {}
+        self.recovered = {}
+        self.lock = threading.Lock()
+
+    def load(self,messages):
+        """Replace the monitoring dicts with the messages of the state managers and index them."""
+        with self.lock:
+            self.messages = {}
+            self.locations = {}
+            self.owned = {}
+            self.recovered = {}
+            for node_ip, function_dict in messages.items():
+                for function_name, msg in function_dict.items():
+                    self._writable("messages",node_ip)[function_name] = msg
+                    self._writable("locations",function_name)[node_ip] = msg.get("activity")
+            self.version += 1
+
+    def mark_recovered(self):
+        """Mark every indexed replica as recovered from the disk, to be checked with its node."""
+        with self.lock:
+            self.recovered = {node_ip: set(function_dict) for node_ip, function_dict in self.messages.items()}
+
+    def merge(self,node_ip,function_dict):
+        """Index the state replicas of a node which answered late, keeping the replicas already
+        reported by the node since they are newer.
+
+        Returns:
+            A list of the replicas recovered from the disk which the node does not hold anymore.
+        """
+        with self.lock:
+            for function_name, msg in function_dict.items():
+                if function_name in self.messages.get(node_ip,{}):
+                    continue
+                self._writable("messages",node_ip)[function_name] = msg
+                self._writable("locations",function_name)[node_ip] = msg.get("activity")
+            self.version += 1
+            return [function_name for function_name in self.recovered.pop(node_ip,set())
+                    if function_name not in function_dict]
+
+    def add(self,node_ip,function_name):
+        """Record a new state replica on a node."""
+        with self.lock:
+            self.recovered.get(node_ip,set()).discard(function_name)
+            self._writable("messages",node_ip)[function_name] = {}
+            self._writable("locations",function_name)[node_ip] = None
+            self.version += 1
+
+    def delete(self,node_ip,function_name):
+        """Forget a removed state replica on a node.
+
+        Returns:
+            A list of the nodes still holding a replica of the state.
+        """
+        with self.lock:
+            self.recovered.get(node_ip,set()).discard(function_name)
+            if function_name in self.messages.get(node_ip,{}):
+                del self._writable("messages",node_ip)[function_name]
+            replicas = self.locations.get(function_name,{})
+            if node_ip in replicas:
+                replicas = self._writable("locations",function_name)
+                del replicas[node_ip]
+            if not replicas:
+                self.locations.pop(function_name,None)
+                self.owned.pop(("locations",function_name),None)
+            self.version += 1
+            return list(replicas)
+
+    def activity(self,node_ip,function_name,activity):
+        """Record the temperature of a state replica on a node."""
+        with self.lock:
+            self.recovered.get(node_ip,set()).discard(function_name)
+            self._writable("messages",node_ip)[function_name] = {"activity": activity}
+            self._writable("locations",function_name)[node_ip] = activity
+            self.version += 1
+
+    def replicas(self,function_name):
+        """Find the replicas of a state.
+
+        Returns:
+            A dict with the ips of the nodes holding a replica as keys and the replica
+            temperatures as values, copied so it does not change under the caller.
+        """
+        with self.lock:
+            return dict(self.locations.get(function_name,{}))
+
+    def snapshot(self):
+        """Take an immutable snapshot of both monitoring dicts.
+
+        The returned dicts must not be modified by the caller.
+
+        Returns:
+            A tuple of the version, the messages and the locations.
+        """
+        with self.lock:
+            self.generation += 1
+            return self.version, dict(self.messages), dict(self.locations)
+
+    def _writable(self,table,key):
+        """Get an inner dict to modify, copying it first if a snapshot may share it, the lock must
+        be held.
+
+        Args:
+            table: "messages" or "locations".
+            key: the node ip or the state name.
+        """
+        outer = getattr(self,table)
+        inner = outer.get(key)
+        if inner is None:
+            inner = outer[key] = {}
+        elif self.owned.get((table, key)) != self.generation:
+            inner = outer[key] = dict(inner)
+        self.owned[(table, key)] = self.generation
+        return inner
@@ -40,7 +40,7 @@ class StateFileManager:
         """
         # Get the storage JSON file list
         cmd = f"ls {EXTERNAL_STATE_SERVER_STORAGE_PATH}/*.json"
-        stdout = self.ssh.exec_command(cmd)
+        _, stdout, _ = self.ssh.exec_command(cmd)
         json_files = stdout.read().decode().splitlines()
         function_names = []
 
@@ -5,28 +5,228 @@ Typical usage example:
     sm = StateMonitor()
     sm.state_search(function_name)
 """
-import copy
 import time
 
 from app import StateOperater
-from app import StateFileManager
+from app import StateDirectory
+from app import ExternalCatalog
+from app import EvictionPool
+from app import CatalogJournal
+from components import MonitorRing
+from app import MonitorReplicator
+from app import PlacementEngine
+
+# config.py
+CLUSTER_CONFIG = {}
+STATE_RECONCILE_MAX_DELAY = 60.0
+STATE_PLACEMENT_ENABLED = True
+STATE_PLACEMENT_INTERVAL = 60
 
 class StateMonitor:
     """Manage the state monitor data and provide scheduling ability about the monitored data.
 
     Attributes:
         so: the tool class to help complete related operations.
+        directory: the StateDirectory holding the monitoring dicts and the index from every state
+                to its replicas.
         messages: the situation about the state replica name list in every worker VM including other
-                monitoring messages.
+                monitoring messages, kept by the directory.
         settings: the information about every function, especially including the master state replica's
                 locations.
+        external_states: the ExternalCatalog of the state names in external storage.
+        eviction: the EvictionPool removing cold state replicas concurrently.
+        missing_nodes: the worker VMs which did not answer at bootstrap and are not indexed yet.
+        journal: the CatalogJournal logging every change of the messages, the settings and the
+                external storage catalog to the local disk.
+        ring: the MonitorRing partitioning the states among the monitors.
+        shard: the index of the partition served by this monitor, None if it serves all states.
+        role: "primary" or "standby" in the partition. A standby only serves reads, its catalog
+                changes come from the primary alone, so no change is lost when the primary returns.
+        replicator: the MonitorReplicator shipping the changes of a primary to its standby.
+        placement: the PlacementEngine creating, dropping and moving the primary of state replicas
+                from their access rates.
     """
 
     def __init__(self):
         """Initial the StateMonitor class and related monitoring dict."""
         self.so = StateOperater()
-        self.messages = {} 
+        self.directory = StateDirectory()
         self.settings = {}
+        self.external_states = ExternalCatalog(self.external_catalog_commit)
+        self.eviction = EvictionPool(self.so.state_remove,self.state_evicted)
+        self.missing_nodes = []
+        self.journal = CatalogJournal(self.catalog_capture)
+        self.ring = MonitorRing()
+        self.shard, self.role = self.ring.locate()
+        monitors = self.ring.shards[self.shard] if self.shard is not None else []
+        standby_ip = monitors[1] if self.role == "primary" and len(monitors) > 1 else None
+        self.replicator = MonitorReplicator(standby_ip,self.catalog_replica_capture)
+        self.placement = PlacementEngine(self.so.state_replicate,self.eviction,self.state_primary_move)
+
+    def writable(self):
+        """Check whether this monitor accepts catalog changes, only the primary of a partition does."""
+        return self.role != "standby"
+
+    @property
+    def messages(self):
+        """The monitoring dict of every worker VM kept by the directory."""
+        return self.directory.messages
+
+    def state_bootstrap(self):
+        """Initial the monitoring dicts from the catalog on the local disk, or else from the worker
+        VMs which answer in time. The recovered replicas and the worker VMs which did not answer are
+        left to state_reconcile_nodes."""
+        if self.journal.recover(self.catalog_restore,self.catalog_apply):
+            self.directory.mark_recovered()
+            self.missing_nodes = list(CLUSTER_CONFIG)
+            return
+
+        messages, self.missing_nodes = self.so.state_messages_init()
+        for node_ip, function_dict in messages.items():
+            self.journal.write({"op": "node", "node": node_ip, "states": self.state_owned(function_dict)},
+                               self.catalog_commit)
+
+    def state_reconcile_nodes(self):
+        """Index the worker VMs which did not answer at bootstrap, or whose replicas were recovered
+        from the disk, retrying until all of them are indexed."""
+        delay = 1.0
+        while self.missing_nodes:
+            for node_ip in list(self.missing_nodes):
+                try:
+                    function_dict = self.so.state_node_get(node_ip)
+                except Exception:
+                    continue
+                self.journal.write({"op": "node", "node": node_ip, "states": self.state_owned(function_dict)},
+                                   self.catalog_commit)
+                self.missing_nodes.remove(node_ip)
+            if self.missing_nodes:
+                time.sleep(delay)
+                delay = min(delay * 2, STATE_RECONCILE_MAX_DELAY)
+
+    def catalog_apply(self,record):
+        """Apply a change record to the monitoring dicts, used live and to replay the journal.
+
+        Args:
+            record: a dict containing "op" ("add", "delete", "activity", "external",
+                    "external_catalog", "node" or "primary") and the "node", "name", "activity",
+                    "stored", "names" or "states" of the change.
+        """
+        if record["op"] in ("add", "delete"):
+            self.state_change_apply(record["node"],record["op"],record["name"])
+        elif record["op"] == "activity":
+            self.directory.activity(record["node"],record["name"],record["activity"])
+        elif record["op"] == "external":
+            self.external_states.change(record["name"],record["stored"])
+        elif record["op"] == "external_catalog":
+            # The listing merged with the changes reported while listing, as logged and shipped.
+            record["names"] = self.external_states.replace(record["names"])
+        elif record["op"] == "node":
+            # The replicas the node answered, dropping the recovered ones it does not hold anymore.
+            stale = self.directory.merge(record["node"],record["states"])
+            self.state_primary_init(record["node"],record["states"])
+            for function_name in stale:
+                self.state_change_apply(record["node"],"delete",function_name)
+        elif record["op"] == "primary":
+            # Only moved to a node still holding a replica.
+            if record["node"] in self.directory.replicas(record["name"]):
+                self.settings.setdefault(record["name"],{})["primary"] = record["node"]
+
+    def external_catalog_commit(self,names):
+        """Log and ship the reconciled external storage catalog, on the primary monitor only."""
+        if self.writable():
+            self.journal.write({"op": "external_catalog", "names": names},self.catalog_commit)
+
+    def catalog_commit(self,record):
+        """Apply a live change record and queue it for the standby monitor."""
+        result = self.catalog_apply(record)
+        self.replicator.report(record)
+        return result
+
+    def catalog_replicate(self,payload):
+        """Apply the catalog or the change records shipped by the primary monitor of the partition.
+
+        Args:
+            payload: a dict containing the full "catalog" or the list of change "records" in order.
+
+        Returns:
+            The number of applied records.
+        """
+        if "catalog" in payload:
+            self.journal.consistent(lambda: self.catalog_restore(payload["catalog"]))
+            self.journal.snapshot()
+        for record in payload.get("records",[]):
+            self.journal.write(record,self.catalog_apply)
+        return len(payload.get("records",[]))
+
+    def catalog_replica_capture(self):
+        """Copy the monitoring dicts for the standby monitor, dropping the queued records the copy
+        contains."""
+        def capture():
+            self.replicator.clear()
+            return self.catalog_capture()
+        return self.journal.consistent(capture)
+
+    def state_owned(self,function_dict):
+        """Keep the states of a worker VM which belong to the partition of this monitor."""
+        if self.shard is None:
+            return function_dict
+        return {function_name: msg for function_name, msg in function_dict.items()
+                if self.ring.shard(function_name) == self.shard}
+
+    def catalog_capture(self):
+        """Copy the monitoring dicts for a journal snapshot, run under the journal lock."""
+        version, messages, locations = self.directory.snapshot()
+        return {"messages": messages,
+                "settings": {function_name: dict(setting) for function_name, setting in self.settings.items()},
+                "external": self.external_states.names()}
+
+    def catalog_restore(self,catalog):
+        """Replace the monitoring dicts with a journal snapshot."""
+        self.directory.load(catalog["messages"])
+        self.settings = catalog["settings"]
+        self.external_states.load(catalog["external"])
+
+    def state_primary_init(self,node_ip,function_dict):
+        """Take the replicas of a worker VM as master replicas of the states without one."""
+        for function_name in function_dict:
+            if not self.settings.get(function_name,{}).get("primary"):
+                self.settings[function_name] = {"primary": node_ip}
+
+    def state_primary_move(self,function_name,node_ip):
+        """Make the replica of a state on a node its master replica, once the current master
+        replica redirects the writes and handed its latest value over to it.
+
+        Returns:
+            True if the master replica moved.
+        """
+        primary_ip = self.settings.get(function_name,{}).get("primary")
+        if primary_ip and primary_ip != node_ip and not self.so.state_primary_handoff(function_name,primary_ip,node_ip):
+            return False
+        self.journal.write({"op": "primary", "node": node_ip, "name": function_name},self.catalog_commit)
+        return True
+
+    def state_placement(self):
+        """Place the state replicas of this partition from the access rates of the state managers.
+
+        Returns:
+            The report of the placement round.
+        """
+        rates = {node_ip: self.state_owned(node_rates) for node_ip, node_rates in self.so.state_access_rates_get().items()}
+        version, state_messages, state_locations = self.directory.snapshot()
+        primaries = {function_name: setting.get("primary") for function_name, setting in list(self.settings.items())}
+        return self.placement.place(rates,state_locations,primaries)
+
+    def state_placement_manager(self):
+        """Place the state replicas every STATE_PLACEMENT_INTERVAL seconds."""
+        while STATE_PLACEMENT_ENABLED:
+            time.sleep(STATE_PLACEMENT_INTERVAL)
+            # The standby monitor applies the placement shipped by the primary monitor.
+            if self.role == "standby":
+                continue
+            try:
+                self.state_placement()
+            except Exception as e:
+                print(f"Thread error: {e}") # Error handling
 
     def state_search(self,function_name):
         """Search the master state replica of the specific function_name.
@@ -38,21 +238,14 @@ class StateMonitor:
             A string about the ip address of primary(master) state replica location or "externalstorage".
         """
         # Exists master replica in other worker VM.
-        return_node = ""
-        if self.settings[function_name]:
-            if self.settings[function_name]["primary"] :
-                return_node = self.settings[function_name]["primary"]
-                return return_node
+        return_node = self.settings.get(function_name,{}).get("primary") or ""
+        if return_node:
+            return return_node
 
         #  Exists master replica in other worker VM.
         if return_node == "" :
-            # Search external storage
-            sfm = StateFileManager()
-            self.messages["externalstorage"] = self.sfm.external_states_get()
-            sfm.close()
-            
-            # In external storage
-            if function_name in self.messages["externalstorage"]:
+            # In external storage, answered by the catalog in memory
+            if function_name in self.external_states:
                 return "externalstorage"
         
         # Not in the cluster
@@ -67,12 +260,7 @@ class StateMonitor:
         Returen:
             A string LIST about the ip address of state replica locations in worker nodes
         """
-        node_list = []
-        for node_ip, funcion_dict in self.messages.items():
-            if function_name in funcion_dict:
-                node_list.append(node_ip)
-        
-        return node_list
+        return list(self.directory.replicas(function_name))
 
     def state_change(self,node_ip,change_type,function_name):
         """Update the state monitoring dict about the removing or adding of state replicas. 
@@ -82,10 +270,14 @@ class StateMonitor:
             node_ip(str): the location of adding or removing happened.
             change_type(str): "add" or "delete".
         """
+        self.journal.write({"op": change_type, "node": node_ip, "name": function_name},self.catalog_commit)
+
+    def state_change_apply(self,node_ip,change_type,function_name):
+        """Apply the adding or removing of a state replica to the monitoring dicts."""
         # State replica adding
         if change_type == "add": 
             # Initial new subdict
-            self.messages[node_ip][function_name]={}
+            self.directory.add(node_ip,function_name)
             
             # Set the value of monitor dict
             if function_name not in self.settings:
@@ -95,16 +287,15 @@ class StateMonitor:
         # State replica removing
         elif change_type == "delete":
             # Delete the removed state replica in monitor dict.
-            del self.messages[node_ip][function_name]
+            replicas = self.directory.delete(node_ip,function_name)
 
             # Change the master replica if the master state replica is removed.
-            if not function_name in self.settings:
+            if function_name in self.settings and self.settings[function_name].get("primary") == node_ip:
                 del self.settings[function_name]["primary"]
                 
                 # Select a slave replica randomly as new master replica.
-                for node_ip, funcion_dict in self.messages.items():
-                    if function_name in funcion_dict:
-                        self.settings[function_name]["primary"]=node_ip
+                if replicas:
+                    self.settings[function_name]["primary"] = replicas[0]
 
     def activity_schange(self,node_ip,activity,function_name):
         """Update the state monitoring dict about the temperature of on state replica. 
@@ -114,8 +305,41 @@ class StateMonitor:
             node_ip(str): the location of temperature changing happened.
             activity: the new temperature from {"cold","warm","hot"}
         """
-        self.messages[node_ip][function_name]={}
-        self.messages[node_ip][function_name]["activity"] = int(activity)
+        self.journal.write({"op": "activity", "node": node_ip, "name": function_name, "activity": int(activity)},
+                           self.catalog_commit)
+
+    def state_external_change(self,function_name,stored):
+        """Update the external storage catalog about a state pushed to or deleted from external storage."""
+        self.journal.write({"op": "external", "name": function_name, "stored": stored},self.catalog_commit)
+
+    def state_report_batch(self,node_ip,reports):
+        """Update the state monitoring dict with a batch of reports from one state manager.
+
+        Args:
+            node_ip(str): the location of the reporting state manager.
+            reports: the list of reports in order, dicts containing "type" ("add", "delete",
+                    "activity", "external_add" or "external_delete"), "name" and "activity".
+
+        Returns:
+            A dict containing the number of applied and failed reports.
+        """
+        applied = 0
+        failed = 0
+        for report in reports:
+            try:
+                if report["type"] == "activity":
+                    self.activity_schange(node_ip,report["activity"],report["name"])
+                elif report["type"] == "external_add":
+                    self.state_external_change(report["name"],True)
+                elif report["type"] == "external_delete":
+                    self.state_external_change(report["name"],False)
+                else:
+                    self.state_change(node_ip,report["type"],report["name"])
+                applied += 1
+            except Exception as e:
+                print(f"Report error: {e}") # Error handling
+                failed += 1
+        return {"applied": applied, "failed": failed}
 
     def function_infomation_acquisition(self,function_name):
         """Acquire all information about state of the specific function corresponding.
@@ -127,11 +351,9 @@ class StateMonitor:
             A dict containing the location list, temperature list, scope and master location.
         """
         return_dict = {}
-        return_dict["scope"] = 0
-        for node_ip, funcion_dict in self.messages.items():
-            if function_name in funcion_dict:
-                return_dict["location"][node_ip]["activity"] = funcion_dict[function_name]["activity"]
-                return_dict["scope"] += 1
+        replicas = self.directory.replicas(function_name)
+        return_dict["location"] = {node_ip: {"activity": activity} for node_ip, activity in replicas.items()}
+        return_dict["scope"] = len(replicas)
         return_dict["primary"] = self.settings[function_name]
         return return_dict
 
@@ -148,29 +370,38 @@ class StateMonitor:
         # Remove old state in source VM
         self.so.state_remove(function_name,msg['source_ip'],0)
 
+    def state_evicted(self,function_name,node_name,remove_type):
+        """Apply a completed removal of a cold state replica to the live monitoring dicts."""
+        self.state_change(node_name,"delete",function_name)
+        if remove_type == 1:
+            self.state_external_change(function_name,True)
+
     def state_remove_from_nodes(self):
         """Manage cold state replicas to remove them."""
         while True :
-            # Deepcopy the monitor dicts.
-            state_messages = copy.deepcopy(self.messages)
-            state_setting = copy.deepcopy(self.settings)
+            # The standby monitor applies the removals shipped by the primary monitor.
+            if self.role == "standby":
+                time.sleep(120)
+                continue
+
+            # Take a copy-on-write snapshot of the monitor dicts, the live dicts keep changing.
+            version, state_messages, state_locations = self.directory.snapshot()
             
-            # Check the temperature of every state replica
+            # Plan the removals, counting the replicas already planned to be removed.
+            pending_remove = []
+            planned = {}
             for node_name in state_messages :
-                pending_remove=[]
                 for function_name in state_messages[node_name] :            
                     
                     # Remove the state replica with "cold" temperature.
-                    if state_messages[node_name][function_name]["activity"] == 0 :
+                    if state_messages[node_name][function_name].get("activity") == 0 :
                         
                         # Judge if there is cold replica
-                        count = 0
-                        for node_ip, funcion_dict in state_messages.items():
-                            if function_name in funcion_dict:
-                                count += 1
+                        count = len(state_locations.get(function_name,{})) - planned.get(function_name,0)
+                        primary = self.settings.get(function_name,{}).get("primary")
 
                         # Remove directly if the removed replica is slave replica.
-                        if not state_setting[function_name]["primary"] == node_name :     
+                        if not primary == node_name :     
                             # If there is only one replica, move it to external storage.
                             if count == 1 :
                                 pending_remove.append([function_name,node_name,1])
@@ -182,16 +413,16 @@ class StateMonitor:
                         # Else remove the replica and set new master replica.
                         else :
                             # If there is only one replica, move it to external storage.
-                            if count ==1 :
+                            if count == 1 :
                                 pending_remove.append([function_name,node_name,1])
+                            else:
+                                continue
+                        planned[function_name] = planned.get(function_name,0) + 1
                 
-                # Excute specific remove operations.
-                for msg in pending_remove:
-                    self.so.state_remove(msg[0],msg[1],msg[2])
-
-            # Update the monitor dicts.
-            self.messages = copy.deepcopy(state_messages)
-            self.settings = copy.deepcopy(state_setting)
+            # Excute the removals concurrently, each applied as a delta to the live dicts when it completes.
+            report = self.eviction.sweep(pending_remove)
+            if report["failed"]:
+                print(f"Eviction sweep: {report['failed']} of {report['total']} removals failed") # Error handling
             
             # The algorithm will excute once every 120 seconds.
-            time.sleep(120)
\ No newline at end of file
+            time.sleep(120)
@@ -5,11 +5,15 @@ Typical usage example:
     sm = StateOperater()
     sm.state_messages_init()
 """
+import concurrent.futures
 import requests
 import json
 import threading
 
 CLUSTER_CONFIG = {}
+STATE_BOOTSTRAP_TIMEOUT = 3.0
+STATE_REMOVE_TIMEOUT = 120.0
+STATE_REPLICATE_TIMEOUT = 30.0
 
 class StateOperater:
     """Help StateMonitor complete detailed operations about accessing state manager in worker
@@ -19,18 +23,63 @@ class StateOperater:
         """Initial the StateOperater class."""
         pass
 
-    def state_messages_init():
-        """Initial the messages dict in state monitor from the state managers in worker VMs.
+    def state_node_get(self,node_ip,timeout=STATE_BOOTSTRAP_TIMEOUT,path="state_monitor_get"):
+        """Get the state replicas of the state manager in one worker VM, or another of its
+        interfaces given by path.
+
+        Returns:
+            A dict with the state names as keys and their monitoring messages as values.
+        """
+        url = f'http://{node_ip}:8054/{path}'
+        res = requests.get(url, timeout=timeout)
+        res.raise_for_status()
+        return json.loads(res.text)
+
+    def state_messages_init(self,timeout=STATE_BOOTSTRAP_TIMEOUT):
+        """Initial the messages dict in state monitor from the state managers in worker VMs,
+        querying all of them concurrently and waiting at most timeout seconds.
         
         Returns:
-            A dict containing the messages from every worker VM.
+            A tuple of a dict containing the messages from every worker VM which answered in time,
+            and the list of the worker VMs which did not.
+        """
+        return self.state_nodes_get("state_monitor_get",timeout)
+
+    def state_access_rates_get(self,timeout=STATE_BOOTSTRAP_TIMEOUT):
+        """Get the access and write rates of the state replicas from the state managers in worker
+        VMs concurrently.
+
+        Returns:
+            A dict with the ips of the worker VMs which answered in time as keys and their
+            /state_access_rate_get answers as values.
+        """
+        return self.state_nodes_get("state_access_rate_get",timeout)[0]
+
+    def state_nodes_get(self,path,timeout=STATE_BOOTSTRAP_TIMEOUT):
+        """Get an interface of the state managers in all worker VMs concurrently, waiting at most
+        timeout seconds.
+
+        Returns:
+            A tuple of a dict with the ips of the worker VMs which answered in time as keys and
+            their answers as values, and the list of the worker VMs which did not.
         """
         messages_dict = {}
-        for node_ip in CLUSTER_CONFIG:
-            url = f'http://{node_ip}:8054/state_monitor_get'
-            res = requests.get(url)
-            messages_dict[node_ip] = json.loads(res.text)
-        return messages_dict
+        missing_nodes = []
+        if not CLUSTER_CONFIG:
+            return messages_dict, missing_nodes
+
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(CLUSTER_CONFIG))
+        futures = {executor.submit(self.state_node_get,node_ip,timeout,path): node_ip for node_ip in CLUSTER_CONFIG}
+        done, not_done = concurrent.futures.wait(futures,timeout=timeout)
+        for future in done:
+            try:
+                messages_dict[futures[future]] = future.result()
+            except Exception as e:
+                print(f"Node error: {futures[future]} {e}") # Error handling
+                missing_nodes.append(futures[future])
+        missing_nodes.extend(futures[future] for future in not_done)
+        executor.shutdown(wait=False)
+        return messages_dict, missing_nodes
 
     def run_thread(thread_function):
         """Run a threading."""
@@ -38,7 +87,7 @@ class StateOperater:
         thread.daemon = True
         thread.start()
 
-    def state_remove(function_name,node_name,remove_type):
+    def state_remove(self,function_name,node_name,remove_type):
         """Send a request to a state manager in worker VM in order to remove a specific state 
         replica.
         
@@ -47,12 +96,49 @@ class StateOperater:
             node_name(str) : the ip address of the state manager in worker VM.
             remove type(int): 0 represents just removing the replica, whiile 1 represents
                     removing the replica after moving it to external storage.
+
+        Returns:
+            True if the state manager removed the replica.
         """
         data = {'type': remove_type}
         url = f'http://{node_name}:8054/state_remove/{function_name}'
-        res = requests.post(url, json=data)
+        try:
+            res = requests.post(url, json=data, timeout=STATE_REMOVE_TIMEOUT)
+        except requests.RequestException as e:
+            print(f"Remove error: {e}") # Error handling
+            return False
+        return res.ok
+
+    def state_replicate(self,function_name,ip):
+        """Ask a state manager in worker VM to pull a replica of a state ahead of its reads.
+
+        Returns:
+            True if the state manager holds a replica of the state.
+        """
+        url = f'http://{ip}:8054/state_read/{function_name}'
+        try:
+            # Read as the monitor, not counted as an access of the replica.
+            with requests.get(url, json={'locked': 0, 'identity': 0}, stream=True, timeout=STATE_REPLICATE_TIMEOUT) as res:
+                return res.ok
+        except requests.RequestException as e:
+            print(f"Replicate error: {e}") # Error handling
+            return False
+
+    def state_primary_handoff(self,function_name,primary_ip,node_ip):
+        """Ask the master replica of a state to hand its writes over to the replica on another node.
+
+        Returns:
+            True if the new master replica holds the latest value and the old one redirects the writes.
+        """
+        url = f'http://{primary_ip}:8054/state_primary_handoff/{function_name}'
+        try:
+            res = requests.post(url, json={'primary': node_ip}, timeout=STATE_REPLICATE_TIMEOUT)
+            return res.ok
+        except requests.RequestException as e:
+            print(f"Handoff error: {e}") # Error handling
+            return False
 
-    def state_read(function_name,data,ip):
+    def state_read(self,function_name,data,ip):
         """Send a request to a state manager in worker VM to read a state.
 
         Read the state by state monitor for node "ip" to pull the specific state from other
@@ -64,4 +150,4 @@ class StateOperater:
             data(dict): the request messages sent to the state manager in worker VM.
         """
         url = f'http://{ip}:8054/state_read/{function_name}'
-        res = requests.get(url, json=data)
\ No newline at end of file
+        res = requests.get(url, json=data, timeout=STATE_REPLICATE_TIMEOUT)
\ No newline at end of file
@@ -7,9 +7,15 @@ scheduler and consistency manager.
 from flask import Flask, request, jsonify
 
 from .app import StateMonitor
+from ... import AppServer
 
 app = Flask(__name__)
 SM = StateMonitor()
+SERVER = AppServer(app,8053,"state_monitor")
+
+def state_standby_reject():
+    """Reject a catalog change sent to a standby monitor, the sender retries it on the primary."""
+    return jsonify({"error": "standby monitor does not accept changes"}),503
 
 @app.route('/state_search/<function_name>',methods=['GET'])
 def state_search(function_name):
@@ -24,13 +30,24 @@ def state_search_all(function_name):
 @app.route('/state_change/<change_type>/<function_name>',methods=['POST'])
 def state_change(change_type,function_name):
     """Update the monitor dict about the state replicas information in state monitor."""
+    if not SM.writable():
+        return state_standby_reject()
     return jsonify(SM.state_change(request.remote_addr,change_type,function_name)),200
 
 @app.route('/activity_change/<function_name>/<activity>',methods=['POST'])
 def activity_schange(activity,function_name):
     """Update the monitor dict about the state replica's data temperature information in state monitor."""
+    if not SM.writable():
+        return state_standby_reject()
     return jsonify(SM.activity_schange(request.remote_addr,activity,function_name)),200
 
+@app.route('/state_report_batch',methods=['POST'])
+def state_report_batch():
+    """Apply a batch of membership and temperature reports from a state manager in order."""
+    if not SM.writable():
+        return state_standby_reject()
+    return jsonify(SM.state_report_batch(request.remote_addr,request.get_json()['reports'])),200
+
 @app.route('/function_infomation_acquisition/<function_name>',methods=['POST'])
 def function_infomation_acquisition(function_name):
     """Get all messages stored in state monitor about specific function"""
@@ -39,14 +56,53 @@ def function_infomation_acquisition(function_name):
 @app.route('/state_migration/<function_name>',methods=['POST'])
 def state_migration(function_name):
     """Migrate a state replica from one worker VM to anoter one."""
+    if not SM.writable():
+        return state_standby_reject()
     return jsonify(SM.state_migration(request.get_json(),function_name)),200
 
+@app.route('/external_catalog_get',methods=['GET'])
+def external_catalog_get():
+    """Get the size and the last reconciliation time of the external storage catalog."""
+    return jsonify(SM.external_states.stats()),200
+
+@app.route('/eviction_report_get',methods=['GET'])
+def eviction_report_get():
+    """Get the progress and latency report of the last cold state eviction sweep."""
+    return jsonify(SM.eviction.last_report),200
+
+@app.route('/catalog_journal_get',methods=['GET'])
+def catalog_journal_get():
+    """Get the sequence number and the last snapshot time of the catalog journal."""
+    return jsonify(SM.journal.stats()),200
+
+@app.route('/catalog_replicate',methods=['POST'])
+def catalog_replicate():
+    """Apply the catalog changes shipped by the primary monitor of this partition."""
+    return jsonify(SM.catalog_replicate(request.get_json())),200
+
+@app.route('/monitor_ring_get',methods=['GET'])
+def monitor_ring_get():
+    """Get the partition and role of this monitor, the ring and the replication progress."""
+    return jsonify({"shard": SM.shard, "role": SM.role, "ring": SM.ring.stats(),
+                    "replication": SM.replicator.stats()}),200
+
+@app.route('/placement_report_get',methods=['GET'])
+def placement_report_get():
+    """Get the decisions and results of the last replica placement round."""
+    return jsonify(SM.placement.last_report),200
+
 @app.route('/primary_state_search/<function_name>',methods=['GET'])
 def primary_state_search(function_name):
-    """Search the primary position of the specific function_name"""
-    return jsonify(SM.settings[function_name]["primary"]),200
+    """Search the primary position of the specific function_name, "" if it is not known yet."""
+    return jsonify(SM.settings.get(function_name,{}).get("primary","")),200
 
 if __name__ == '__main__':
-    SM.messages = SM.so.state_messages_init() # initial the state monitoring dict
-    SM.so.run_thread(SM.state_remove_from_nodes)  # run the thread to manage cold state replicas
-    app.run(port=8053) # run flask app
\ No newline at end of file
+    SM.state_bootstrap() # initial and index the state monitoring dict from the disk or the worker VMs answering in time
+    SERVER.background(SM.state_reconcile_nodes)  # run the thread to index the worker VMs answering late or recovered
+    SERVER.background(SM.journal.journal_manager)  # run the thread to fsync and snapshot the catalog journal
+    SERVER.background(SM.replicator.replicate_manager)  # run the thread to ship the catalog changes to the standby monitor
+    SERVER.on_shutdown(SM.journal.close)  # snapshot the catalog journal when stopping
+    SERVER.background(SM.state_remove_from_nodes)  # run the thread to manage cold state replicas
+    SERVER.background(SM.state_placement_manager)  # run the thread to place state replicas by their access rates
+    SERVER.background(SM.external_states.reconcile_manager)  # run the thread to reconcile the external storage catalog
+    SERVER.serve() # run flask app
\ No newline at end of file
@@ -5,24 +5,267 @@ Typical usage example:
   srw = StateRW()
   data = srw.read()
   srw.write(data)
+  srw.state_compare_and_set(lambda count: count + 1)
+
+  asrw = AsyncStateRW(function_name)
+  data = await asrw.state_read()
 """
 import requests
+from requests.adapters import HTTPAdapter
+import asyncio
+import bisect
+import collections
+import copy
+import hashlib
+import json
 import os
+import threading
+import time
+import weakref
+
+try:
+    import aiohttp
+except ImportError: # aiohttp is only required by AsyncStateRW
+    aiohttp = None
+try:
+    import msgpack
+except ImportError: # msgpack is only required by the binary wire format
+    msgpack = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+STATE_CAS_RETRIES = int(os.getenv("STATE_CAS_RETRIES", "8"))
+STATE_CAS_BACKOFF = float(os.getenv("STATE_CAS_BACKOFF", "0.01"))
+STATE_CACHE_ENABLED = os.getenv("STATE_CACHE_ENABLED", "0") == "1"
+STATE_CACHE_SIZE = int(os.getenv("STATE_CACHE_SIZE", "64"))
+STATE_CACHE_MAX_AGE = float(os.getenv("STATE_CACHE_MAX_AGE", "0"))
+STATE_PRIMARY_TTL = float(os.getenv("STATE_PRIMARY_TTL", "30"))
+STATE_REDIRECT_HOPS = 3
+STATE_HTTP_POOL_MAXSIZE = int(os.getenv("STATE_HTTP_POOL_MAXSIZE", "8"))
+STATE_HTTP_TIMEOUT = float(os.getenv("STATE_HTTP_TIMEOUT", "30"))
+
+STATE_WIRE_FORMAT = os.getenv("STATE_WIRE_FORMAT", "application/json")
+
+# The state monitor partitions as "primary,standby;primary,standby", the same as STATE_MONITOR_SHARDS.
+STATE_MONITOR_SHARDS = os.getenv("STATE_MONITOR_SHARDS", "100.64.214.11")
+STATE_MONITOR_VNODES = int(os.getenv("STATE_MONITOR_VNODES", "64"))
+STATE_MONITOR_FAILOVER_SECONDS = float(os.getenv("STATE_MONITOR_FAILOVER_SECONDS", "10"))
+
+# The keep-alive session shared by every StateRW in a warm container.
+SESSION = requests.Session()
+SESSION.mount("http://", HTTPAdapter(pool_maxsize=STATE_HTTP_POOL_MAXSIZE))
+
+class StateStaleLeaseError(Exception):
+    """The lease of a locked read expired and the state was locked by another function since,
+    so the write was rejected."""
+
+def state_stale_names(results):
+    """List the states of a write_many whose write was rejected for a stale lease."""
+    return sorted(name for name, result in results.items() if isinstance(result, dict) and result.get('stale_token'))
+
+def state_cas_conflict(status, msg):
+    """Check whether a compare-and-set was refused because another writer changed the state."""
+    version = msg.get('version') if isinstance(msg, dict) else None
+    return status == 409 and isinstance(version, int) and not isinstance(version, bool)
+
+class StateCache:
+    """An LRU cache of state values with their versions, shared by every StateRW in a warm
+    container.
+
+    Attributes:
+        size: the maximum number of cached states.
+        entries: an ordered dict with state names as keys and [version, state data, check time]
+                as values, from the least to the most recently used.
+        hits: the number of reads answered without transferring the state.
+        misses: the number of reads transferring the state.
+    """
+
+    def __init__(self, size=STATE_CACHE_SIZE):
+        """Initial the StateCache class."""
+        self.size = size
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, function_name):
+        """Get a cached state and mark it as recently used.
+
+        Returns:
+            The [version, state data, check time] entry, or None if the state is not cached.
+        """
+        with self.lock:
+            entry = self.entries.get(function_name)
+            if entry is not None:
+                self.entries.move_to_end(function_name)
+            return entry
+
+    def put(self, function_name, version, state_data):
+        """Cache a state value and evict the least recently used states over the size bound."""
+        with self.lock:
+            self.entries[function_name] = [version, state_data, time.time()]
+            self.entries.move_to_end(function_name)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def touch(self, function_name):
+        """Record that a cached state was checked to be up to date."""
+        with self.lock:
+            if function_name in self.entries:
+                self.entries[function_name][2] = time.time()
+
+    def invalidate(self, function_name):
+        """Drop a cached state."""
+        with self.lock:
+            self.entries.pop(function_name, None)
+
+STATE_CACHE = StateCache()
+
+def state_request_kwargs(data):
+    """Build the request arguments sending a payload to a state manager in the wire format.
+
+    Args:
+        data: the request payload
+
+    Returns:
+        A dict of keyword arguments for requests or aiohttp.
+    """
+    # The node of the function, counted by the replicas to place them near their readers and writers.
+    headers = {'X-State-Origin': os.getenv('NodeIP', "")}
+    if STATE_WIRE_FORMAT != "application/msgpack" or msgpack is None:
+        return {'json': data, 'headers': headers}
+    headers = {
+        **headers,
+        'Content-Type': "application/msgpack",
+        'Accept': "application/msgpack",
+    }
+    if zstandard is not None:
+        headers['X-State-Accept-Encoding'] = "zstd"
+    return {'data': msgpack.packb(data, use_bin_type=True), 'headers': headers}
+
+def state_response_decode(content, headers):
+    """Decode the body of a state manager's response in JSON or the binary wire format.
+
+    Args:
+        content: the response body bytes
+        headers: the response headers
+
+    Returns:
+        The response payload.
+    """
+    if headers.get('X-State-Encoding') == "zstd":
+        content = zstandard.ZstdDecompressor().decompress(content)
+    if headers.get('Content-Type', "").startswith("application/msgpack"):
+        return msgpack.unpackb(content, raw=False)
+    return json.loads(content)
+
+class MonitorRing:
+    """The consistent hash ring of the state monitor partitions, the same as the state managers use,
+    shared by every StateRW in a warm container.
+
+    Attributes:
+        shards: a list of the partitions, each a list of the primary and standby monitor ips.
+        points: the sorted hashes of the ring points.
+        owners: the partition index of every ring point.
+        down: a dict with the ips of the failed monitors as keys and the time to retry them as values.
+    """
+
+    def __init__(self, shards=STATE_MONITOR_SHARDS, vnodes=STATE_MONITOR_VNODES):
+        self.shards = [shard.split(",") for shard in shards.split(";") if shard]
+        ring = sorted((self.hash(f"{monitors[0]}#{vnode}"), index)
+                      for index, monitors in enumerate(self.shards) for vnode in range(vnodes))
+        self.points = [point for point, index in ring]
+        self.owners = [index for point, index in ring]
+        self.down = {}
+
+    @staticmethod
+    def hash(key):
+        """Hash a key to a 64 bits integer, the same in every process."""
+        return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+    def monitors(self, function_name):
+        """List the monitors of the partition owning a state, the ones not marked failed first."""
+        position = bisect.bisect(self.points, self.hash(function_name)) % len(self.points)
+        now = time.time()
+        return sorted(self.shards[self.owners[position]], key=lambda monitor_ip: self.down.get(monitor_ip, 0) > now)
+
+    def mark_down(self, monitor_ip):
+        """Skip a failed monitor for STATE_MONITOR_FAILOVER_SECONDS."""
+        self.down[monitor_ip] = time.time() + STATE_MONITOR_FAILOVER_SECONDS
+
+MONITOR_RING = MonitorRing()
+
+# The master replica locations shared by every invocation in a warm container, with state names
+# as keys and [ip address, expire time] as values.
+PRIMARY_CACHE = {}
+
+def state_primary_search(function_name, refresh=False):
+    """Search the master replica location of a state, cached for STATE_PRIMARY_TTL seconds.
+
+    Args:
+        function_name: the state name
+        refresh: ask the state monitor even if the location is cached
+
+    Returns:
+        A string of the ip address where the master replica is located.
+    """
+    entry = PRIMARY_CACHE.get(function_name)
+    if not refresh and entry is not None and entry[1] > time.time():
+        return entry[0]
+
+    error = None
+    for monitor_ip in MONITOR_RING.monitors(function_name):
+        url = f"http://{monitor_ip}:8053/primary_state_search/{function_name}"
+        try:
+            res = SESSION.get(url, timeout=STATE_HTTP_TIMEOUT)
+        except requests.RequestException as e:
+            error = e
+            MONITOR_RING.mark_down(monitor_ip)
+            continue
+        if res.status_code >= 500:
+            error = requests.HTTPError(f"{monitor_ip} answered {res.status_code}")
+            MONITOR_RING.mark_down(monitor_ip)
+            continue
+        primary_ip = res.text.strip().strip("\"")
+        state_primary_update(function_name, primary_ip)
+        return primary_ip
+    raise error
+
+def state_primary_update(function_name, primary_ip):
+    """Cache the master replica location of a state, e.g. learned from a redirect."""
+    PRIMARY_CACHE[function_name] = [primary_ip, time.time() + STATE_PRIMARY_TTL]
 
 class StateRW:
     """Help user access the state stored by DesFaaS.
 
+    All requests go through the module-level keep-alive SESSION, so the connections to the state
+    managers are reused across invocations in a warm container.
+
     Attributes:
         function_name(str): the state name stored in DesFaaS
         read_url(str): the url to read state  
         wirte_url: the url to wriet state
+        primary_ip(str): the location of the master replica, resolved on first write
+        lock_token(int): the fencing token of the lease taken by the last locked read
+        lock_tokens(dict): the fencing tokens of the leases taken by the last locked read_many
+        cache(bool): whether unlocked reads use the in-process state cache
     """
 
-    def __init__(self, function_name):
+    def __init__(self, function_name, cache=STATE_CACHE_ENABLED):
         """Initial the StateRW class and constuct the url to read and wirte"""
         self.function_name = function_name
+        self.cache = cache
         self.read_url = f"http://{os.getenv('NodeIP')}:8054/state_read/{self.function_name}"
-        self.write_url = f"http://{self.state_primary_check()}:8054/state_write/{self.function_name}"
+        self.primary_ip = None
+        self.lock_token = None
+        self.lock_tokens = {}
+
+    @property
+    def write_url(self):
+        """The url to write state at the cached master replica location."""
+        return f"http://{self.state_primary_check()}:8054/state_write/{self.function_name}"
 
     def state_primary_check(self):
         """Search the master replica location of the funtion.
@@ -30,30 +273,551 @@ class StateRW:
         Returns:
             A string of the ip address where the master replica is located.
         """
-        url = f"http://100.64.214.11:8053/primary_state_search/{self.function_name}"
-        return requests.get(url).text.strip().strip("\"")
+        if self.primary_ip is None:
+            self.primary_ip = state_primary_search(self.function_name)
+        return self.primary_ip
 
-    def state_read(self):
+    def state_read(self, locked=0):
         """Read state data.
+
+        Args:
+            locked: 1 to lock the state until the next state_write, the lock is a lease which
+                    expires if the function crashes before writing
         
         Returns:
             state data
         """
+        if self.cache and locked == 0:
+            return self.state_read_cached()
+
         data = {
-            'locked':  0,
+            'locked':  locked,
             'identity': 1
         }
-        res = requests.get(self.read_url, json=data)
-        return res.json()
+        res = SESSION.get(self.read_url, **state_request_kwargs(data), timeout=STATE_HTTP_TIMEOUT)
+        res.raise_for_status()
+        if locked == 1:
+            self.lock_token = int(res.headers['X-State-Lock-Token'])
+        return state_response_decode(res.content, res.headers)
 
     def state_write(self, state_data):
         """Write state data.
+
+        The write is rejected by the state manager if the lease of the locked read has expired
+        and the state has been locked by another function since.
         
         Args:
             state_data
+
+        Raises:
+            StateStaleLeaseError: the lease of the locked read was taken over.
+            requests.HTTPError: the master replica failed to write the state.
         """
         data = {
             'state_data':  state_data,
             'identity': 1
         }
-        requests.post(self.write_url, json=data)
\ No newline at end of file
+        if self.lock_token is not None:
+            data['token'] = self.lock_token
+            self.lock_token = None
+        STATE_CACHE.invalidate(self.function_name)
+        res = self.state_primary_post("state_write", data)
+        if res.status_code == 409:
+            raise StateStaleLeaseError(f"lease of state {self.function_name} was taken over")
+        res.raise_for_status()
+
+    def state_primary_post(self, path, data):
+        """Send a write request to the master replica, following the redirects of state managers
+        which are no longer the master replica and updating the cached location.
+
+        Args:
+            path: the interface name, such as "state_write"
+            data: the request body
+
+        Returns:
+            The response of the master replica.
+        """
+        self.state_primary_check()
+        for hop in range(STATE_REDIRECT_HOPS):
+            url = f"http://{self.primary_ip}:8054/{path}/{self.function_name}"
+            res = SESSION.post(url, **state_request_kwargs(data), allow_redirects=False, timeout=STATE_HTTP_TIMEOUT)
+            if res.status_code != 307:
+                break
+            self.primary_ip = state_response_decode(res.content, res.headers)['redirect']
+            state_primary_update(self.function_name, self.primary_ip)
+        return res
+
+    def state_read_cached(self):
+        """Read state data through the in-process cache.
+
+        A cached value checked within STATE_CACHE_MAX_AGE seconds is returned without any
+        request, otherwise a conditional read only transfers the state if its version changed.
+
+        Returns:
+            state data
+        """
+        entry = STATE_CACHE.get(self.function_name)
+        if entry is not None and time.time() - entry[2] < STATE_CACHE_MAX_AGE:
+            STATE_CACHE.hits += 1
+            return copy.deepcopy(entry[1])
+
+        # Ask the local node whether the cached version is still current
+        url = f"http://{os.getenv('NodeIP')}:8054/state_read_versioned/{self.function_name}"
+        data = {
+            'identity': 1,
+            'if_version': entry[0] if entry is not None else None
+        }
+        res = SESSION.get(url, **state_request_kwargs(data), timeout=STATE_HTTP_TIMEOUT)
+        res.raise_for_status()
+        msg = state_response_decode(res.content, res.headers)
+        if msg.get('not_modified'):
+            STATE_CACHE.hits += 1
+            STATE_CACHE.touch(self.function_name)
+            return copy.deepcopy(entry[1])
+
+        STATE_CACHE.misses += 1
+        STATE_CACHE.put(self.function_name, msg['version'], msg['state_data'])
+        return copy.deepcopy(msg['state_data'])
+
+    def state_lock_renew(self):
+        """Extend the lease of the state locked by state_read(locked=1).
+
+        Returns:
+            True if the lease was renewed, False if it had already expired.
+        """
+        url = f"http://{os.getenv('NodeIP')}:8054/state_lock_renew/{self.function_name}"
+        res = SESSION.post(url, json={'token': self.lock_token, 'identity': 1}, timeout=STATE_HTTP_TIMEOUT)
+        return res.status_code == 200
+
+    def state_read_versioned(self, primary=False):
+        """Read state data together with its version.
+
+        Args:
+            primary: read from the master replica instead of the local replica if True
+
+        Returns:
+            A tuple of the state data and its version.
+        """
+        node_ip = self.state_primary_check() if primary else os.getenv('NodeIP')
+        url = f"http://{node_ip}:8054/state_read_versioned/{self.function_name}"
+        res = SESSION.get(url, **state_request_kwargs({'locked': 0, 'identity': 1}), timeout=STATE_HTTP_TIMEOUT)
+        res.raise_for_status()
+        msg = state_response_decode(res.content, res.headers)
+        return msg['state_data'], msg['version']
+
+    def state_compare_and_set(self, update, retries=STATE_CAS_RETRIES):
+        """Update state data optimistically without locking the state.
+
+        The state is read with its version from the master replica and the new value is written
+        only if no other writer changed the state in between, otherwise it is retried.
+
+        Args:
+            update: a function computing the new state data from the current state data
+            retries: the maximum number of attempts
+
+        Returns:
+            The state data written.
+
+        Raises:
+            RuntimeError: the state was changed by other writers in every attempt.
+            requests.HTTPError: the state manager failed to read or write the state.
+        """
+        for attempt in range(retries):
+            state_data, version = self.state_read_versioned(primary=True)
+            new_data = update(state_data)
+            data = {
+                'version': version,
+                'state_data': new_data,
+                'identity': 1
+            }
+            res = self.state_primary_post("state_cas", data)
+            if res.status_code == 200:
+                STATE_CACHE.invalidate(self.function_name)
+                return new_data
+            msg = state_response_decode(res.content, res.headers) if res.status_code == 409 else None
+            if not state_cas_conflict(res.status_code, msg):
+                res.raise_for_status()
+                raise RuntimeError(f"compare-and-set of state {self.function_name} failed with status {res.status_code}")
+
+            # Back off exponentially before retrying
+            time.sleep(STATE_CAS_BACKOFF * 2 ** attempt)
+        raise RuntimeError(f"compare-and-set of state {self.function_name} failed after {retries} attempts")
+
+    def read_many(self, function_names, locked=0):
+        """Read several states from the local node in one request.
+
+        Args:
+            function_names: the list of state names
+            locked: 1 to lock all the states until the next write_many, the states are locked
+                    in sorted name order so overlapping locked reads can not deadlock
+
+        Returns:
+            A dict with state names as keys and state data as values.
+        """
+        url = f"http://{os.getenv('NodeIP')}:8054/state_mget"
+        data = {
+            'names': list(function_names),
+            'locked': locked,
+            'identity': 1
+        }
+        res = SESSION.get(url, **state_request_kwargs(data), timeout=STATE_HTTP_TIMEOUT)
+        res.raise_for_status()
+        msg = state_response_decode(res.content, res.headers)
+        if locked == 1:
+            self.lock_tokens = msg['tokens']
+        return msg['states']
+
+    def write_many(self, states):
+        """Write several states, sending one request to the master replica node of each group.
+
+        Args:
+            states: a dict with state names as keys and the new state data as values
+
+        Returns:
+            A dict with state names as keys and the result of every write as values.
+
+        Raises:
+            StateStaleLeaseError: the lease of a locked read was taken over, the other states
+                    are written.
+            requests.HTTPError: a master replica node failed to write its states.
+        """
+        results = {}
+        pending = dict(states)
+        for hop in range(STATE_REDIRECT_HOPS):
+            # Group the states by their master replica location
+            groups = {}
+            for function_name, state_data in pending.items():
+                primary_ip = state_primary_search(function_name)
+                groups.setdefault(primary_ip, {})[function_name] = state_data
+
+            pending = {}
+            for primary_ip, group in groups.items():
+                data = {
+                    'states': group,
+                    'tokens': {name: self.lock_tokens[name] for name in group if name in self.lock_tokens},
+                    'identity': 1
+                }
+                for function_name in group:
+                    STATE_CACHE.invalidate(function_name)
+                res = SESSION.post(f"http://{primary_ip}:8054/state_mset", **state_request_kwargs(data), timeout=STATE_HTTP_TIMEOUT)
+                res.raise_for_status()
+                for function_name, result in state_response_decode(res.content, res.headers).items():
+                    # Resend the states whose master replica has moved
+                    if isinstance(result, dict) and result.get('redirect'):
+                        state_primary_update(function_name, result['redirect'])
+                        pending[function_name] = group[function_name]
+                    results[function_name] = result
+            if not pending:
+                break
+        self.lock_tokens = {}
+        if state_stale_names(results):
+            raise StateStaleLeaseError(f"leases of states {state_stale_names(results)} were taken over")
+        return results
+
+
+# The aiohttp sessions shared by every AsyncStateRW, one for each event loop.
+ASYNC_SESSIONS = weakref.WeakKeyDictionary()
+
+def async_session():
+    """Get the keep-alive aiohttp session of the running event loop, created on first use."""
+    loop = asyncio.get_running_loop()
+    session = ASYNC_SESSIONS.get(loop)
+    if session is None or session.closed:
+        session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit_per_host=STATE_HTTP_POOL_MAXSIZE),
+            timeout=aiohttp.ClientTimeout(total=STATE_HTTP_TIMEOUT))
+        ASYNC_SESSIONS[loop] = session
+    return session
+
+async def async_state_primary_search(function_name, refresh=False):
+    """Search the master replica location of a state without blocking the event loop.
+
+    Args:
+        function_name: the state name
+        refresh: ask the state monitor even if the location is cached
+
+    Returns:
+        A string of the ip address where the master replica is located.
+    """
+    entry = PRIMARY_CACHE.get(function_name)
+    if not refresh and entry is not None and entry[1] > time.time():
+        return entry[0]
+
+    error = None
+    for monitor_ip in MONITOR_RING.monitors(function_name):
+        url = f"http://{monitor_ip}:8053/primary_state_search/{function_name}"
+        try:
+            async with async_session().get(url) as res:
+                if res.status >= 500:
+                    error = aiohttp.ClientResponseError(res.request_info, res.history, status=res.status)
+                    MONITOR_RING.mark_down(monitor_ip)
+                    continue
+                primary_ip = (await res.text()).strip().strip("\"")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            error = e
+            MONITOR_RING.mark_down(monitor_ip)
+            continue
+        state_primary_update(function_name, primary_ip)
+        return primary_ip
+    raise error
+
+class AsyncStateRW:
+    """Help asyncio-based stateful functions access the state stored by DesFaaS, with the same
+    read, write and lock semantics as StateRW.
+
+    Attributes:
+        function_name(str): the state name stored in DesFaaS
+        read_url(str): the url to read state
+        primary_ip(str): the location of the master replica, resolved on first write
+        lock_token(int): the fencing token of the lease taken by the last locked read
+        lock_tokens(dict): the fencing tokens of the leases taken by the last locked read_many
+        cache(bool): whether unlocked reads use the in-process state cache
+    """
+
+    def __init__(self, function_name, cache=STATE_CACHE_ENABLED):
+        """Initial the AsyncStateRW class and constuct the url to read."""
+        if aiohttp is None:
+            raise ImportError("AsyncStateRW requires the aiohttp package")
+        self.function_name = function_name
+        self.cache = cache
+        self.read_url = f"http://{os.getenv('NodeIP')}:8054/state_read/{self.function_name}"
+        self.primary_ip = None
+        self.lock_token = None
+        self.lock_tokens = {}
+
+    async def state_primary_check(self):
+        """Search the master replica location of the funtion.
+
+        Returns:
+            A string of the ip address where the master replica is located.
+        """
+        if self.primary_ip is None:
+            self.primary_ip = await async_state_primary_search(self.function_name)
+        return self.primary_ip
+
+    async def state_read(self, locked=0):
+        """Read state data.
+
+        Args:
+            locked: 1 to lock the state until the next state_write
+
+        Returns:
+            state data
+        """
+        if self.cache and locked == 0:
+            return await self.state_read_cached()
+
+        data = {
+            'locked':  locked,
+            'identity': 1
+        }
+        async with async_session().get(self.read_url, **state_request_kwargs(data)) as res:
+            res.raise_for_status()
+            if locked == 1:
+                self.lock_token = int(res.headers['X-State-Lock-Token'])
+            return state_response_decode(await res.read(), res.headers)
+
+    async def state_read_cached(self):
+        """Read state data through the in-process cache shared with StateRW.
+
+        Returns:
+            state data
+        """
+        entry = STATE_CACHE.get(self.function_name)
+        if entry is not None and time.time() - entry[2] < STATE_CACHE_MAX_AGE:
+            STATE_CACHE.hits += 1
+            return copy.deepcopy(entry[1])
+
+        url = f"http://{os.getenv('NodeIP')}:8054/state_read_versioned/{self.function_name}"
+        data = {
+            'identity': 1,
+            'if_version': entry[0] if entry is not None else None
+        }
+        async with async_session().get(url, **state_request_kwargs(data)) as res:
+            res.raise_for_status()
+            msg = state_response_decode(await res.read(), res.headers)
+        if msg.get('not_modified'):
+            STATE_CACHE.hits += 1
+            STATE_CACHE.touch(self.function_name)
+            return copy.deepcopy(entry[1])
+
+        STATE_CACHE.misses += 1
+        STATE_CACHE.put(self.function_name, msg['version'], msg['state_data'])
+        return copy.deepcopy(msg['state_data'])
+
+    async def state_write(self, state_data):
+        """Write state data.
+
+        Args:
+            state_data
+
+        Raises:
+            StateStaleLeaseError: the lease of the locked read was taken over.
+            RuntimeError: the master replica failed to write the state.
+        """
+        data = {
+            'state_data':  state_data,
+            'identity': 1
+        }
+        if self.lock_token is not None:
+            data['token'] = self.lock_token
+            self.lock_token = None
+        STATE_CACHE.invalidate(self.function_name)
+        status, msg = await self.state_primary_post("state_write", data)
+        if status == 409:
+            raise StateStaleLeaseError(f"lease of state {self.function_name} was taken over")
+        if status >= 400:
+            raise RuntimeError(f"write of state {self.function_name} failed with status {status}: {msg}")
+
+    async def state_primary_post(self, path, data):
+        """Send a write request to the master replica, following redirects of stale masters.
+
+        Args:
+            path: the interface name, such as "state_write"
+            data: the request body
+
+        Returns:
+            A tuple of the response status and the response body.
+        """
+        await self.state_primary_check()
+        for hop in range(STATE_REDIRECT_HOPS):
+            url = f"http://{self.primary_ip}:8054/{path}/{self.function_name}"
+            async with async_session().post(url, **state_request_kwargs(data), allow_redirects=False) as res:
+                status, msg = res.status, state_response_decode(await res.read(), res.headers)
+            if status != 307:
+                break
+            self.primary_ip = msg['redirect']
+            state_primary_update(self.function_name, self.primary_ip)
+        return status, msg
+
+    async def state_lock_renew(self):
+        """Extend the lease of the state locked by state_read(locked=1).
+
+        Returns:
+            True if the lease was renewed, False if it had already expired.
+        """
+        url = f"http://{os.getenv('NodeIP')}:8054/state_lock_renew/{self.function_name}"
+        async with async_session().post(url, json={'token': self.lock_token, 'identity': 1}) as res:
+            return res.status == 200
+
+    async def state_read_versioned(self, primary=False):
+        """Read state data together with its version.
+
+        Args:
+            primary: read from the master replica instead of the local replica if True
+
+        Returns:
+            A tuple of the state data and its version.
+        """
+        node_ip = await self.state_primary_check() if primary else os.getenv('NodeIP')
+        url = f"http://{node_ip}:8054/state_read_versioned/{self.function_name}"
+        async with async_session().get(url, **state_request_kwargs({'locked': 0, 'identity': 1})) as res:
+            res.raise_for_status()
+            msg = state_response_decode(await res.read(), res.headers)
+        return msg['state_data'], msg['version']
+
+    async def state_compare_and_set(self, update, retries=STATE_CAS_RETRIES):
+        """Update state data optimistically without locking the state.
+
+        Args:
+            update: a function computing the new state data from the current state data
+            retries: the maximum number of attempts
+
+        Returns:
+            The state data written.
+
+        Raises:
+            RuntimeError: the state was changed by other writers in every attempt, or the
+                    master replica failed to write the state.
+        """
+        for attempt in range(retries):
+            state_data, version = await self.state_read_versioned(primary=True)
+            new_data = update(state_data)
+            data = {
+                'version': version,
+                'state_data': new_data,
+                'identity': 1
+            }
+            status, msg = await self.state_primary_post("state_cas", data)
+            if status == 200:
+                STATE_CACHE.invalidate(self.function_name)
+                return new_data
+            if not state_cas_conflict(status, msg):
+                raise RuntimeError(f"compare-and-set of state {self.function_name} failed with status {status}: {msg}")
+
+            # Back off exponentially before retrying
+            await asyncio.sleep(STATE_CAS_BACKOFF * 2 ** attempt)
+        raise RuntimeError(f"compare-and-set of state {self.function_name} failed after {retries} attempts")
+
+    async def read_many(self, function_names, locked=0):
+        """Read several states from the local node in one request.
+
+        Args:
+            function_names: the list of state names
+            locked: 1 to lock all the states until the next write_many
+
+        Returns:
+            A dict with state names as keys and state data as values.
+        """
+        url = f"http://{os.getenv('NodeIP')}:8054/state_mget"
+        data = {
+            'names': list(function_names),
+            'locked': locked,
+            'identity': 1
+        }
+        async with async_session().get(url, **state_request_kwargs(data)) as res:
+            res.raise_for_status()
+            msg = state_response_decode(await res.read(), res.headers)
+        if locked == 1:
+            self.lock_tokens = msg['tokens']
+        return msg['states']
+
+    async def write_many(self, states):
+        """Write several states, sending the requests to the master replica nodes concurrently.
+
+        Args:
+            states: a dict with state names as keys and the new state data as values
+
+        Returns:
+            A dict with state names as keys and the result of every write as values.
+
+        Raises:
+            StateStaleLeaseError: the lease of a locked read was taken over, the other states
+                    are written.
+            aiohttp.ClientResponseError: a master replica node failed to write its states.
+        """
+        results = {}
+        pending = dict(states)
+        for hop in range(STATE_REDIRECT_HOPS):
+            # Group the states by their master replica location
+            groups = {}
+            for function_name, state_data in pending.items():
+                primary_ip = await async_state_primary_search(function_name)
+                groups.setdefault(primary_ip, {})[function_name] = state_data
+
+            async def post_group(primary_ip, group):
+                data = {
+                    'states': group,
+                    'tokens': {name: self.lock_tokens[name] for name in group if name in self.lock_tokens},
+                    'identity': 1
+                }
+                for function_name in group:
+                    STATE_CACHE.invalidate(function_name)
+                async with async_session().post(f"http://{primary_ip}:8054/state_mset", **state_request_kwargs(data)) as res:
+                    res.raise_for_status()
+                    return group, state_response_decode(await res.read(), res.headers)
+
+            pending = {}
+            for group, msg in await asyncio.gather(*[post_group(ip, group) for ip, group in groups.items()]):
+                for function_name, result in msg.items():
+                    # Resend the states whose master replica has moved
+                    if isinstance(result, dict) and result.get('redirect'):
+                        state_primary_update(function_name, result['redirect'])
+                        pending[function_name] = group[function_name]
+                    results[function_name] = result
+            if not pending:
+                break
+        self.lock_tokens = {}
+        if state_stale_names(results):
+            raise StateStaleLeaseError(f"leases of states {state_stale_names(results)} were taken over")
+        return results